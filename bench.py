@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+
+# Benchmarks for nocomment.py. The micro-benchmarks time the current implementation
+# against a frozen copy of the code it replaced and check that both agree; the throughput
+# benchmark analyzes a generated corpus of target modules end to end.
+#
+# Every benchmark returns a dictionary of metrics, which can be saved as a baseline and
+# compared against on later runs. Metrics ending in _per_s are better when higher, the
+# rest (seconds, milliseconds and megabytes) when lower.
+#
+# Usage: python bench.py [--save-baseline FILE] [--baseline FILE] [benchmark ...]
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import nocomment
+
+NoneType = type(None)
+
+def legacy_prune(lines_, var_types_):
+    """The regex-based prune from before the token index: one search per pattern,
+    per variable, per line. Kept verbatim as the benchmark reference.
+
+    Given the source code of a function and a dictionary mapping parameter names to
+    dictionaries mapping types to numerical metrics, prunes the dictionary and returns
+    one with unlikely types removed from the dictionary corresponding to each variable
+    name.
+
+    lines_ - A list of strings representing lines in part of a Python source file.
+    var_types_ - A dictionary mapping strings of variable names to a dictionary mapping
+                 types to a numeric score indicating likelihood of the variable's type.
+    """
+    var_types = var_types_.copy()
+    reassigned = {v: False for v in var_types} # to keep track of reassignments
+    lines_t = []; lines = []
+    for l in lines_[1:]:
+        lines_t.append(str(re.sub("'(.)*'", "_", l)))
+    for l in lines_t:
+        lines.append(str(re.sub('"(.)*"', "_", l)))
+    int_methods = [ "bit_length" ]
+    float_methods = [ "as_integer_ratio", "is_integer", "hex", "fromhex" ]
+    string_methods = [  "capitalize", "center", "count", "decode", "encode", "endswith",
+                        "expandtabs", "find", "format", "index", "isalnum", "isdigit",
+                        "islower", "isspace", "istitle", "isupper", "join", "ljust",
+                        "lower", "lstrip", "partition", "replace", "rfind", "rindex",
+                        "rjust", "rpartition", "rsplit", "split", "splitlines",
+                        "startswith", "strip", "swapcase", "title", "translate",
+                        "upper", "zfill" ]
+    dict_methods = [ "clear", "copy", "fromkeys", "get", "has_key", "items", "iteritems",
+                     "iterkeys", "itervalues", "keys", "popitem", "setdefault", "update",
+                     "values", "viewitems", "viewvalues" ]
+
+    for var in var_types:
+        for line in lines:
+            # check for any reassignment, stop analysis for now if found
+            if re.search("( )+"+var+"( )*=", line) or re.match(var+"( )*=", line):
+                reassigned[var] = True
+            if not reassigned[var]:
+                # prune __getitem__ accessor, a.k.a []
+                if re.search(var+"( )*\[", line):
+                    if bool in var_types[var]: del var_types[var][bool]
+                    if int in var_types[var]: del var_types[var][int]
+                    if float in var_types[var]: del var_types[var][float]
+                    if NoneType in var_types[var]: del var_types[var][NoneType]
+                if re.search(var+"( )*\[( )*_\]", line):
+                    if str in var_types[var]: del var_types[var][str]
+                    if tuple in var_types[var]: del var_types[var][tuple]
+                    if list in var_types[var]: del var_types[var][list]
+                # prune __call__ operator, a.k.a ()
+                if re.search(var+"( )*\(", line):
+                    if bool in var_types[var]: del var_types[var][bool]
+                    if int in var_types[var]: del var_types[var][int]
+                    if float in var_types[var]: del var_types[var][float]
+                    if str in var_types[var]: del var_types[var][str]
+                    if tuple in var_types[var]: del var_types[var][tuple]
+                    if list in var_types[var]: del var_types[var][list]
+                    if dict in var_types[var]: del var_types[var][dict]
+                    if NoneType in var_types[var]: del var_types[var][NoneType]
+                # prune operators for each type
+                if re.search(var+"( )*(\+|\*)", line) or \
+                   re.search(        "(\+|\*)( )*"+var+"[^\[\(]", line):
+                    if NoneType in var_types[var]: del var_types[var][NoneType]
+                    if dict in var_types[var]: del var_types[var][dict]
+                if re.search(var+"( )*(\-|\/|\*\*)", line) or \
+                   re.search(        "(\-|\/|\*\*)( )*"+var+"[^\[\(]", line):
+                    if str in var_types[var]: del var_types[var][str]
+                    if tuple in var_types[var]: del var_types[var][tuple]
+                    if list in var_types[var]: del var_types[var][list]
+                    if dict in var_types[var]: del var_types[var][dict]
+                if re.search(var+"( )*(\^|%|&|\||<<|>>)", line) or \
+                   re.search(        "(\^|%|&|\||<<|>>)( )*"+var+"[^\[\(]", line):
+                    if str in var_types[var]: del var_types[var][str]
+                    if tuple in var_types[var]: del var_types[var][tuple]
+                    if list in var_types[var]: del var_types[var][list]
+                    if dict in var_types[var]: del var_types[var][dict]
+                    if float in var_types[var]: del var_types[var][float]
+                    if NoneType in var_types[var]: del var_types[var][NoneType]
+                # check sequence operators
+                if re.search("in( )*"+var, line):
+                    if bool in var_types[var]: del var_types[var][bool]
+                    if int in var_types[var]: del var_types[var][int]
+                    if float in var_types[var]: del var_types[var][float]
+                    if NoneType in var_types[var]: del var_types[var][NoneType]
+                if re.search("(len|min|max|list|next|enumerate|sorted|all|any|set|sum|tuple|zip)( )*\(( )*"+var, line):
+                    if bool in var_types[var]: del var_types[var][bool]
+                    if int in var_types[var]: del var_types[var][int]
+                    if float in var_types[var]: del var_types[var][float]
+                    if NoneType in var_types[var]: del var_types[var][NoneType]
+                if re.search(var+"( )*.( )*(append|extend|count|index|insert|pop|remove|reverse|sort)", line):
+                    if bool in var_types[var]: del var_types[var][bool]
+                    if int in var_types[var]: del var_types[var][int]
+                    if float in var_types[var]: del var_types[var][float]
+                    if NoneType in var_types[var]: del var_types[var][NoneType]
+                # look for string methods
+                for methodname in string_methods:
+                    if re.search(var+"( )*.( )*"+methodname, line):
+                        if str in var_types[var]:
+                            var_types[var] = {str : var_types[var][str]}
+                for methodname in int_methods:
+                    if re.search(var+"( )*.( )*"+methodname, line):
+                        if int in var_types[var]:
+                            var_types[var] = {int : var_types[var][int]}
+                for methodname in float_methods:
+                    if re.search(var+"( )*.( )*"+methodname, line):
+                        if float in var_types[var]:
+                            var_types[var] = {float : var_types[var][float]}
+                for methodname in dict_methods:
+                    if re.search(var+"( )*.( )*"+methodname, line):
+                        if dict in var_types[var]:
+                            var_types[var] = {dict : var_types[var][dict]}
+
+    return var_types
+
+
+def legacy_remove_comments(lines):
+    """The regex-based remove_comments from before the tokenizer: joins the lines and
+    strips triple-quoted strings with a greedy pattern, then cuts each line at the first
+    '#'. Kept verbatim as the benchmark reference.
+
+    lines - A list of strings representing lines in part of a Python source file.
+    """
+
+    # remove multi-line comments
+    single = "\n".join(map(lambda x: x[:-1], lines))
+    single = re.sub("'''(.|\n)*'''", "", single)
+    single = re.sub('"""(.|\n)*"""', '', single)
+
+    lines = single.split("\n")
+    return map(lambda x: x.split("#")[0], lines)
+
+
+def _synthetic_body(n_lines, var_names):
+    """Returns the lines of a generated function that uses each parameter in a rotating
+    mix of operators, accessors, builtins and method calls.
+
+    n_lines - The number of body lines to generate.
+    var_names - A list of strings representing the parameters of the generated function.
+    """
+    templates = [ "    x = {v} + 1 + y", "    x = 2 * {v} - y", "    x = {v}[i] or y",
+                  "    x = len({v}) + y", "    if y in {v}: pass", "    x = {v} % 3 + y",
+                  "    x = {v}.count(y)", "    x = {v}['key'] and y", "    x = y / {v} + 1" ]
+    lines = ["def generated(" + ", ".join(var_names) + "):"]
+    for ndx in range(n_lines):
+        template = templates[ndx % len(templates)]
+        lines.append(template.format(v=var_names[ndx % len(var_names)]))
+    return lines
+
+def bench_prune(n_lines=2000, repeat=3):
+    """Times legacy_prune against nocomment.prune on a long generated function."""
+    var_names = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot"]
+    lines = _synthetic_body(n_lines, var_names)
+    def fresh():
+        return {v: {t: 0 for t in nocomment.supported_types} for v in var_names}
+
+    same = legacy_prune(lines, fresh()) == nocomment.prune(lines, fresh())
+    old = min(timeit.repeat(lambda: legacy_prune(lines, fresh()), number=1, repeat=repeat))
+    new = min(timeit.repeat(lambda: nocomment.prune(lines, fresh()), number=1, repeat=repeat))
+    print("prune: %d lines, %d params" % (n_lines, len(var_names)))
+    print("  legacy  %8.4fs" % old)
+    print("  current %8.4fs  (%.1fx, identical results: %s)" % (new, old / new, same))
+    return {"prune.seconds": new}
+
+def _commented_file(n_lines):
+    """Returns the lines, with line endings, of a generated source file of functions with
+    docstrings, comments, and string literals containing '#'.
+
+    n_lines - The approximate number of lines to generate.
+    """
+    function = [ "def f{n}(a, b):\n",
+                 "    \"\"\"Returns a value for a and b.\n",
+                 "\n",
+                 "    a - '#' counts as text here.\n",
+                 "    \"\"\"\n",
+                 "    c = \"#%d\" % a  # format a\n",
+                 "    # the divisor is b\n",
+                 "    return len(c) / b\n",
+                 "\n" ]
+    lines = []
+    for n in range(n_lines // len(function) + 1):
+        lines.extend(line.format(n=n) for line in function)
+    return lines[:n_lines]
+
+def bench_remove_comments(n_lines=50000, repeat=3):
+    """Times legacy_remove_comments against nocomment.remove_comments on a long generated
+    file. The legacy version is not expected to agree: it removes the code between the
+    first and last docstring and cuts strings containing '#'."""
+    lines = _commented_file(n_lines)
+    old = min(timeit.repeat(lambda: legacy_remove_comments(lines), number=1, repeat=repeat))
+    new = min(timeit.repeat(lambda: nocomment.remove_comments(lines), number=1, repeat=repeat))
+    kept = len(nocomment.remove_comments(lines)) == len(lines)
+    print("remove_comments: %d lines" % n_lines)
+    print("  legacy  %8.4fs" % old)
+    print("  current %8.4fs  (line numbers kept: %s)" % (new, kept))
+    return {"remove_comments.seconds": new}
+
+# the statements generated function bodies are drawn from, by operator family; {a} and
+# {b} are replaced by parameters of the function
+operator_templates = {
+    "arithmetic": [ "    x = {a} + {b}", "    x = {a} * 2 - {b}", "    x = -{a} ** 2" ],
+    "division":   [ "    x = {a} / {b}", "    x = {a} // {b} % 7" ],
+    "sequence":   [ "    x = {a}[0]", "    x = len({a}) + 1", "    x = {b} in {a}",
+                    "    x = sorted({a})" ],
+    "string":     [ "    x = {a}.upper()", "    x = {a}.split({b})", "    x = {a}.strip() + {b}" ],
+    "dict":       [ "    x = {a}.get({b})", "    x = {a}.keys()", "    x = {a}.items()" ],
+    "call":       [ "    x = {a}({b})", "    x = {a}()" ]
+}
+default_mix = {"arithmetic": 3, "division": 1, "sequence": 2, "string": 2, "dict": 1, "call": 0}
+
+def generate_function(name, rng, arity, body_lines, mix, slow=False, hang=False):
+    """Returns the source lines of a generated function.
+
+    name - The name of the function.
+    rng - A random.Random to draw parameters and statements with.
+    arity - The number of parameters, p0 to p(arity - 1).
+    body_lines - The number of statements drawn from operator_templates.
+    mix - A dictionary mapping operator families to relative weights.
+    slow - Whether the function first spins through a long loop on every call.
+    hang - Whether the function never returns when its first parameter is True.
+    """
+    params = ["p%d" % n for n in range(arity)]
+    families = [f for f in sorted(mix) for _ in range(mix[f])]
+    lines = ["def %s(%s):" % (name, ", ".join(params))]
+    if slow:
+        lines.append("    for _ in range(20000): pass")
+    if hang:
+        lines.append("    while p0 is True: pass")
+    for _ in range(body_lines):
+        template = rng.choice(operator_templates[rng.choice(families)])
+        lines.append(template.format(a=rng.choice(params), b=rng.choice(params)))
+    lines.append("    return x" if body_lines else "    return " + params[0])
+    return lines
+
+def generate_corpus(directory, modules=4, functions=10, arity=(1, 8), body_lines=(2, 12),
+                    mix=None, slow=0.1, hang=0.0, seed=0):
+    """Writes generated target modules to a directory and returns their paths. The same
+    arguments always generate the same corpus.
+
+    directory - The directory to write the modules to.
+    modules - The number of modules.
+    functions - The number of functions per module.
+    arity - A (min, max) range of the number of parameters of each function.
+    body_lines - A (min, max) range of the number of statements of each function.
+    mix - A dictionary mapping operator families to relative weights, or None for default_mix.
+    slow - The fraction of functions that spin through a long loop on every call.
+    hang - The fraction of functions that never return for some arguments; only usable
+           with the sandbox executor.
+    seed - An integer seeding the generator.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for m in range(modules):
+        lines = []
+        for f in range(functions):
+            lines.extend(generate_function("f%d" % f, rng, rng.randint(*arity),
+                                           rng.randint(*body_lines), mix or default_mix,
+                                           rng.random() < slow, rng.random() < hang))
+            lines.append("")
+        path = os.path.join(directory, "target%d.py" % m)
+        with open(path, "w") as out:
+            out.write("\n".join(lines) + "\n")
+        paths.append(path)
+    return paths
+
+# the analysis modes of the throughput benchmark; every mode caps the probes per function
+# so that the exhaustive strategy stays tractable for eight parameters
+throughput_modes = [
+    ("exhaustive", {"sampling": "exhaustive", "budget": 2000}),
+    ("covering",   {"sampling": "covering", "budget": 2000}),
+    ("random",     {"sampling": "random", "budget": 500}),
+    ("sandbox",    {"sampling": "covering", "budget": 2000, "executor": "sandbox",
+                    "timeout": 0.05})
+]
+
+def _measure_mode(directory, options, queue):
+    """Analyzes every module in a directory and puts the StatsReport data, the elapsed time
+    and the peak resident set size of the process, in megabytes, on queue."""
+    report = nocomment.StatsReport()
+    start = timeit.default_timer()
+    for record in nocomment.analyze_paths([directory], options, report=report):
+        pass
+    elapsed = timeit.default_timer() - start
+    queue.put((report.to_json(), elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+def bench_throughput(**corpus):
+    """Analyzes a generated corpus in each of throughput_modes and reports functions and
+    probes per second, peak RSS and the time spent in each stage. Each mode runs in its own
+    process, so that peak RSS is measured per mode (sandbox workers are not included).
+    Functions that hang are only generated for the sandbox mode.
+
+    corpus - Keyword arguments for generate_corpus.
+    """
+    metrics = {}
+    for (name, options) in throughput_modes:
+        directory = tempfile.mkdtemp()
+        try:
+            sandboxed = options.get("executor") == "sandbox"
+            generate_corpus(directory, **dict(corpus, hang=0.1 if sandboxed else 0.0))
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_measure_mode, args=(directory, options, queue))
+            process.start()
+            data, elapsed, rss = queue.get()
+            process.join()
+        finally:
+            shutil.rmtree(directory)
+        totals = data["totals"]
+        probes = sum(totals["outcomes"].values())
+        prefix = "throughput.%s." % name
+        metrics[prefix + "functions_per_s"] = totals["functions"] / elapsed
+        metrics[prefix + "probes_per_s"] = probes / elapsed
+        metrics[prefix + "peak_rss_mb"] = rss
+        for (stage, seconds) in totals["timings"].items():
+            metrics[prefix + stage + ".seconds"] = seconds
+        print("throughput, %s: %d functions, %d probes (%d timed out) in %.2fs" %
+              (name, totals["functions"], probes, totals["outcomes"]["timeout"], elapsed))
+        print("  %8.1f functions/s %10.1f probes/s %8.1f MB peak RSS" %
+              (metrics[prefix + "functions_per_s"], metrics[prefix + "probes_per_s"], rss))
+        print("  " + "  ".join("%s %.3fs" % (stage, totals["timings"][stage])
+                               for stage in ["import"] + nocomment.profile_stages))
+    return metrics
+
+# command lines timed by bench_startup, as arguments to the interpreter
+startup_commands = [
+    ("interpreter", ["-c", "pass"]),
+    ("import", ["-c", "import nocomment"]),
+    ("help", ["-m", "nocomment", "--help"]),
+    ("script_help", ["nocomment.py", "--help"])
+]
+
+def bench_startup(repeat=10):
+    """Times each of startup_commands in a fresh interpreter, from starting it to its exit,
+    taking the fastest of repeat runs. Bytecode is cached as it would be for an installed
+    copy, in a temporary directory on Python 3.8+, by an untimed first run; a script run
+    as "python nocomment.py" is compiled on every run regardless. Startup times are
+    reported in milliseconds, since they fall under the noise floor of seconds."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    cache = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    metrics = {}
+    try:
+        print("startup (fastest of %d runs):" % repeat)
+        for (name, args) in startup_commands:
+            command = [sys.executable] + args
+            with open(os.devnull, "w") as devnull:
+                subprocess.check_call(command, cwd=here, env=env, stdout=devnull)
+                times = []
+                for _ in range(repeat):
+                    start = timeit.default_timer()
+                    subprocess.check_call(command, cwd=here, env=env, stdout=devnull)
+                    times.append(timeit.default_timer() - start)
+            metrics["startup.%s_ms" % name] = min(times) * 1000
+            print("  %-12s %8.1f ms" % (name, min(times) * 1000))
+    finally:
+        shutil.rmtree(cache)
+    return metrics
+
+benchmarks = {
+    "prune": bench_prune,
+    "remove_comments": bench_remove_comments,
+    "startup": bench_startup,
+    "throughput": bench_throughput
+}
+
+# timings shorter than this in the baseline are too noisy to be flagged as regressions
+noise_floor = 0.05
+
+def compare(metrics, baseline, tolerance):
+    """Prints each metric against its baseline value and returns the names of the metrics
+    that regressed by more than tolerance, a fraction of the baseline value. Timings under
+    noise_floor seconds in the baseline are printed but not flagged.
+
+    metrics - A dictionary mapping metric names to values.
+    baseline - A dictionary mapping metric names to baseline values.
+    tolerance - A number, e.g. 0.1 to allow metrics to be 10% worse than the baseline.
+    """
+    regressed = []
+    print("comparison with baseline:")
+    for name in sorted(metrics):
+        if not baseline.get(name):
+            continue
+        change = metrics[name] / baseline[name] - 1
+        worse = -change if name.endswith("_per_s") else change
+        flag = ""
+        noisy = name.endswith(".seconds") and baseline[name] < noise_floor
+        if worse > tolerance and not noisy:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        print("  %-45s %12.4f %12.4f %+7.1f%%%s" % (name, baseline[name], metrics[name],
+                                                    change * 100, flag))
+    return regressed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks nocomment.py.")
+    parser.add_argument("names", nargs="*", metavar="BENCHMARK",
+                        help="benchmarks to run (default: all of %s)" % ", ".join(sorted(benchmarks)))
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare against the metrics saved in FILE, failing on regressions")
+    parser.add_argument("--save-baseline", metavar="FILE", help="save the metrics to FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction by which a metric may be worse than the baseline "
+                             "(default: 0.2)")
+    args = parser.parse_args()
+    metrics = {}
+    for name in args.names or sorted(benchmarks):
+        if name not in benchmarks:
+            print("Unknown benchmark: " + name)
+        else:
+            metrics.update(benchmarks[name]())
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(metrics, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(metrics, json.load(f), args.tolerance)
+        if regressed:
+            sys.exit(1)
@@ -1,40 +1,130 @@
 #!/usr/bin/env python 
 
-import imp
-import inspect
+from __future__ import print_function
+
+import argparse
+import ast
+import collections
 import itertools
+import json
+import linecache
+import math
+import numbers
 import os
+import random
 import re
-import StringIO
+import signal
+import stat
+import struct
 import sys
+import textwrap
+import threading
+import time
+import tokenize
 import types
 
-def analyze(filepath, verbose=True):
-    """Analyzes the module-level methods in a Python source file and recommends documentation
-    for methods, which are printed to standard output.
+# cProfile, hashlib, inspect, multiprocessing, select and socket are imported by the
+# functions that use them: they take longer to import than the rest of the module, and
+# runs such as --help, --connect and --static need few of them
+
+try:
+    import cPickle as pickle
+except ImportError: # Python 3
+    import pickle
+
+try:
+    from StringIO import StringIO
+except ImportError: # Python 3
+    from io import StringIO
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+try:
+    import importlib.machinery
+    import importlib.util
+except ImportError: # Python 2
+    import imp
+    importlib = None
+
+if sys.version_info[0] >= 3:
+    unicode = str
+    xrange = range
+
+NoneType = type(None)
+
+def analyze(filepath, verbose=True, options=None, jobs=1, cache=None, pool=None, static=False,
+            report=None):
+    """Analyzes the module-level functions, and the methods of the module-level classes (see
+    class_results), in a Python source file and recommends documentation for them, which is
+    printed to standard output.
 
     filepath - A string indicating the location of the file to analyze.
     verbose - A boolean indicating whether to print the step-by-step processes of the analysis.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    jobs - An integer, the number of worker processes to probe functions with. The output
+           is the same for any number of jobs.
+    cache - A ResultCache to reuse the results of unchanged functions from, or None.
+    pool - A multiprocessing pool to probe functions with when jobs > 1, or None to start one.
+    static - A boolean indicating whether to analyze the source alone, without importing
+             the file (see static_recommendation). Files that cannot be imported are
+             always analyzed this way.
+    report - A StatsReport to add the file and its functions to, or None.
     """
-    mod = imp.load_source('mod', filepath)
-    functions = get_functions(mod)
+    start = time.time()
+    if not static:
+        try:
+            mod = load_source('mod', filepath)
+        except (Exception, SystemExit) as e:
+            print("Cannot import %s (%s), falling back to static analysis." %
+                  (filepath, _describe_exception(e)))
+            static = True
+    if report is not None:
+        report.add_file(filepath, time.time() - start)
+    functions = static_functions(filepath) if static else get_functions(mod)
+    methods = [] if static else [t for c in get_classes(mod) for t in class_targets(c)]
 
     if verbose:
-        print "Checking functions for missing docstrings..."
-        for f in functions:
-            print (" [missing]   " if f.__doc__ is None else "             ") + f.__name__
+        print("Checking functions for missing docstrings...")
+        for f in functions + methods:
+            print((" [missing]   " if f.__doc__ is None else "             ") + f.__name__)
+
+    if static:
+        results = static_results(functions)
+    else:
+        results = itertools.chain(file_results(filepath, functions, options, jobs, cache, pool),
+                                  class_results(methods, options, cache))
+    for (f, r, seconds) in results:
+        if report is not None:
+            report.add(make_record(filepath, f, r, seconds))
+        print("-"*80)
+        print(f.__name__)
+        print()
+        print(format_recommendation(r))
+    print("-"*80)
 
-    recommendations = {}
-    for function in functions:
-        recommendations[function] = generate_recommendation(function)
 
-    for (f, r) in recommendations.items():
-        print "-"*80
-        print f
-        print
-        print r
-    print "-"*80
+def load_source(name, filepath):
+    """Imports a Python source file as a module, which is added to sys.modules under name,
+    replacing any module of that name, and returns it. Exceptions raised by the file
+    propagate.
 
+    name - A string, the name of the module.
+    filepath - A string indicating the location of the file to import.
+    """
+    if importlib is None:
+        return imp.load_source(name, filepath)
+    loader = importlib.machinery.SourceFileLoader(name, filepath)
+    mod = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+    sys.modules[name] = mod
+    try:
+        loader.exec_module(mod)
+    except BaseException:
+        sys.modules.pop(name, None)
+        raise
+    return mod
 
 def get_functions(mod):
     """Extracts all module-level functions from a given module and
@@ -42,32 +132,582 @@ def get_functions(mod):
 
     mod - A module.
     """
+    import inspect
     functions = []
     for (name, method) in inspect.getmembers(mod, inspect.isfunction):
         functions.append(method)
     return functions
 
-def generate_recommendation(function):
+def get_classes(mod):
+    """Extracts the classes defined in a given module, rather than imported into it, and
+    returns them in a list, sorted by name.
+
+    mod - A module.
+    """
+    import inspect
+    return [c for (name, c) in inspect.getmembers(mod, inspect.isclass)
+            if c.__module__ == mod.__name__]
+
+# the most instances of a class kept to probe its methods with, and the most constructor
+# calls made to build them
+instance_pool_size = 4
+instance_pool_attempts = 50
+
+class MethodTarget(object):
+    """A constructor, method, static method or class method of a class, callable like a
+    function of its parameters other than self or cls, so that it is analyzed like a
+    module-level function. Has the __name__ ("Class.method"), __doc__ and __code__ of the
+    method, the underlying function (function), its kind ("constructor", "method",
+    "static" or "class") and the InstancePool of its class (pool).
+
+    Calling a constructor target constructs an instance and returns None, as __init__
+    does. Calling a method target calls the method on an instance from the pool.
+    """
+
+    def __init__(self, cls, function, kind, pool):
+        self.cls = cls
+        self.function = function
+        self.kind = kind
+        self.pool = pool
+        self.__name__ = "%s.%s" % (cls.__name__, function.__name__)
+        self.__doc__ = function.__doc__
+        self.__code__ = function.__code__
+        self.call = probe_callable(function, cls if kind == "constructor" else None)
+        # results of methods depend on the instances, i.e. on the class and constructor
+        init = _own_init(cls)
+        self.context = cls.__name__ + ("" if init is None else code_fingerprint(init.__code__))
+
+    def __call__(self, *args):
+        if self.kind == "constructor":
+            self.call(*args)
+            return None
+        if self.kind == "static":
+            return self.call(*args)
+        if self.kind == "class":
+            return self.call(self.cls, *args)
+        slot, instance = self.pool.take()
+        try:
+            return self.call(instance, *args)
+        finally:
+            self.pool.release(slot)
+
+class InstancePool(object):
+    """A bounded pool of instances of a class, constructed once and shared by the probes
+    of all its methods, in turn. An instance whose state a probe changes is replaced by a
+    new one constructed from the same arguments, so that later probes start from the
+    state the constructor leaves. State is compared by the repr of the instance's
+    attributes; instances without a __dict__ are never replaced.
+    """
+
+    def __init__(self, cls, size=instance_pool_size):
+        """cls - A class.
+        size - The most instances to keep.
+        """
+        self.cls = cls
+        self.construct = probe_callable(_own_init(cls), cls)
+        self.size = size
+        self.instances = [] # [instance, arguments, state] lists
+        self.filled = False
+        self.next = 0
+        self.refreshed = 0
+
+    def fill(self, var_names, inferred_types):
+        """Constructs up to size instances from sample values of the most likely type
+        inferred for each of the constructor's parameters, trying at most
+        instance_pool_attempts combinations. Instances built from less likely types would
+        make methods fail for reasons unrelated to their own parameters.
+
+        var_names - A list of the constructor's parameter names, other than self.
+        inferred_types - A dictionary mapping each parameter name to a list of (type, count)
+                         pairs, as in the results of recommend, or None if the constructor
+                         could not be typed.
+        """
+        self.filled = True
+        if not var_names:
+            candidates = [()]
+        else:
+            if inferred_types is None:
+                return
+            if not all(inferred_types[v] for v in var_names):
+                return
+            var_types = {v: dict(inferred_types[v][:1]) for v in var_names}
+            candidates = sample_type_values(var_names, var_types, "covering")
+        with silence_output():
+            for args in itertools.islice(candidates, instance_pool_attempts):
+                try:
+                    instance = self.construct(*fresh_arguments(args))
+                except (Exception, SystemExit):
+                    continue
+                self.instances.append([instance, args, _instance_state(instance)])
+                if len(self.instances) == self.size:
+                    break
+
+    def take(self):
+        """Returns a tuple of a slot number and the instance in it, taking slots in turn."""
+        slot = self.next % len(self.instances)
+        self.next += 1
+        return slot, self.instances[slot][0]
+
+    def release(self, slot):
+        """Replaces the instance in a slot if its state changed since it was constructed.
+        If constructing it again fails, the changed instance is kept."""
+        instance, args, state = self.instances[slot]
+        if state is None or _instance_state(instance) == state:
+            return
+        try:
+            instance = self.construct(*fresh_arguments(args))
+        except (Exception, SystemExit):
+            pass
+        self.instances[slot] = [instance, args, _instance_state(instance)]
+        self.refreshed += 1
+
+def _instance_state(instance):
+    """Returns a string describing the attributes of an instance, or None if it has none
+    or they cannot be described."""
+    try:
+        return repr(sorted(vars(instance).items()))
+    except Exception:
+        return None
+
+def _own_init(cls):
+    """Returns the function a class is initialized by, or None if it is object's."""
+    # an unbound method on Python 2, and missing from old-style classes without one
+    init = getattr(cls, "__init__", None)
+    init = getattr(init, "im_func", init)
+    return init if isinstance(init, types.FunctionType) else None
+
+def class_targets(cls):
+    """Returns a list of MethodTarget sharing one InstancePool for a class: its constructor,
+    if it has one other than object's, then the methods, static methods and class methods
+    defined in the class itself, sorted by name.
+
+    cls - A class.
+    """
+    pool = InstancePool(cls)
+    targets = []
+    init = _own_init(cls)
+    if init is not None:
+        targets.append(MethodTarget(cls, init, "constructor", pool))
+    for (name, attribute) in sorted(cls.__dict__.items()):
+        if name == "__init__":
+            continue
+        if isinstance(attribute, staticmethod) and name == "__new__":
+            # a static method that takes the class like a class method
+            targets.append(MethodTarget(cls, attribute.__func__, "class", pool))
+        elif isinstance(attribute, staticmethod):
+            targets.append(MethodTarget(cls, attribute.__func__, "static", pool))
+        elif isinstance(attribute, classmethod):
+            targets.append(MethodTarget(cls, attribute.__func__, "class", pool))
+        elif isinstance(attribute, types.FunctionType):
+            targets.append(MethodTarget(cls, attribute, "method", pool))
+    return targets
+
+def class_results(targets, options=None, cache=None):
+    """Generates a (target, result, seconds) tuple, as described by file_results, for each
+    of a list of MethodTarget, in order. A class's instance pool is filled after its
+    constructor has been analyzed, or before its first method if it has no constructor
+    of its own; methods of a class that cannot be constructed are not probed, and neither
+    are methods without source code, such as those generated by dataclasses and
+    namedtuple. Targets are always analyzed in this process, since their pools cannot be
+    shared with workers.
+
+    targets - A list of MethodTarget returned by class_targets.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    cache - A ResultCache to reuse the results of unchanged methods from, or None.
+    """
+    for target in targets:
+        start = time.time()
+        pool = target.pool
+        if target.kind == "method" and not pool.filled:
+            pool.fill([], None)
+        try:
+            lines, var_names = function_source(target)
+        except (IOError, OSError, TypeError) as e:
+            lines, var_names = [], probed_parameters(target)
+            stats = {"sampling": "no source (%s), no probes" % _describe_exception(e),
+                     "probes": 0}
+            result = make_result(lines, var_names, None, stats)
+        else:
+            if target.kind == "method" and not pool.instances:
+                stats = {"sampling": "no instances of %s, no probes" % target.cls.__name__,
+                         "probes": 0}
+                result = make_result(lines, var_names, None, stats)
+            else:
+                result = recommend(target, options, cache)
+        if target.kind == "constructor":
+            pool.fill(result["params"], result["types"])
+        yield target, result, time.time() - start
+
+def discover_files(paths):
+    """Generates the Python source files named by a list of paths: files are generated as
+    given, directories are searched recursively in sorted order, skipping hidden ones.
+
+    paths - A list of strings naming files and directories.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for (root, dirs, files) in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    yield os.path.join(root, name)
+
+def load_modules(filepaths):
+    """Generates a (filepath, module, error, seconds) tuple for each file in filepaths,
+    where module is the imported file, or None if importing it raised, in which case error
+    is a string describing the exception, and seconds is the time taken. Each file is
+    imported under its own module name, which is dropped from sys.modules once the next
+    file is requested, so that memory does not grow with the number of files.
+
+    filepaths - An iterable of strings naming Python source files.
+    """
+    for (ndx, filepath) in enumerate(filepaths):
+        name = "_nocomment_target_%d" % ndx
+        start = time.time()
+        try:
+            mod, error = load_source(name, filepath), None
+        except (Exception, SystemExit) as e:
+            mod, error = None, _describe_exception(e)
+        try:
+            yield filepath, mod, error, time.time() - start
+        finally:
+            sys.modules.pop(name, None)
+
+def file_results(filepath, functions, options=None, jobs=1, cache=None, pool=None):
+    """Generates a (function, result, seconds) tuple for each of the functions of a file,
+    in order, where result is as returned by recommend and seconds is the time spent
+    analyzing the function (in the worker processes, when jobs > 1).
+
+    filepath - A string indicating the location of the file the functions come from.
+    functions - The list of functions returned by get_functions for the file.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    jobs - An integer, the number of worker processes to probe functions with.
+    cache - A ResultCache to reuse the results of unchanged functions from, or None.
+    pool - A multiprocessing pool to probe functions with when jobs > 1, or None to start one.
+    """
+    if make_options(options)["propagate"]:
+        for item in propagated_results(filepath, functions, options, jobs, cache, pool):
+            yield item
+        return
+    if jobs > 1:
+        for item in parallel_recommendations(filepath, functions, options, jobs, cache, pool):
+            yield item
+        return
+    for function in functions:
+        start = time.time()
+        result = recommend(function, options, cache)
+        yield function, result, time.time() - start
+
+def analyze_paths(paths, options=None, jobs=1, cache=None, static=False, report=None):
+    """Generates one record (see make_record) per function, and per method of a class
+    (named "Class.method"), in the Python files found under paths, as soon as each function
+    has been analyzed. Files that cannot be imported are analyzed statically, and their
+    records carry an "import_error" key describing why; files that cannot be parsed either
+    generate one record with an "error" key. Files are discovered, loaded and analyzed
+    lazily, one at a time.
+
+    paths - A list of strings naming files and directories.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    jobs - An integer, the number of worker processes to probe functions with.
+    cache - A ResultCache to reuse the results of unchanged functions from, or None.
+    static - A boolean indicating whether to analyze every file without importing it.
+    report - A StatsReport to add the files and the records to, or None.
+    """
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs) if jobs > 1 and not static else None
+    filepaths = discover_files(paths)
+    if static:
+        loaded = ((filepath, None, None, 0.0) for filepath in filepaths)
+    else:
+        loaded = load_modules(filepaths)
+    try:
+        for (filepath, mod, error, seconds) in loaded:
+            if report is not None:
+                report.add_file(filepath, seconds)
+            for record in file_records(filepath, mod, error, options, jobs, cache, pool):
+                if report is not None:
+                    report.add(record)
+                yield record
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def file_records(filepath, mod, error, options=None, jobs=1, cache=None, pool=None,
+                 names=None):
+    """Generates the records of analyze_paths for one file.
+
+    filepath - A string indicating the location of the file.
+    mod - The imported file, or None to analyze it statically.
+    error - A string describing why the file could not be imported, or None.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    jobs - An integer, the number of worker processes to probe functions with.
+    cache - A ResultCache to reuse the results of unchanged functions from, or None.
+    pool - A multiprocessing pool to probe functions with when jobs > 1, or None to start one.
+    names - A collection of the names of the functions and classes to analyze, or None
+            for all of them (see file_units).
+    """
+    if mod is None:
+        try:
+            functions = static_functions(filepath)
+        except (SyntaxError, TypeError, IOError) as e:
+            yield {"file": filepath, "error": error or _describe_exception(e)}
+            return
+        if names is not None:
+            functions = [f for f in functions if f.__name__ in names]
+        results = static_results(functions)
+    else:
+        functions = get_functions(mod)
+        classes = get_classes(mod)
+        if names is not None:
+            functions = [f for f in functions if f.__name__ in names]
+            classes = [c for c in classes if c.__name__ in names]
+        methods = [t for c in classes for t in class_targets(c)]
+        results = itertools.chain(file_results(filepath, functions, options, jobs, cache, pool),
+                                  class_results(methods, options, cache))
+    for (f, result, seconds) in results:
+        record = make_record(filepath, f, result, seconds)
+        if error is not None:
+            record["import_error"] = error
+        yield record
+
+def _describe_exception(e):
+    """Returns a one-line string naming an exception and its message."""
+    return "%s: %s" % (type(e).__name__, e)
+
+def make_record(filepath, function, result, seconds):
+    """Returns a JSON-serializable dictionary describing the analysis of a function, with
+    the keys of make_result (types named by stringify_type) plus:
+        file     - the path of the file the function is defined in.
+        qualname - the name of the function.
+        docstring - whether the function has a docstring.
+        seconds  - the time spent analyzing the function.
+
+    filepath - A string indicating the location of the file the function comes from.
+    function - A function.
+    result - A dictionary returned by recommend for the function.
+    seconds - A number, the time spent analyzing the function.
+    """
+    record = _result_to_json(result)
+    record.update({"file": filepath, "qualname": function.__name__,
+                   "docstring": function.__doc__ is not None, "seconds": round(seconds, 6)})
+    return record
+
+def emit_jsonl(records, out=None):
+    """Writes each record as one line of JSON, flushing after each, so that consumers can
+    read the results while the analysis is still running.
+
+    records - An iterable of JSON-serializable dictionaries.
+    out - A file to write to, or None for standard output.
+    """
+    out = sys.stdout if out is None else out
+    for record in records:
+        out.write(json.dumps(record, sort_keys=True) + "\n")
+        out.flush()
+
+class StatsReport(object):
+    """Collects the statistics of an analysis run into a JSON report with the keys:
+        files     - a list of {file, import} entries, import being the seconds spent
+                    importing the file.
+        functions - a list of {file, qualname, seconds, probes, outcomes, pruned, timings,
+                    slowest, duplicate_of} entries, with the statistics of each function's
+                    record (see count_types, new_profile and DedupCache); timings and
+                    slowest are missing for results reused from the cache or found
+                    statically, duplicate_of for results not reused from a duplicate.
+        totals    - the number of files, functions and deduplicated functions, and the
+                    seconds of each stage (import and profile_stages), outcomes and pruned
+                    pairs, summed.
+        slowest   - the slowest probes of the run, as [seconds, file, qualname, arguments].
+    """
+
+    def __init__(self):
+        self.files = []
+        self.functions = []
+
+    def add_file(self, filepath, seconds):
+        """Adds a file that took seconds to import."""
+        self.files.append({"file": filepath, "import": round(seconds, 6)})
+
+    def add(self, record):
+        """Adds a record returned by make_record."""
+        if "error" in record:
+            return
+        stats = record["stats"]
+        entry = {"file": record["file"], "qualname": record["qualname"],
+                 "seconds": record["seconds"], "probes": stats.get("probes", 0),
+                 "outcomes": stats.get("outcomes", {}), "pruned": stats.get("pruned", 0)}
+        if "profile" in stats:
+            entry["timings"] = {s: round(t, 6) for (s, t) in stats["profile"]["timings"].items()}
+            entry["slowest"] = [[round(t, 6), args] for (t, args) in stats["profile"]["slowest"]]
+        if "duplicate_of" in stats:
+            entry["duplicate_of"] = stats["duplicate_of"]
+        self.functions.append(entry)
+
+    def to_json(self):
+        """Returns the report as a JSON-serializable dictionary."""
+        timings = {s: 0.0 for s in ["import"] + profile_stages}
+        outcomes = {o: 0 for o in probe_outcomes}
+        slowest = []
+        for f in self.files:
+            timings["import"] += f["import"]
+        for f in self.functions:
+            for (s, t) in f.get("timings", {}).items():
+                timings[s] += t
+            for (o, n) in f["outcomes"].items():
+                outcomes[o] += n
+            slowest.extend([t, f["file"], f["qualname"], args] for (t, args) in f.get("slowest", []))
+        slowest.sort(key=lambda probe: -probe[0])
+        totals = {"files": len(self.files), "functions": len(self.functions),
+                  "deduplicated": sum("duplicate_of" in f for f in self.functions),
+                  "timings": {s: round(t, 6) for (s, t) in timings.items()},
+                  "outcomes": outcomes, "pruned": sum(f["pruned"] for f in self.functions)}
+        return {"files": self.files, "functions": self.functions, "totals": totals,
+                "slowest": slowest[:slowest_probes]}
+
+    def write(self, path):
+        """Writes the report to a file as indented JSON."""
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+def generate_recommendation(function, options=None, cache=None):
     """Returns a multi-line string describing some recommended specifications
     for the given function.
 
     function - A function.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    cache - A ResultCache to reuse the result from if the function is unchanged, or None.
     """
-    body = ""
-    lines = remove_comments(inspect.getsourcelines(function)[0])
-    var_names = inspect.getargspec(function).args
+    return format_recommendation(recommend(function, options, cache))
 
-    infer_types_retval = infer_types(function, lines, var_names)
-    if infer_types_retval is None:
-        return "Cannot determine typing."
-    else:
-        tp, returnarg = infer_types_retval
+def recommend(function, options=None, cache=None, assumed={}):
+    """Returns the result of analyzing a function, as described by make_result.
+
+    function - A function.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    cache - A ResultCache to reuse the result from if the function is unchanged, or None.
+    assumed - A dictionary mapping some parameter names to the collection of types they
+              are limited to (see candidate_types).
+    """
+    start = time.time()
+    lines, var_names = function_source(function)
+    source_seconds = time.time() - start
+    if cache is not None:
+        key = cache.key(function, lines, options, assumed)
+        result = cache.get(key)
+        if result is not None:
+            return result
+    stats = {"profile": new_profile()}
+    stats["profile"]["timings"]["source"] = source_seconds
+    inferred = infer_types(function, lines, var_names, assumed, options=options, stats=stats)
+    result = make_result(lines, var_names, inferred, stats)
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+def function_source(function):
+    """Returns a tuple of the function's source lines, with comments removed and dedented,
+    and the list of its parameter names (without self or cls for a MethodTarget).
+
+    function - A function or MethodTarget.
+    """
+    import inspect
+    source = textwrap.dedent("".join(inspect.getsourcelines(getattr(function, "function",
+                                                                    function))[0]))
+    lines = remove_comments(source.splitlines(True))
+    return lines, probed_parameters(function)
+
+def probed_parameters(function):
+    """Returns the list of the parameter names of a function that are probed (see
+    parameter_names), without self or cls for a MethodTarget.
+
+    function - A function or MethodTarget.
+    """
+    if not isinstance(function, MethodTarget):
+        return parameter_names(function)
+    args = parameter_names(function.function)
+    return args if function.kind == "static" else args[1:]
+
+def parameter_names(function):
+    """Returns the names of the parameters of a function that are probed: the positional
+    ones, then the keyword-only ones. Parameters with defaults are probed like the others;
+    *args and **kwargs are not probed.
+
+    function - A function.
+    """
+    import inspect
+    signature = getattr(inspect, "signature", None)
+    if signature is None: # Python 2
+        return inspect.getargspec(function).args
+    kinds = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD,
+             inspect.Parameter.KEYWORD_ONLY)
+    return [p.name for p in signature(function).parameters.values() if p.kind in kinds]
+
+def probe_callable(function, cls=None):
+    """Returns a function that calls function with the values of the parameters named by
+    parameter_names, in that order, passed positionally: function itself, unless it has
+    keyword-only parameters, which are then passed by keyword.
+
+    function - A function, or any callable (which is returned as is).
+    cls - A class whose constructor function is (see _own_init), to construct instances of
+          from the values of the parameters other than self instead of calling function,
+          or None.
+    """
+    import inspect
+    target = function if cls is None else cls
+    signature = getattr(inspect, "signature", None)
+    if signature is None or not isinstance(function, types.FunctionType):
+        return target
+    names = parameter_names(function)
+    keywords = [p.name for p in signature(function).parameters.values()
+                if p.kind == inspect.Parameter.KEYWORD_ONLY]
+    if not keywords:
+        return target
+    count = len(names) - len(keywords) - (cls is not None) # without self
+    def call(*args):
+        return target(*args[:count], **dict(zip(keywords, args[count:])))
+    return call
+
+def make_result(lines, var_names, inferred, stats):
+    """Returns a dictionary describing the analysis of a function, with the keys:
+        params   - the list of parameter names.
+        types    - a dictionary mapping each parameter name to a list of (type, count)
+                   pairs, most likely first, or None if the typing cannot be determined.
+        returns  - a list of (type, count) pairs for the return value.
+        divisors - the list of parameters used as denominators (see find_zero_denominators).
+        zero_divisions - the list of parameters that probes raised ZeroDivisionError by
+                   dividing by (see count_types).
+        stats    - the dictionary of statistics filled in by infer_types.
 
+    lines - A list of strings representing the function's source lines, without comments.
+    var_names - A list of strings representing the variable names used in the parameters.
+    inferred - The value returned by infer_types for the function.
+    stats - The dictionary of statistics filled in by infer_types.
+    """
     zd_data = find_zero_denominators(lines, var_names)
-    zd = {v: (v in zd_data) for v in var_names}
+    tp, returnarg = inferred if inferred is not None else (None, [])
+    return {"params": list(var_names), "types": tp, "returns": returnarg,
+            "divisors": [v for v in var_names if v in zd_data],
+            "zero_divisions": [v for v in var_names if v in stats.get("zero_divisions", [])],
+            "stats": stats}
 
-    for v in var_names:
-        div = " (divisor)" if zd[v] else ""
+def format_recommendation(result):
+    """Returns the multi-line string described by generate_recommendation.
+
+    result - A dictionary returned by make_result.
+    """
+    body = ""
+    if result["types"] is None:
+        return "Cannot determine typing."
+    tp, returnarg = result["types"], result["returns"]
+
+    for v in result["params"]:
+        if v in result["zero_divisions"]:
+            div = " (divisor, raised ZeroDivisionError)"
+        else:
+            div = " (divisor)" if v in result["divisors"] else ""
         buf = ""
         for type_, metric in tp[v]:
             buf += stringify_type(type_) + ", "
@@ -78,54 +718,1391 @@ def generate_recommendation(function):
     for type_, metric in returnarg:
         body += stringify_type(type_) + ", "
 
+    body += "\nSampling: " + result["stats"]["sampling"]
+    if "duplicate_of" in result["stats"]:
+        body += "\nDuplicate of: " + result["stats"]["duplicate_of"]
     return body
 
-supported_types = [types.BooleanType, types.IntType, types.FloatType,
-                   types.StringType, types.TupleType, types.ListType,
-                   types.DictType, types.NoneType]
+class StaticFunction(object):
+    """A module-level function found by parsing a source file rather than importing it.
+    Has the __name__ and __doc__ of the function, its source lines with comments removed
+    (lines), its parameter names (var_names) and its ast.FunctionDef node (node)."""
+
+    def __init__(self, node, lines):
+        self.__name__ = node.name
+        self.__doc__ = ast.get_docstring(node, clean=False)
+        self.node = node
+        self.lines = remove_comments(lines)
+        self.var_names = sum(_parameter_nodes(node.args), [])
+
+def _parameter_nodes(arguments):
+    """Returns a tuple of the lists of the names of the positional and of the keyword-only
+    parameters in an ast.arguments node, as parameter_names would. Parameters unpacked from
+    tuples (Python 2) are left out.
+
+    arguments - An ast.arguments.
+    """
+    def names(nodes):
+        # Python 2 parameters are ast.Name nodes, Python 3 ones ast.arg nodes
+        return [getattr(a, "arg", getattr(a, "id", None)) for a in nodes
+                if not isinstance(a, ast.Tuple)]
+    positional = getattr(arguments, "posonlyargs", []) + arguments.args
+    return names(positional), names(getattr(arguments, "kwonlyargs", []))
+
+def static_functions(filepath):
+    """Returns a list of StaticFunction for the functions defined at the top level of a
+    Python source file, in the order of get_functions, without executing the file.
+    Raises SyntaxError if the file cannot be parsed.
+
+    filepath - A string indicating the location of the file to parse.
+    """
+    with open(filepath) as f:
+        source = f.read()
+    body = ast.parse(source, filepath).body
+    lines = [line if line.endswith("\n") else line + "\n" for line in source.splitlines(True)]
+    functions = []
+    for (ndx, node) in enumerate(body):
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        start = _first_line(node) - 1
+        end = _first_line(body[ndx + 1]) - 1 if ndx + 1 < len(body) else len(lines)
+        # the next statement's line number is past any comments and blank lines after
+        # the function, which inspect.getsourcelines leaves out
+        while end > start + 1 and lines[end - 1].split("#")[0].strip() == "":
+            end -= 1
+        functions.append(StaticFunction(node, lines[start:end]))
+    return sorted(functions, key=lambda f: f.__name__)
+
+def _first_line(node):
+    """Returns the line number a statement starts on, counting its decorators, which
+    Python 3.8 and later leave out of the node's lineno."""
+    return min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", ())])
+
+def static_results(functions):
+    """Generates (function, result, seconds) tuples, as described by file_results, for a
+    list of StaticFunction.
+
+    functions - A list of StaticFunction returned by static_functions.
+    """
+    for function in functions:
+        start = time.time()
+        result = static_recommendation(function)
+        yield function, result, time.time() - start
+
+def static_recommendation(function):
+    """Returns the result of analyzing a function from its source alone, as described by
+    make_result. Every type that survives pruning is counted once for its parameter, and
+    return types are counted once per return statement whose value has an evident type
+    (see static_return_types).
+
+    function - A StaticFunction.
+    """
+    lines, var_names = function.lines, function.var_names
+    stats = {"sampling": "static, no probes", "probes": 0}
+    var_types = candidate_types(lines, var_names, stats=stats)
+    if var_types is None:
+        return make_result(lines, var_names, None, stats)
+    var_types = {v: {t: 1 for t in var_types[v]} for v in var_names}
+    return_types = static_return_types(function.node, var_types)
+    return make_result(lines, var_names, rank_types(var_names, var_types, return_types), stats)
+
+def static_return_types(node, var_types):
+    """Returns a dictionary mapping types to the number of return statements of a function
+    that may return them, judging by the syntax of the returned expression: literals,
+    displays, comparisons, string concatenation and formatting, and parameters (with
+    their candidate types) are recognized.
+    A function without return statements returns None.
+
+    node - An ast.FunctionDef.
+    var_types - A dictionary mapping parameter names to dictionaries keyed by their
+                candidate types.
+    """
+    displays = {ast.Tuple: tuple, ast.List: list,
+                ast.ListComp: list, ast.Dict: dict,
+                ast.DictComp: dict, ast.Compare: bool}
+    counts = {t: 0 for t in supported_types}
+    returns = _return_nodes(node.body)
+    for value in (r.value for r in returns):
+        if value is None:
+            found = [NoneType]
+        elif isinstance(value, ast.Name) and value.id in var_types:
+            found = list(var_types[value.id])
+        elif _literal_type(value) is not None:
+            found = [_literal_type(value)]
+        elif isinstance(value, ast.UnaryOp) and isinstance(value.op, ast.Not):
+            found = [bool]
+        elif isinstance(value, ast.BinOp) and str in (_literal_type(value.left),
+                                                       _literal_type(value.right)):
+            # concatenation and %-formatting of a string literal
+            found = [str]
+        else:
+            found = [displays[type(value)]] if type(value) in displays else []
+        for t in found:
+            if t in counts:
+                counts[t] += 1
+    if not returns:
+        counts[NoneType] = 1
+    return counts
+
+# literal nodes and the attribute holding their value; Python 3.8 parses every literal
+# as ast.Constant, and deprecates the older nodes
+if sys.version_info >= (3, 8):
+    _literal_nodes = [(ast.Constant, "value")]
+else:
+    _literal_nodes = [(getattr(ast, name), attribute) for (name, attribute) in
+                      [("NameConstant", "value"), ("Num", "n"), ("Str", "s")]
+                      if hasattr(ast, name)]
+# names of the Python 2 literals that are not keywords
+_literal_names = {"True": bool, "False": bool, "None": NoneType}
+
+def _literal_type(node):
+    """Returns the type of a literal number, string, True, False or None, or None if the
+    node is not one."""
+    if isinstance(node, ast.Name):
+        return _literal_names.get(node.id)
+    for (kind, attribute) in _literal_nodes:
+        if isinstance(node, kind):
+            return type(getattr(node, attribute))
+    return None
+
+# the parts of compound statements that hold statements, besides bodies and orelse
+_clause_nodes = tuple(getattr(ast, name) for name in ("excepthandler", "match_case")
+                      if hasattr(ast, name))
+
+def _return_nodes(statements):
+    """Returns the ast.Return nodes in a list of statements, excluding those of nested
+    functions and classes."""
+    found = []
+    for statement in statements:
+        if isinstance(statement, ast.Return):
+            found.append(statement)
+        elif not isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+            for child in ast.iter_child_nodes(statement):
+                if isinstance(child, ast.stmt):
+                    found.extend(_return_nodes([child]))
+                elif isinstance(child, _clause_nodes):
+                    found.extend(_return_nodes(child.body))
+    return found
+
+# the most rounds a strongly connected group of functions is analyzed for by
+# propagated_results before its assumed types are taken as settled
+fixpoint_rounds = 4
+
+def call_graph(filepath):
+    """Returns a dictionary mapping the name of each function defined at the top level of a
+    Python source file to a list of (callee, arguments) pairs, one per call it makes to
+    another such function on every run, where arguments is a dictionary mapping the
+    caller's parameters passed straight to the callee to the callee's parameters. Calls
+    under conditions (if, loops, try, and/or, conditional expressions, lambdas and
+    comprehensions) and parameters that are reassigned are left out. Raises SyntaxError if
+    the file cannot be parsed.
+
+    filepath - A string indicating the location of the file to parse.
+    """
+    with open(filepath) as f:
+        body = ast.parse(f.read(), filepath).body
+    nodes = {node.name: node for node in body if isinstance(node, ast.FunctionDef)}
+    params = {name: _parameter_nodes(node.args) for (name, node) in nodes.items()}
+    graph = {}
+    for (name, node) in nodes.items():
+        passed = set(sum(params[name], [])) - _assigned_names(node)
+        graph[name] = []
+        for call in _unconditional_calls(node.body):
+            if not isinstance(call.func, ast.Name) or call.func.id not in nodes:
+                continue
+            positional, keyword_only = params[call.func.id]
+            callee_params = positional + keyword_only
+            arguments = {}
+            # positions are unknown past a *args argument (Python 3)
+            given = itertools.takewhile(lambda a: not isinstance(a, _starred), call.args)
+            for (ndx, arg) in enumerate(list(given)[:len(positional)]):
+                if isinstance(arg, ast.Name) and arg.id in passed:
+                    arguments[arg.id] = positional[ndx]
+            for keyword in call.keywords:
+                if isinstance(keyword.value, ast.Name) and keyword.value.id in passed and \
+                   keyword.arg in callee_params:
+                    arguments[keyword.value.id] = keyword.arg
+            graph[name].append((call.func.id, arguments))
+    return graph
+
+def _assigned_names(node):
+    """Returns the set of names bound anywhere in a function other than by its parameters."""
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and isinstance(child.ctx, (ast.Store, ast.Del)):
+            names.add(child.id)
+        elif isinstance(child, (ast.FunctionDef, ast.ClassDef)) and child is not node:
+            names.add(child.name)
+    return names
+
+# statements and expressions whose parts need not be evaluated on every run; try
+# statements are TryExcept and TryFinally on Python 2, Try and TryStar on Python 3
+_branching_statements = tuple(getattr(ast, name) for name in
+                              ("If", "For", "While", "Try", "TryStar", "TryExcept",
+                               "TryFinally", "With", "Match", "AsyncFor", "AsyncWith",
+                               "FunctionDef", "AsyncFunctionDef", "ClassDef")
+                              if hasattr(ast, name))
+_starred = getattr(ast, "Starred", ())
+_branching_expressions = (ast.IfExp, ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp,
+                          ast.GeneratorExp)
+
+def _unconditional_calls(statements):
+    """Generates the ast.Call nodes that run whenever a block of statements does, up to
+    the first statement that may leave the block. Calls inside branching statements are
+    skipped."""
+    def visit(node):
+        if isinstance(node, _branching_expressions):
+            return
+        if isinstance(node, ast.BoolOp):
+            # only the first operand is always evaluated
+            for call in visit(node.values[0]):
+                yield call
+            return
+        if isinstance(node, ast.Call):
+            yield node
+        for child in ast.iter_child_nodes(node):
+            for call in visit(child):
+                yield call
+    leaving = (ast.Return, ast.Raise, ast.Break, ast.Continue)
+    for statement in statements:
+        if isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+            continue
+        if isinstance(statement, _branching_statements):
+            if any(isinstance(node, leaving) for node in ast.walk(statement)):
+                return
+            continue
+        for call in visit(statement):
+            yield call
+        if isinstance(statement, leaving):
+            return
+
+def strongly_connected(graph):
+    """Returns the strongly connected components of a graph as lists of nodes, ordered so
+    that every component comes after the components it has edges to (Tarjan's algorithm).
+
+    graph - A dictionary mapping each node to a list of (node, label) edges.
+    """
+    index, lowlink, stack, on_stack, components = {}, {}, [], set(), []
+    def visit(node):
+        index[node] = lowlink[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for (successor, label) in graph[node]:
+            if successor not in index:
+                visit(successor)
+                lowlink[node] = min(lowlink[node], lowlink[successor])
+            elif successor in on_stack:
+                lowlink[node] = min(lowlink[node], index[successor])
+        if lowlink[node] == index[node]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == node:
+                    break
+            components.append(sorted(component))
+    for node in sorted(graph):
+        if node not in index:
+            visit(node)
+    return components
+
+def callee_assumptions(name, graph, results):
+    """Returns the dictionary of assumed types (see candidate_types) for a function: each
+    parameter it passes to an analyzed callee is limited to the types inferred for the
+    callee's parameter, intersected over every such callee. A callee's parameter whose
+    typing is undetermined, or may be cut short by rank_types, limits nothing.
+
+    name - The name of the function.
+    graph - A dictionary returned by call_graph.
+    results - A dictionary mapping function names to results returned by recommend.
+    """
+    assumed = {}
+    for (callee, arguments) in graph[name]:
+        if callee not in results or results[callee]["types"] is None:
+            continue
+        for (param, callee_param) in arguments.items():
+            pairs = results[callee]["types"][callee_param]
+            if 0 < len(pairs) < 5: # rank_types keeps the top 5
+                found = set(t for (t, n) in pairs)
+                assumed[param] = assumed.get(param, found) & found
+    return {p: [t for t in supported_types if t in ts] for (p, ts) in assumed.items() if ts}
+
+def propagated_results(filepath, functions, options=None, jobs=1, cache=None, pool=None):
+    """Generates (function, result, seconds) tuples, as described by file_results, analyzing
+    callees before their callers so that each caller starts from the types inferred for the
+    parameters it passes on (see call_graph and callee_assumptions). Functions that call
+    each other are analyzed again with the assumptions from the last round until they stop
+    changing, for at most fixpoint_rounds rounds. Independent functions are analyzed
+    together, in worker processes when jobs > 1, and the tuples are generated in the order
+    of functions once all are done.
+
+    The arguments are those of file_results.
+    """
+    by_name = {f.__name__: f for f in functions}
+    try:
+        graph = call_graph(filepath)
+    except (SyntaxError, TypeError, IOError):
+        graph = {}
+    graph = {name: [(c, a) for (c, a) in graph.get(name, []) if c in by_name] for name in by_name}
+    components = strongly_connected(graph)
+    component_of = {name: ndx for (ndx, c) in enumerate(components) for name in c}
+    level = []
+    for (ndx, component) in enumerate(components):
+        level.append(max([0] + [level[component_of[callee]] + 1 for name in component
+                                for (callee, arguments) in graph[name]
+                                if component_of[callee] != ndx]))
+    cyclic = set(name for name in graph if len(components[component_of[name]]) > 1 or
+                 any(callee == name for (callee, arguments) in graph[name]))
+
+    results, seconds, previous = {}, {}, {}
+    for current in sorted(set(level)):
+        pending = [name for (ndx, c) in enumerate(components) if level[ndx] == current
+                   for name in c]
+        for _ in range(fixpoint_rounds):
+            assumed = {name: callee_assumptions(name, graph, results) for name in pending}
+            pending = [name for name in pending
+                       if name not in results or assumed[name] != previous[name]]
+            if not pending:
+                break
+            batch = [by_name[name] for name in pending]
+            if jobs > 1:
+                items = parallel_recommendations(filepath, batch, options, jobs, cache, pool,
+                                                 [assumed[name] for name in pending])
+            else:
+                items = _timed_recommendations(batch, options, cache, assumed)
+            for (function, result, s) in items:
+                results[function.__name__] = result
+                seconds[function.__name__] = seconds.get(function.__name__, 0.0) + s
+            previous.update(assumed)
+            pending = [name for name in pending if name in cyclic]
+    for function in functions:
+        yield function, results[function.__name__], seconds[function.__name__]
+
+def _timed_recommendations(functions, options, cache, assumed):
+    """Generates (function, result, seconds) tuples for functions analyzed by recommend in
+    this process, with the assumed types of each from a dictionary keyed by name."""
+    for function in functions:
+        start = time.time()
+        result = recommend(function, options, cache, assumed[function.__name__])
+        yield function, result, time.time() - start
+
+# functions with at least this many probes are split across every worker
+shard_threshold = 10000
+
+# the target file and module last loaded by a worker process of parallel_recommendations
+_worker_file = None
+_worker_mod = None
+
+def parallel_recommendations(filepath, functions, options, jobs, cache=None, pool=None,
+                             assumed=None):
+    """Generates (function, result, seconds) tuples, as described by file_results, by
+    probing the functions in a pool of worker processes, each of which imports the file
+    once. Functions with at least shard_threshold probes are split into one shard per
+    worker and their counts merged (unless the adaptive, early_stop or coverage options are
+    on), so the results are the same as those of recommend. Functions with the same cache
+    key are probed once.
+
+    filepath - A string indicating the location of the file the functions come from.
+    functions - The list of functions returned by get_functions for the file.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    jobs - An integer, the number of worker processes.
+    cache - A ResultCache to reuse the results of unchanged functions from, or None.
+    pool - A multiprocessing pool of jobs processes to use, or None to start one.
+    assumed - A list of the dictionaries of assumed types of each function (see recommend),
+              or None for none.
+    """
+    import multiprocessing
+    options = make_options(options)
+    assumed = assumed or [{}] * len(functions)
+    sources = []
+    source_seconds = []
+    for function in functions:
+        start = time.time()
+        sources.append(function_source(function))
+        source_seconds.append(time.time() - start)
+    keys = [None] * len(functions)
+    cached = [None] * len(functions)
+    first = {} # key -> index of the first function probed with it
+    shard_counts = []
+    tasks = []
+    for (ndx, (lines, var_names)) in enumerate(sources):
+        if cache is not None:
+            keys[ndx] = cache.key(functions[ndx], lines, options, assumed[ndx])
+            cached[ndx] = cache.get(keys[ndx])
+        if cached[ndx] is None and keys[ndx] in first:
+            # the same key as a function probed earlier in this call: reuse its result
+            shard_counts.append(0)
+            continue
+        if cached[ndx] is None and keys[ndx] is not None:
+            first[keys[ndx]] = ndx
+        var_types = candidate_types(lines, var_names, assumed[ndx]) if cached[ndx] is None else None
+        # adaptive, sequential and coverage-guided runs depend on the outcomes of earlier
+        # probes, so they are never split
+        large = var_types is not None and not options["adaptive"] and \
+                options["early_stop"] is None and options["coverage"] is None and \
+                _probe_count(var_names, var_types, options) >= shard_threshold
+        shard_counts.append(0 if cached[ndx] is not None else jobs if large else 1)
+        tasks.extend((filepath, functions[ndx].__name__, (shard, shard_counts[ndx]), options,
+                      _encode_assumed(assumed[ndx]))
+                     for shard in range(shard_counts[ndx]))
+
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.imap(_count_shard, tasks)
+        probed = {}
+        for (ndx, function) in enumerate(functions):
+            if cached[ndx] is None and first.get(keys[ndx], ndx) != ndx:
+                cached[ndx] = cache.get(keys[ndx]) or probed[keys[ndx]]
+            if cached[ndx] is not None:
+                yield function, cached[ndx], 0.0
+                continue
+            lines, var_names = sources[ndx]
+            shards = [next(results) for _ in range(shard_counts[ndx])]
+            counts = merge_counts([_decode_counts(c) for (c, s, seconds) in shards])
+            inferred = None if counts is None else rank_types(var_names, *counts)
+            stats = merge_stats([s for (c, s, seconds) in shards], options)
+            stats["profile"]["timings"]["source"] = source_seconds[ndx]
+            result = make_result(lines, var_names, inferred, stats)
+            if cache is not None:
+                cache.put(keys[ndx], result)
+                probed[keys[ndx]] = result
+            yield function, result, sum(seconds for (c, s, seconds) in shards)
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
+
+def _worker_module(filepath):
+    """Returns the module of filepath in a worker process of parallel_recommendations,
+    importing it the first time it is asked for. Only the latest module is kept."""
+    global _worker_file, _worker_mod
+    if _worker_file != filepath:
+        _worker_file, _worker_mod = None, None
+        # load_source would otherwise reuse the previous file's module object
+        sys.modules.pop("_nocomment_worker_target", None)
+        _worker_mod = load_source("_nocomment_worker_target", filepath)
+        _worker_file = filepath
+    return _worker_mod
+
+def _count_shard(task):
+    """Runs count_types on one shard of a function in a worker process. Returns a tuple
+    of the counts, the statistics collected by count_types and the time taken.
+
+    task - A tuple of the file, the name of the function, the shard, the options and the
+           assumed types, encoded by _encode_assumed.
+    """
+    filepath, name, shard, options, assumed = task
+    start = time.time()
+    function = next(f for f in get_functions(_worker_module(filepath)) if f.__name__ == name)
+    lines, var_names = function_source(function)
+    stats = {}
+    counts = count_types(function, lines, var_names, _decode_assumed(assumed), options=options,
+                         stats=stats, shard=shard)
+    return _encode_counts(counts), stats, time.time() - start
+
+def _encode_assumed(assumed):
+    """Returns a dictionary of assumed types with every type replaced by its index in
+    supported_types, for pickling (see _encode_counts)."""
+    return {v: [supported_types.index(t) for t in ts] for (v, ts) in assumed.items()}
+
+def _decode_assumed(assumed):
+    """Reverses _encode_assumed."""
+    return {v: [supported_types[t] for t in ts] for (v, ts) in assumed.items()}
+
+def _encode_counts(counts):
+    """Returns count_types results with every type replaced by its index in
+    supported_types, since some types (e.g. NoneType) cannot be pickled.
+
+    counts - A value returned by count_types.
+    """
+    if counts is None:
+        return None
+    index = {t: ndx for (ndx, t) in enumerate(supported_types)}
+    var_types, return_types = counts
+    return ({v: {index[t]: c for (t, c) in vt.items()} for (v, vt) in var_types.items()},
+            {index[t]: c for (t, c) in return_types.items()})
+
+def _decode_counts(counts):
+    """Reverses _encode_counts.
+
+    counts - A value returned by _encode_counts.
+    """
+    if counts is None:
+        return None
+    var_types, return_types = counts
+    return ({v: {supported_types[t]: c for (t, c) in vt.items()} for (v, vt) in var_types.items()},
+            {supported_types[t]: c for (t, c) in return_types.items()})
+
+def _probe_count(var_names, var_types, options):
+    """Returns the number of probes sample_type_values provides for the pruned types.
+
+    var_names - A list of strings representing the variable names used in the parameters.
+    var_types - A dictionary mapping variable names to dictionaries keyed by possible types.
+    options - A dictionary of analysis options (see default_options).
+    """
+    if options["sampling"] == "exhaustive":
+        table = sample_table()
+        total = 1
+        for v in var_names:
+            total *= sum(len(table[t]) for t in var_types[v])
+        return total if options["budget"] is None else min(total, options["budget"])
+    return len(list(sample_type_values(var_names, var_types, options["sampling"],
+                                       options["strength"], options["budget"], options["seed"])))
+
+def code_fingerprint(code):
+    """Returns a hex digest identifying a code object by its bytecode, constants, names,
+    argument names and flags. Nested code objects (lambdas, inner functions) are
+    fingerprinted recursively, so the digest does not depend on memory addresses.
+
+    code - A code object.
+    """
+    import hashlib
+    digest = hashlib.sha1()
+    for part in (code.co_code, repr(code.co_names), repr(code.co_varnames),
+                 repr(code.co_freevars), repr(code.co_cellvars),
+                 str(code.co_argcount), str(code.co_flags)):
+        digest.update(_bytes(part))
+        digest.update(b"\0")
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            digest.update(_bytes(code_fingerprint(const)))
+        elif isinstance(const, frozenset):
+            # the order of a set of strings varies between runs on Python 3
+            digest.update(_bytes(repr((frozenset, sorted(map(repr, const))))))
+        else:
+            digest.update(_bytes(repr((type(const), const))))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def global_fingerprint(function):
+    """Returns a hex digest identifying the values of the global variables, and of the
+    closure cells, that a function (or its nested functions) reads: functions by their
+    code (see code_fingerprint) and, for functions of the same module, by the globals they
+    read in turn, other values as described by _value_fingerprint. Names that are not
+    globals of the function's module, such as builtins, are left out. The digest is the
+    same in every run over unchanged code, so that it can key cached results.
+
+    function - A function or MethodTarget.
+    """
+    import hashlib
+    function = getattr(function, "function", function)
+    scope = getattr(function, "__globals__", None)
+    module = getattr(function, "__module__", None)
+    digest = hashlib.sha1()
+    pending, seen = [function], set()
+    while pending:
+        function = pending.pop()
+        if id(function) in seen:
+            continue
+        seen.add(id(function))
+        for (name, value) in _read_values(function):
+            if isinstance(value, types.FunctionType):
+                part = code_fingerprint(value.__code__)
+                if scope is not None and value.__globals__ is scope:
+                    pending.append(value) # a callee changes what the caller does
+            else:
+                part = _value_fingerprint(value, module)
+            digest.update(_bytes("%s\0%s\0" % (name, part)))
+    return digest.hexdigest()
+
+def _value_fingerprint(value, module):
+    """Returns a string identifying a value read by a function the same way in every run:
+    modules by name, classes of the function's own module by the code of their methods,
+    other classes by qualified name, and other values by their type and repr, without
+    memory addresses. The function's module is named differently in every run (see
+    load_modules), so its name is left out.
+
+    value - The value.
+    module - A string, the name of the function's module, or None.
+    """
+    import inspect
+    if isinstance(value, types.ModuleType):
+        return "module " + ("" if value.__name__ == module else value.__name__)
+    if inspect.isclass(value):
+        if value.__module__ != module:
+            return "class %s.%s" % (value.__module__, value.__name__)
+        methods = sorted((name, code_fingerprint(getattr(f, "__func__", f).__code__))
+                         for (name, f) in vars(value).items()
+                         if isinstance(getattr(f, "__func__", f), types.FunctionType))
+        return "class %s %r" % (value.__name__, methods)
+    try:
+        text = repr((type(value), value))
+    except Exception:
+        text = repr(type(value))
+    text = re.sub(r" at 0x[0-9a-fA-F]+", "", text)
+    return text if module is None else text.replace(module + ".", "")
+
+def _read_values(function):
+    """Returns a list of (name, value) tuples of the globals a function (or its nested
+    functions) reads, by name, followed by (None, value) tuples of its closure cells."""
+    names, codes = set(), [function.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(c for c in code.co_consts if isinstance(c, types.CodeType))
+    scope = getattr(function, "__globals__", {})
+    values = [(name, scope[name]) for name in sorted(names) if name in scope]
+    for cell in getattr(function, "__closure__", None) or ():
+        try:
+            values.append((None, cell.cell_contents))
+        except ValueError: # not assigned yet
+            values.append((None, None))
+    return values
+
+def _bytes(text):
+    """Returns a string as bytes, encoded as UTF-8 if it is text."""
+    return text if isinstance(text, bytes) else text.encode("utf-8")
+
+# bump when the format of cached results or the analysis itself changes
+cache_version = 3
+default_cache_dir = ".nocomment-cache"
+default_cache_bytes = 64 * 1024 ** 2
+# the most distinct function codes a DedupCache remembers before it starts over
+dedup_cache_size = 4096
+
+class ResultCache(object):
+    """An on-disk cache of the results of recommend, one JSON file per function, keyed by
+    a hash of the function's code object, its comment-free source lines, the globals and
+    callees it reads (see global_fingerprint) and the analysis options. Entries are evicted least recently used first once the files take up more
+    than max_bytes.
+    """
+
+    def __init__(self, directory=default_cache_dir, max_bytes=default_cache_bytes):
+        """directory - A string naming the directory to keep entries in.
+        max_bytes - An integer, the size the entries may take up before eviction.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None # total size of the entries, computed on the first put
+
+    def key(self, function, lines, options, assumed={}):
+        """Returns the cache key of a function's result.
+
+        function - A function.
+        lines - A list of strings representing the function's source lines, without comments.
+        options - A dictionary of analysis options (see default_options), or None for the defaults.
+        assumed - The dictionary of assumed types the function was analyzed with.
+        """
+        import hashlib
+        digest = hashlib.sha1()
+        digest.update(_bytes(str(cache_version) + "\0" + code_fingerprint(function.__code__)
+                             + "\0"))
+        digest.update(_bytes("\n".join(lines) + "\0"))
+        digest.update(_bytes(global_fingerprint(function) + "\0"))
+        digest.update(_bytes(repr(sorted(make_options(options).items())) + "\0"))
+        digest.update(_bytes(registry_fingerprint()))
+        if getattr(function, "context", None):
+            digest.update(_bytes("\0" + function.context))
+        if assumed:
+            digest.update(_bytes("\0" + repr(sorted((v, sorted(map(stringify_type, ts)))
+                                                     for (v, ts) in assumed.items()))))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached result for key, or None if there is none."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = _result_from_json(json.load(f))
+            os.utime(path, None) # mark as recently used
+            return result
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def put(self, key, result):
+        """Stores a result returned by recommend under key, without the profile in its
+        statistics, evicting old entries if needed."""
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # the profile describes one run, not the function
+        result = dict(result, stats={k: v for (k, v) in result["stats"].items() if k != "profile"})
+        data = json.dumps(_result_to_json(result), sort_keys=True)
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, "w") as f:
+            f.write(data)
+        os.rename(temp, path)
+
+        if self._size is None:
+            self._size = sum(size for (mtime, size, p) in self._entries())
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict(path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _entries(self):
+        """Returns a list of (modification time, size, path) tuples of every entry."""
+        entries = []
+        for (root, dirs, files) in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self, keep):
+        """Removes the least recently used entries, other than the one at path keep, until
+        the cache is under 90% of max_bytes."""
+        entries = sorted(self._entries())
+        self._size = sum(size for (mtime, size, path) in entries)
+        for (mtime, size, path) in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._size -= size
+
+class MemoryCache(ResultCache):
+    """An in-memory cache of the results of recommend, keyed like ResultCache, in front of
+    another cache. Entries not used between two calls to sweep are dropped by the second,
+    so that a cache swept after each analysis of a file only keeps its current functions.
+    """
+
+    def __init__(self, backing=None):
+        """backing - A ResultCache to read results missing from memory from, and to store
+                     new results in too, or None.
+        """
+        self.backing = backing
+        self.entries = {}
+        self.used = {}
+        self.hits = 0 # results found in memory
+
+    def get(self, key):
+        """Returns the cached result for key, or None if there is none."""
+        result = self.used.get(key) or self.entries.get(key)
+        if result is not None:
+            self.hits += 1
+        elif self.backing is not None:
+            result = self.backing.get(key)
+        if result is not None:
+            self.used[key] = result
+        return result
+
+    def put(self, key, result):
+        """Stores a result returned by recommend under key, without the profile in its
+        statistics."""
+        self.used[key] = dict(result, stats={k: v for (k, v) in result["stats"].items()
+                                             if k != "profile"})
+        if self.backing is not None:
+            self.backing.put(key, result)
+
+    def sweep(self):
+        """Drops the entries not used since the previous sweep."""
+        self.entries, self.used = self.used, {}
+
+class DedupCache(MemoryCache):
+    """An in-memory cache of the results of recommend in front of another cache, keyed
+    like ResultCache but by the code of each function (see code_fingerprint and
+    global_fingerprint) instead of its source lines, which hold its name. Functions with the
+    same body, parameters and globals under different names, in the same file or in any
+    other file of a run, are then analyzed once; the results reused for the others carry a
+    "duplicate_of" statistic naming the function ("file:qualname") first analyzed. Once
+    dedup_cache_size codes are remembered, the cache is cleared before the next one, so
+    that memory stays bounded over long runs; duplicates of cleared functions are then
+    analyzed again.
+    """
+
+    def __init__(self, backing=None):
+        """backing - A ResultCache to read results missing from memory from, and to store
+                     new results in too (under the same keys), or None.
+        """
+        MemoryCache.__init__(self, backing)
+        self.origins = {} # key -> "file:qualname" of the first function with the key
+
+    def clear(self):
+        """Forgets every function and result held in memory, for example between runs."""
+        self.origins = {}
+        self.entries = {}
+        self.used = {}
+
+    def key(self, function, lines, options, assumed={}):
+        """Returns the cache key of a function's result, the same for every function with
+        the same code, parameters and globals.
+
+        function - A function or MethodTarget.
+        lines - A list of strings representing the function's source lines, without comments.
+        options - A dictionary of analysis options (see default_options), or None for the defaults.
+        assumed - The dictionary of assumed types the function was analyzed with.
+        """
+        # without the source lines, which hold the function's name
+        key = ResultCache.key(self, function, [], options, assumed)
+        if key not in self.origins and len(self.origins) >= dedup_cache_size:
+            self.clear()
+        self.origins.setdefault(key, "%s:%s" % (function.__code__.co_filename,
+                                                function.__name__))
+        return key
+
+    def get(self, key):
+        """Returns the cached result for key, marked as a duplicate if it was found in
+        memory, or None if there is none."""
+        hits = self.hits
+        result = MemoryCache.get(self, key)
+        if self.hits > hits:
+            result = dict(result, stats=dict(result["stats"], duplicate_of=self.origins[key]))
+        return result
+
+    def put(self, key, result):
+        """Stores a result returned by recommend under key, in memory only if the function
+        with the key was not forgotten by clear meanwhile."""
+        if key in self.origins:
+            MemoryCache.put(self, key, result)
+        elif self.backing is not None:
+            self.backing.put(key, result)
+
+def _result_to_json(result):
+    """Returns a JSON-serializable copy of a result from make_result, with types named by
+    stringify_type."""
+    def named(pairs):
+        return [[stringify_type(t), n] for (t, n) in pairs]
+    data = dict(result)
+    data["returns"] = named(result["returns"])
+    if result["types"] is not None:
+        data["types"] = {v: named(pairs) for (v, pairs) in result["types"].items()}
+    return data
+
+def _result_from_json(data):
+    """Reverses _result_to_json. Raises KeyError for a type that is no longer supported."""
+    by_name = {stringify_type(t): t for t in supported_types}
+    def typed(pairs):
+        return [(by_name[name], n) for (name, n) in pairs]
+    result = {"params": [str(v) for v in data["params"]], "returns": typed(data["returns"]),
+              "divisors": [str(v) for v in data["divisors"]],
+              "zero_divisions": [str(v) for v in data.get("zero_divisions", [])],
+              "stats": _plain(data["stats"]),
+              "types": None}
+    if data["types"] is not None:
+        result["types"] = {str(v): typed(pairs) for (v, pairs) in data["types"].items()}
+    return result
+
+def _plain(obj):
+    """Returns a copy of a decoded JSON value with unicode strings turned into str."""
+    if isinstance(obj, dict):
+        return {_plain(k): _plain(v) for (k, v) in obj.items()}
+    if isinstance(obj, list):
+        return [_plain(v) for v in obj]
+    if isinstance(obj, unicode):
+        return str(obj)
+    return obj
+
+# method names that narrow a variable down to the types declaring them (see TypeEntry)
+# when called on it
+int_methods = [ "bit_length" ]
+float_methods = [ "as_integer_ratio", "is_integer", "hex", "fromhex" ]
+string_methods = [  "capitalize", "center", "count", "decode", "encode", "endswith",
+                    "expandtabs", "find", "format", "index", "isalnum", "isdigit",
+                    "islower", "isspace", "istitle", "isupper", "join", "ljust",
+                    "lower", "lstrip", "partition", "replace", "rfind", "rindex",
+                    "rjust", "rpartition", "rsplit", "split", "splitlines",
+                    "startswith", "strip", "swapcase", "title", "translate",
+                    "upper", "zfill" ]
+dict_methods = [ "clear", "copy", "fromkeys", "get", "has_key", "items", "iteritems",
+                 "iterkeys", "itervalues", "keys", "popitem", "setdefault", "update",
+                 "values", "viewitems", "viewvalues" ]
+
+class TypeEntry(object):
+    """A type that parameters and return values can be inferred to have, with what the
+    analysis needs to know about it. Types are added with register_type.
+    """
+
+    def __init__(self, type_, name, samples, supports=(), methods=(), weight=1.0,
+                 rebuild=None):
+        """type_ - The type.
+        name - A string naming the type in recommendations and records.
+        samples - A function returning a list of distinct sample values of the type.
+        supports - The usages in prune_kinds that values of the type allow; prune removes
+                   the type from parameters used in any other way.
+        methods - Method names that narrow a parameter they are called on down to the
+                  types declaring them.
+        weight - The share of the samples to probe with, for types that are costly or
+                 rarely useful; at least one sample is always used.
+        rebuild - A function returning a fresh copy of a sample value, for mutable types
+                  that fresh_value does not already copy, or None.
+        """
+        self.type = type_
+        self.name = name
+        self.samples = samples
+        self.supports = frozenset(supports)
+        self.methods = frozenset(methods)
+        self.weight = weight
+        self.rebuild = rebuild
+
+# the registered types: supported_types in registration order, which decides ties in
+# rankings, and type_registry mapping each one to its TypeEntry
+supported_types = []
+type_registry = {}
+
+def register_type(entry):
+    """Adds a TypeEntry to the types the analysis considers, or replaces the entry of a
+    type that is already registered, keeping its place. Types should be registered before
+    any analysis starts, so that worker processes see the same registry.
+
+    entry - A TypeEntry.
+    """
+    if entry.type not in type_registry:
+        supported_types.append(entry.type)
+    type_registry[entry.type] = entry
+
+def registry_fingerprint():
+    """Returns a string describing the registered types as the analysis sees them: the
+    name, samples, weight, supported usages and methods of each, in registration order,
+    so that replacing an entry, e.g. with float-edges, changes it. Memory addresses are
+    left out of the samples, so that the string is the same in every run.
+    """
+    parts = []
+    for t in supported_types:
+        entry = type_registry[t]
+        samples = re.sub(r" at 0x[0-9a-fA-F]+", "", repr(entry.samples()))
+        parts.append(repr((stringify_type(t), samples, entry.weight, sorted(entry.supports),
+                           sorted(entry.methods))))
+    return "\n".join(parts)
 
 def stringify_type(t):
     """Returns a simple string name of a type t. Returns None if type not supported."""
-    table = {
-        types.BooleanType   : "bool"
-    ,   types.IntType       : "int"
-    ,   types.FloatType     : "float"
-    ,   types.StringType    : "string"
-    ,   types.TupleType     : "tuple"
-    ,   types.ListType      : "list"
-    ,   types.DictType      : "dict"
-    ,   types.NoneType      : "None"
-    }
-    if t in table: return table[t]
-    else: return None
+    entry = type_registry.get(t)
+    return entry.name if entry is not None else None
+
+# the usages prune recognizes, in the order they are applied to a line:
+#   subscript     - v[...]                    subscript_key - v["..."]
+#   call          - v(...)                    additive      - v + ..., ... * v
+#   arithmetic    - v - ..., ... / v          bitwise       - v ^ ..., ... << v
+#   contains      - ... in v                  iterated      - len(v), sorted(v), ...
+#   sequence      - v.append(...), v.index(...), ... (see sequence_methods)
+prune_kinds = ["subscript", "subscript_key", "call", "additive", "arithmetic", "bitwise",
+               "contains", "iterated", "sequence"]
+
+_sequence_kinds = ["subscript", "additive", "contains", "iterated", "sequence"]
+
+# the default registrations
+register_type(TypeEntry(bool, "bool", lambda: [True, False],
+                        supports=["additive", "arithmetic", "bitwise"]))
+register_type(TypeEntry(int, "int", lambda: [-100, 1, 0, 100],
+                        supports=["additive", "arithmetic", "bitwise"], methods=int_methods))
+register_type(TypeEntry(float, "float", lambda: [-1.1, -0.73, 0.0, 0.34, 2.999],
+                        supports=["additive", "arithmetic"], methods=float_methods))
+register_type(TypeEntry(str, "string",
+                        lambda: ["", "\n", " ", "Hello", "H3llo\n W0rld!"],
+                        supports=_sequence_kinds, methods=string_methods))
+register_type(TypeEntry(tuple, "tuple",
+                        lambda: [(), (0,1), (2,"zz", False), ("a","b","c"), ([1,2,3], 4)],
+                        supports=_sequence_kinds))
+register_type(TypeEntry(list, "list",
+                        lambda: [ [], [-1.1, "zzz"], [[], [[0]], [0,1]], ["a","b","c"], [1,2,3] ],
+                        supports=_sequence_kinds))
+register_type(TypeEntry(dict, "dict",
+                        lambda: [{}, {"a": 3}, {1:{1,2}, 4:3}, {0:"h"}, {"b":"c"}],
+                        supports=["subscript", "subscript_key", "contains", "iterated", "sequence"],
+                        methods=dict_methods))
+# None survives arithmetic, as it always has, since "a / b" rules out sequences first
+register_type(TypeEntry(NoneType, "None", lambda: [None], supports=["arithmetic"]))
+
+set_methods = [ "add", "discard", "difference", "difference_update", "intersection",
+                "intersection_update", "isdisjoint", "issubset", "issuperset",
+                "symmetric_difference", "symmetric_difference_update", "union" ]
+
+# further registrations that can be enabled by name (see parse_args); each samples
+# sparsely so that enabling it grows the probe space by little
+extra_types = {
+    "set": TypeEntry(set, "set", lambda: [set(), set([1, 2]), set(["a", "b"])],
+                     supports=["bitwise", "contains", "iterated"], methods=set_methods,
+                     weight=0.67),
+    "float-edges": TypeEntry(float, "float",
+                             lambda: [-1.1, -0.73, 0.0, 0.34, 2.999, -0.0, float("inf"),
+                                      float("-inf"), float("nan"), 1e308],
+                             supports=["additive", "arithmetic"], methods=float_methods)
+}
+if sys.version_info[0] < 3:
+    extra_types["long"] = TypeEntry(long, "long", lambda: [long(0), -2 ** 64, 2 ** 70 + 1],
+                                    supports=["additive", "arithmetic", "bitwise"],
+                                    methods=int_methods, weight=0.67)
+    extra_types["unicode"] = TypeEntry(unicode, "unicode",
+                                       lambda: [u"", u"Hello", u"\u00e9t\u00e9 \u2603"],
+                                       supports=_sequence_kinds, methods=string_methods,
+                                       weight=0.67)
+else: # str is unicode, and byte strings are the other string type
+    extra_types["bytes"] = TypeEntry(bytes, "bytes", lambda: [b"", b"Hello", b"\xe9t\xe9"],
+                                     supports=_sequence_kinds, methods=string_methods,
+                                     weight=0.67)
+
+def load_type(spec):
+    """Returns the TypeEntry named by spec: a key of extra_types, or "module:attribute"
+    for an entry defined by a project, e.g. for its own classes. Raises ValueError if
+    there is no such entry.
+
+    spec - A string.
+    """
+    if spec in extra_types:
+        return extra_types[spec]
+    module, _, attribute = spec.partition(":")
+    try:
+        entry = getattr(__import__(module, fromlist=[attribute]), attribute)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise ValueError("Unknown type %s (%s)" % (spec, _describe_exception(e)))
+    # not isinstance: run as a script, this module is __main__ rather than nocomment
+    if not all(hasattr(entry, a) for a in ("type", "name", "samples", "supports", "methods")):
+        raise ValueError("Not a TypeEntry: " + spec)
+    return entry
+
+sampling_strategies = ["exhaustive", "covering", "random"]
+default_random_budget = 1000
+
+# options controlling how functions are probed; every entry point that takes an
+# options dictionary fills in missing keys from here
+default_options = {
+    "sampling": "exhaustive"
+,   "strength": 2
+,   "budget": None
+,   "seed": 0
+,   "adaptive": False           # eliminate (parameter, type) pairs as probes fail
+,   "early_stop": None          # stop once rankings hold for this many probes
+,   "confidence": 0.05          # ... or may change with at most this probability
+,   "coverage": None            # probe near new coverage first, stop after this many
+                                # probes in a row reach none (see CoverageGuide)
+,   "propagate": False          # limit parameters to the types of the callees they are
+                                # passed to (see propagated_results)
+,   "executor": "inline"        # or "sandbox", see SandboxExecutor
+,   "timeout": 1.0              # seconds per probe, sandbox only
+,   "memory": 512 * 1024 ** 2   # bytes of address space per worker, sandbox only
+}
+
+def make_options(options=None):
+    """Returns a copy of default_options updated with the given dictionary of options.
+
+    options - A dictionary of analysis options, or None for the defaults.
+    """
+    merged = dict(default_options)
+    merged.update(options or {})
+    if merged["sampling"] not in sampling_strategies:
+        raise ValueError("Unknown sampling strategy: " + str(merged["sampling"]))
+    if merged["executor"] not in ("inline", "sandbox"):
+        raise ValueError("Unknown executor: " + str(merged["executor"]))
+    return merged
 
 def remove_comments(lines):
-    """Returns a list of Python source lines with comments removed.
+    """Returns a list of Python source lines with comments and docstrings (string literals
+    standing alone as statements) removed. There is one line per line of the input, so
+    line numbers are kept; line endings are dropped, as is whitespace left at the end of
+    a line by a removal. The source is tokenized once, in linear time, and its tokens are
+    kept for the _tokenize_lines calls on the result, and on the result without its first
+    line, as prune and failure_classifier make them.
 
     lines - A list of strings representing lines in part of a Python source file.
     """
+    lines = [l.rstrip("\r\n") for l in lines]
+    tokens, ok = _generate_tokens("\n".join(lines))
+    if not ok:
+        # e.g. a fragment with an unbalanced bracket: only comments can be found, one
+        # line at a time
+        spans = []
+        for (row, line) in enumerate(lines):
+            indent = len(line) - len(line.lstrip())
+            spans.extend((row, indent + tok[2][1], row, indent + tok[3][1])
+                         for tok in _generate_tokens(line.lstrip())[0]
+                         if tok[0] == tokenize.COMMENT)
+        return _remove_spans(lines, spans)
+
+    spans = []
+    significant = []
+    strings = []  # the string tokens of the current logical line, if only strings so far
+    for tok in tokens:
+        kind = tok[0]
+        if kind == tokenize.STRING and strings is not None:
+            strings.append(tok)
+        elif kind == tokenize.NEWLINE or kind == tokenize.ENDMARKER:
+            # a docstring
+            spans.extend((t[2][0] - 1, t[2][1], t[3][0] - 1, t[3][1]) for t in strings or ())
+            strings = []
+        elif kind == tokenize.COMMENT:
+            spans.append((tok[2][0] - 1, tok[2][1], tok[3][0] - 1, tok[3][1]))
+        elif kind not in _SKIPPED_TOKENS:
+            if strings:
+                significant.extend((t[2][0] - 1, t[0], t[1]) for t in strings)
+            strings = None
+            significant.append((tok[2][0] - 1, kind, tok[1]))
+    cleaned = _remove_spans(lines, spans)
 
-    # remove multi-line comments
-    single = "\n".join(map(lambda x: x[:-1], lines))
-    single = re.sub("'''(.|\n)*'''", "", single)
-    single = re.sub('"""(.|\n)*"""', '', single)
+    _cache_tokens(cleaned, significant)
+    # prune and failure_classifier read the body alone, without the first line
+    _cache_tokens(cleaned[1:], [(row - 1, kind, text) for (row, kind, text) in significant
+                                if row > 0])
+    return cleaned
 
-    lines = single.split("\n")
-    return map(lambda x: x.split("#")[0], lines)
+def _cache_tokens(lines, tokens):
+    """Keeps the significant tokens of a list of lines for _tokenize_lines."""
+    if len(_token_cache) >= _token_cache_size:
+        _token_cache.clear()
+    _token_cache[tuple(lines)] = tokens
+
+def _remove_spans(lines, spans):
+    """Returns a copy of lines with the text of each (start row, start column, end row,
+    end column) span removed. Lines that lose text have trailing whitespace removed.
+
+    lines - A list of strings representing lines in part of a Python source file.
+    spans - A list of non-overlapping spans.
+    """
+    lines = list(lines)
+    touched = set()
+    for (srow, scol, erow, ecol) in sorted(spans, reverse=True):
+        if srow == erow:
+            lines[srow] = lines[srow][:scol] + lines[srow][ecol:]
+        else:
+            lines[srow] = lines[srow][:scol]
+            for row in range(srow + 1, erow):
+                lines[row] = ""
+            lines[erow] = lines[erow][ecol:]
+        touched.update(range(srow, erow + 1))
+    for row in touched:
+        lines[row] = lines[row].rstrip()
+    return lines
+
+# the operators whose right operand is a divisor, and the functions whose second argument
+# is one (math.fmod is matched by its attribute name)
+_division_operators = (ast.Div, ast.FloorDiv, ast.Mod)
+division_functions = [ "divmod", "fmod", "remainder" ]
+_function_nodes = tuple(getattr(ast, name) for name in ("FunctionDef", "AsyncFunctionDef")
+                        if hasattr(ast, name))
 
 def find_zero_denominators(lines, var_names):
     """Returns a subset of variables in var_names that are used as denominators
-    in the list of Python source lines.
+    in the list of Python source lines: the right operand of /, //, % (other than string
+    formatting) and their augmented assignments, or the second argument of one of
+    division_functions. Parameters are followed through simple assignments, so that in
+    "d = b; a / d" b is a denominator; a name assigned in a nested block may still hold
+    what it held before. Lines that cannot be parsed are searched for names following
+    / or // instead.
 
     lines - A list of strings representing lines in part of a Python source file.
     var_names - A list of strings representing the variable names used in the parameters.
     """
-    output = []
-    for line in lines:
-        for var in var_names:
-            if re.search("/( )*"+var, line):
-                output.append(var)
-    return list(set(output)) # remove duplicates
+    try:
+        tree = ast.parse(textwrap.dedent("\n".join(line.rstrip("\r\n") for line in lines)))
+    except (SyntaxError, TypeError, ValueError):
+        tokens = _tokenize_lines(lines)
+        found = set(text for (prev, (row, kind, text)) in zip(tokens, tokens[1:])
+                    if kind == tokenize.NAME and prev[1] == tokenize.OP and
+                    prev[2] in ("/", "//"))
+        return [v for v in var_names if v in found]
+    found = set()
+    aliases = {v: set([v]) for v in var_names} # name -> the parameters it may hold
+
+    def held(node):
+        # the parameters an expression may evaluate to, give or take its sign
+        if isinstance(node, ast.Name):
+            return aliases.get(node.id, set())
+        if isinstance(node, ast.IfExp):
+            return held(node.body) | held(node.orelse)
+        if isinstance(node, ast.BoolOp):
+            return set().union(*[held(value) for value in node.values])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            return held(node.operand)
+        return set()
+
+    def divisions(node):
+        for n in ast.walk(node):
+            if isinstance(n, ast.BinOp) and isinstance(n.op, _division_operators) and \
+               not (isinstance(n.op, ast.Mod) and _literal_type(n.left) in (str, unicode, bytes)):
+                found.update(held(n.right))
+            elif isinstance(n, ast.Call) and len(n.args) > 1 and \
+                 getattr(n.func, "id", getattr(n.func, "attr", None)) in division_functions:
+                found.update(held(n.args[1]))
+
+    def assign(target, value, nested):
+        if isinstance(target, ast.Name):
+            names = set() if value is None else held(value)
+            aliases[target.id] = names | aliases.get(target.id, set()) if nested else names
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            values = getattr(value, "elts", None)
+            if values is None or len(values) != len(target.elts):
+                values = [None] * len(target.elts)
+            for (t, v) in zip(target.elts, values):
+                assign(t, v, nested)
+
+    def visit(statements, nested):
+        for statement in statements:
+            blocks = []
+            for (field, value) in ast.iter_fields(statement):
+                for node in value if isinstance(value, list) else [value]:
+                    if isinstance(node, ast.stmt):
+                        blocks.append([node])
+                    elif isinstance(node, _clause_nodes):
+                        for (f, v) in ast.iter_fields(node):
+                            if isinstance(v, list) and v and isinstance(v[0], ast.stmt):
+                                blocks.append(v)
+                            elif isinstance(v, ast.AST):
+                                divisions(v)
+                    elif isinstance(node, ast.AST):
+                        divisions(node)
+            if isinstance(statement, ast.Assign):
+                for target in statement.targets:
+                    assign(target, statement.value, nested)
+            elif isinstance(statement, ast.AugAssign):
+                if isinstance(statement.op, _division_operators):
+                    found.update(held(statement.value))
+                assign(statement.target, None, nested)
+            elif getattr(statement, "value", None) is not None and \
+                 hasattr(statement, "target"): # annotated assignment
+                assign(statement.target, statement.value, nested)
+            elif hasattr(statement, "target"): # for loops
+                assign(statement.target, None, nested)
+            for block in blocks:
+                visit(block, True)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Lambda):
+            divisions(node.body)
+            break
+        if isinstance(node, _function_nodes):
+            visit(node.body, False)
+            break
+    return [v for v in var_names if v in found]
+
+# method names that mark a variable as a sequence, see prune_kinds
+sequence_methods = [ "append", "extend", "count", "index", "insert", "pop", "remove",
+                     "reverse", "sort" ]
+iterating_builtins = [ "len", "min", "max", "list", "next", "enumerate", "sorted", "all",
+                       "any", "set", "sum", "tuple", "zip" ]
+
+# binary operators (augmented forms are folded onto these) grouped by the types
+# they rule out; ** appears twice because it is both a "*" and a "**"
+_ADDITIVE_OPS = frozenset(["+", "*", "**"])
+_ARITHMETIC_OPS = frozenset(["-", "/", "//", "**"])
+_BITWISE_OPS = frozenset(["^", "%", "&", "|", "<<", ">>"])
+
+_SKIPPED_TOKENS = frozenset([tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE,
+                             tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER])
+
+# the significant tokens of the lines most recently returned by remove_comments, and of
+# those lines without the first, keyed by the tuple of lines; bounded so that analyzing
+# many files does not accumulate them
+_token_cache = {}
+_token_cache_size = 256
+
+def _tokenize_lines(lines):
+    """Returns a list of (row, type, string) tuples for the significant tokens in a list
+    of Python source lines, where row is the index of the line the token starts on.
+
+    Lines returned by remove_comments are not tokenized again. Other lines are tokenized
+    as one block. Fragments that do not tokenize as a block (e.g. an unbalanced bracket
+    or a stray dedent) fall back to tokenizing each line on its own, keeping whatever
+    tokens precede an error.
+
+    lines - A list of strings representing lines in part of a Python source file.
+    """
+    cached = _token_cache.get(tuple(lines))
+    if cached is not None:
+        return cached
+    def significant(tokens, row_offset):
+        return [(tok[2][0] - 1 + row_offset, tok[0], tok[1])
+                for tok in tokens if tok[0] not in _SKIPPED_TOKENS]
+
+    tokens, ok = _generate_tokens("\n".join(l.rstrip("\n") for l in lines))
+    if ok:
+        return significant(tokens, 0)
+    tokens = []
+    for row, line in enumerate(lines):
+        tokens.extend(significant(_generate_tokens(line.strip())[0], row))
+    return tokens
+
+def _generate_tokens(text):
+    """Returns a tuple of the list of tokens of a string of Python source, as generated by
+    tokenize, and a boolean indicating whether the whole string was tokenized, rather than
+    only the tokens preceding an error.
+
+    text - A string of Python source.
+    """
+    try:
+        return list(tokenize.generate_tokens(StringIO(text).readline)), True
+    except (tokenize.TokenError, IndentationError):
+        pass
+    # tokenize again, keeping the tokens preceding the error
+    tokens = []
+    try:
+        for tok in tokenize.generate_tokens(StringIO(text).readline):
+            tokens.append(tok)
+    except (tokenize.TokenError, IndentationError):
+        pass
+    return tokens, False
+
+def _index_usages(lines, var_names):
+    """Walks the tokens of a list of Python source lines once and returns a tuple of
+    a dictionary mapping each variable name to a list of (row, kind, detail) usages,
+    and a dictionary mapping each variable name to the first row it is reassigned on
+    (absent if never reassigned).
+
+    Kinds are the names in prune_kinds plus "method", whose detail is the name of the
+    method accessed on the variable.
+
+    lines - A list of strings representing lines in part of a Python source file.
+    var_names - A collection of strings representing the variable names to index.
+    """
+    tokens = _tokenize_lines(lines)
+    usages = {v: [] for v in var_names}
+    reassigned = {}
+    depth = 0
+    n = len(tokens)
+    for i in range(n):
+        row, kind, text = tokens[i]
+        if kind == tokenize.OP:
+            if text in "([{": depth += 1
+            elif text in ")]}": depth = max(0, depth - 1)
+            continue
+        if kind != tokenize.NAME or text not in usages:
+            continue
+        prev = tokens[i-1] if i > 0 else None
+        if prev is not None and prev[2] == ".":
+            continue # attribute of something else, e.g. self.a
+        nxt = tokens[i+1] if i+1 < n and tokens[i+1][0] == row else None
+        after = nxt[2] if nxt is not None else None
+        found = usages[text]
+
+        # check for any reassignment, analysis of the variable stops on that line
+        if after == "=" and depth == 0:
+            if text not in reassigned: reassigned[text] = row
+            continue
+
+        # accessors
+        if after == "[":
+            found.append((row, "subscript", None))
+            if i+3 < n and tokens[i+2][1] == tokenize.STRING and tokens[i+3][2] == "]":
+                found.append((row, "subscript_key", None))
+        elif after == "(":
+            found.append((row, "call", None))
+        elif after == "." and i+2 < n and tokens[i+2][1] == tokenize.NAME:
+            found.append((row, "method", tokens[i+2][2]))
+
+        # operators with the variable on the left
+        op = after.rstrip("=") if after is not None and after not in ("==", "<=", ">=", "!=") else None
+        if op in _ADDITIVE_OPS: found.append((row, "additive", None))
+        if op in _ARITHMETIC_OPS: found.append((row, "arithmetic", None))
+        if op in _BITWISE_OPS: found.append((row, "bitwise", None))
+
+        # operators with the variable on the right; as with the original line scan,
+        # the operand must be followed by something other than [ or ( on its line
+        if prev is not None and prev[1] == tokenize.OP and nxt is not None and after not in ("[", "("):
+            if prev[2] in _ADDITIVE_OPS: found.append((row, "additive", None))
+            if prev[2] in _ARITHMETIC_OPS: found.append((row, "arithmetic", None))
+            if prev[2] in _BITWISE_OPS: found.append((row, "bitwise", None))
+
+        # sequence operators and builtins
+        if prev is not None and prev[1] == tokenize.NAME and prev[2] == "in":
+            found.append((row, "contains", None))
+        if prev is not None and prev[2] == "(" and i > 1 and tokens[i-2][1] == tokenize.NAME \
+           and tokens[i-2][2] in iterating_builtins:
+            found.append((row, "iterated", None))
+    return usages, reassigned
 
 def prune(lines_, var_types_):
     """Given the source code of a function and a dictionary mapping parameter names to
@@ -133,112 +2110,47 @@ def prune(lines_, var_types_):
     one with unlikely types removed from the dictionary corresponding to each variable
     name.
 
+    The body is tokenized once and every usage of every parameter is indexed in a single
+    walk. Usages on or after the line where a parameter is reassigned are ignored.
+
     lines_ - A list of strings representing lines in part of a Python source file.
     var_types_ - A dictionary mapping strings of variable names to a dictionary mapping
                  types to a numeric score indicating likelihood of the variable's type.
     """
-    var_types = var_types_.copy()
-    reassigned = {v: False for v in var_types} # to keep track of reassignments
-    lines_t = []; lines = []
-    for l in lines_[1:]:
-        lines_t.append(str(re.sub("'(.)*'", "_", l)))
-    for l in lines_t:
-        lines.append(str(re.sub('"(.)*"', "_", l)))
-    int_methods = [ "bit_length" ]
-    float_methods = [ "as_integer_ratio", "is_integer", "hex", "fromhex" ]
-    string_methods = [  "capitalize", "center", "count", "decode", "encode", "endswith",
-                        "expandtabs", "find", "format", "index", "isalnum", "isdigit",
-                        "islower", "isspace", "istitle", "isupper", "join", "ljust",
-                        "lower", "lstrip", "partition", "replace", "rfind", "rindex",
-                        "rjust", "rpartition", "rsplit", "split", "splitlines",
-                        "startswith", "strip", "swapcase", "title", "translate",
-                        "upper", "zfill" ]
-    dict_methods = [ "clear", "copy", "fromkeys", "get", "has_key", "items", "iteritems",
-                     "iterkeys", "itervalues", "keys", "popitem", "setdefault", "update",
-                     "values", "viewitems", "viewvalues" ]
+    var_types = {v: dict(t) for (v, t) in var_types_.items()}
+    usages, reassigned = _index_usages(lines_[1:], var_types)
+    entries = [type_registry[t] for t in supported_types]
+    # the types each usage eliminates, and the types each method narrows down to
+    rules = [(kind, [e.type for e in entries if kind not in e.supports]) for kind in prune_kinds]
+    narrowing = {}
+    for e in entries:
+        for name in e.methods:
+            narrowing.setdefault(name, set()).add(e.type)
 
     for var in var_types:
-        for line in lines:
-            # check for any reassignment, stop analysis for now if found
-            if re.search("( )+"+var+"( )*=", line) or re.match(var+"( )*=", line):
-                reassigned[var] = True
-            if not reassigned[var]:
-                # prune __getitem__ accessor, a.k.a []
-                if re.search(var+"( )*\[", line):
-                    if types.BooleanType in var_types[var]: del var_types[var][types.BooleanType]
-                    if types.IntType in var_types[var]: del var_types[var][types.IntType]
-                    if types.FloatType in var_types[var]: del var_types[var][types.FloatType]
-                    if types.NoneType in var_types[var]: del var_types[var][types.NoneType]
-                if re.search(var+"( )*\[( )*_\]", line):
-                    if types.StringType in var_types[var]: del var_types[var][types.StringType]
-                    if types.TupleType in var_types[var]: del var_types[var][types.TupleType]
-                    if types.ListType in var_types[var]: del var_types[var][types.ListType]
-                # prune __call__ operator, a.k.a ()
-                if re.search(var+"( )*\(", line):
-                    if types.BooleanType in var_types[var]: del var_types[var][types.BooleanType]
-                    if types.IntType in var_types[var]: del var_types[var][types.IntType]
-                    if types.FloatType in var_types[var]: del var_types[var][types.FloatType]
-                    if types.StringType in var_types[var]: del var_types[var][types.StringType]
-                    if types.TupleType in var_types[var]: del var_types[var][types.TupleType]
-                    if types.ListType in var_types[var]: del var_types[var][types.ListType]
-                    if types.DictType in var_types[var]: del var_types[var][types.DictType]
-                    if types.NoneType in var_types[var]: del var_types[var][types.NoneType]
-                # prune operators for each type
-                if re.search(var+"( )*(\+|\*)", line) or \
-                   re.search(        "(\+|\*)( )*"+var+"[^\[\(]", line):
-                    if types.NoneType in var_types[var]: del var_types[var][types.NoneType]
-                    if types.DictType in var_types[var]: del var_types[var][types.DictType]
-                if re.search(var+"( )*(\-|\/|\*\*)", line) or \
-                   re.search(        "(\-|\/|\*\*)( )*"+var+"[^\[\(]", line):
-                    if types.StringType in var_types[var]: del var_types[var][types.StringType]
-                    if types.TupleType in var_types[var]: del var_types[var][types.TupleType]
-                    if types.ListType in var_types[var]: del var_types[var][types.ListType]
-                    if types.DictType in var_types[var]: del var_types[var][types.DictType]
-                if re.search(var+"( )*(\^|%|&|\||<<|>>)", line) or \
-                   re.search(        "(\^|%|&|\||<<|>>)( )*"+var+"[^\[\(]", line):
-                    if types.StringType in var_types[var]: del var_types[var][types.StringType]
-                    if types.TupleType in var_types[var]: del var_types[var][types.TupleType]
-                    if types.ListType in var_types[var]: del var_types[var][types.ListType]
-                    if types.DictType in var_types[var]: del var_types[var][types.DictType]
-                    if types.FloatType in var_types[var]: del var_types[var][types.FloatType]
-                    if types.NoneType in var_types[var]: del var_types[var][types.NoneType]
-                # check sequence operators
-                if re.search("in( )*"+var, line):
-                    if types.BooleanType in var_types[var]: del var_types[var][types.BooleanType]
-                    if types.IntType in var_types[var]: del var_types[var][types.IntType]
-                    if types.FloatType in var_types[var]: del var_types[var][types.FloatType]
-                    if types.NoneType in var_types[var]: del var_types[var][types.NoneType]
-                if re.search("(len|min|max|list|next|enumerate|sorted|all|any|set|sum|tuple|zip)( )*\(( )*"+var, line):
-                    if types.BooleanType in var_types[var]: del var_types[var][types.BooleanType]
-                    if types.IntType in var_types[var]: del var_types[var][types.IntType]
-                    if types.FloatType in var_types[var]: del var_types[var][types.FloatType]
-                    if types.NoneType in var_types[var]: del var_types[var][types.NoneType]
-                if re.search(var+"( )*.( )*(append|extend|count|index|insert|pop|remove|reverse|sort)", line):
-                    if types.BooleanType in var_types[var]: del var_types[var][types.BooleanType]
-                    if types.IntType in var_types[var]: del var_types[var][types.IntType]
-                    if types.FloatType in var_types[var]: del var_types[var][types.FloatType]
-                    if types.NoneType in var_types[var]: del var_types[var][types.NoneType]
-                # look for string methods
-                for methodname in string_methods:
-                    if re.search(var+"( )*.( )*"+methodname, line):
-                        if types.StringType in var_types[var]:
-                            var_types[var] = {types.StringType : var_types[var][types.StringType]}
-                for methodname in int_methods:
-                    if re.search(var+"( )*.( )*"+methodname, line):
-                        if types.IntType in var_types[var]:
-                            var_types[var] = {types.IntType : var_types[var][types.IntType]}
-                for methodname in float_methods:
-                    if re.search(var+"( )*.( )*"+methodname, line):
-                        if types.FloatType in var_types[var]:
-                            var_types[var] = {types.FloatType : var_types[var][types.FloatType]}
-                for methodname in dict_methods:
-                    if re.search(var+"( )*.( )*"+methodname, line):
-                        if types.DictType in var_types[var]:
-                            var_types[var] = {types.DictType : var_types[var][types.DictType]}
+        cutoff = reassigned.get(var)
+        by_row = {}
+        for (row, kind, detail) in usages[var]:
+            if cutoff is None or row < cutoff:
+                by_row.setdefault(row, []).append((kind, detail))
+
+        for row in sorted(by_row):
+            kinds = set(k for (k, d) in by_row[row])
+            methods = set(d for (k, d) in by_row[row] if k == "method")
+            if methods & frozenset(sequence_methods):
+                kinds.add("sequence")
+            for (kind, eliminated) in rules:
+                if kind in kinds:
+                    for t in eliminated:
+                        var_types[var].pop(t, None)
+            for name in sorted(methods):
+                if name in narrowing and narrowing[name] & set(var_types[var]):
+                    var_types[var] = {t: var_types[var][t] for t in narrowing[name]
+                                      if t in var_types[var]}
 
     return var_types
 
-def infer_types(func, lines, var_names, assumed={}):
+def infer_types(func, lines, var_names, assumed={}, options=None, stats=None):
     """Tries to infer a type based on its associated operations given a set of
     assumed types for other parameters.
 
@@ -251,106 +2163,1809 @@ def infer_types(func, lines, var_names, assumed={}):
     func - A function.
     lines - A list of strings representing lines in part of a Python source file.
     var_names - A list of strings representing the variable names used in the parameters.
-    assumed - A dictionary mapping strings corresponding to variable names to the type
-              that it should run with (this method will supply a set of values for each type).
+    assumed - A dictionary mapping some variable names to the collection of types they are
+              limited to (this method will supply a set of values for each type).
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    stats - A dictionary that, if given, is updated with "sampling" (a description of the
+            sampling strategy) and "probes" (the number of calls made to func).
     """
+    counts = count_types(func, lines, var_names, assumed, options, stats)
+    if counts is None:
+        return None
+    return rank_types(var_names, *counts)
 
+def candidate_types(lines, var_names, assumed={}, stats=None):
+    """Returns a dictionary mapping each variable name to a dictionary mapping its
+    possible types to a zero score, after pruning, or None if a variable loses all
+    possible types.
+
+    lines - A list of strings representing lines in part of a Python source file.
+    var_names - A list of strings representing the variable names used in the parameters.
+    assumed - A dictionary mapping some variable names to the collection of types they are
+              limited to, e.g. from the callee they are passed to (see propagated_results).
+    stats - A dictionary that, if given, is updated with "pruned" (the number of
+            (parameter, type) pairs removed by pruning or by assumption).
+    """
     # maps strings of variable names to dictionary mapping types to a numeric score
     # indicating likelihood of the variable's type
-    # e.g. variable name { 'a' : { types.BooleanType: 4, types.StringType: 2 } }
-    var_types = {v: {t: 0 for t in supported_types} for v in var_names}
-    return_types = {t: 0 for t in supported_types}
+    # e.g. variable name { 'a' : { bool: 4, str: 2 } }
+    var_types = {v: {t: 0 for t in supported_types if v not in assumed or t in assumed[v]}
+                 for v in var_names}
 
     # prune unlikely types from each variable's possible set based on scanning
     # the raw source code
     var_types = prune(lines, var_types)
-
+    if stats is not None:
+        stats["pruned"] = len(var_names) * len(supported_types) - \
+                          sum(len(var_types[v]) for v in var_names)
 
     ## CHECK PRUNE RESULTS TO ENSURE EACH VARIABLE STILL HAS POSSIBLE TYPES
     ## OTHERWISE, SAMPLE_TYPE WILL FAIL
     for var in var_types:
         if len(var_types[var]) == 0:
             return None
+    return var_types
+
+def count_types(func, lines, var_names, assumed={}, options=None, stats=None, shard=(0, 1)):
+    """Runs func over sample values and counts, for every variable and for the return
+    value, how many successful calls each type took part in.
+
+    Returns a tuple of a dictionary mapping variable names to dictionaries mapping types
+    to counts, and a dictionary mapping return types to counts. Returns None if a variable
+    loses all possible types during pruning.
+
+    Counts from disjoint shards of the same function can be added together (see
+    merge_counts) to give the counts of the whole probe space.
+
+    func - A function.
+    lines - A list of strings representing lines in part of a Python source file.
+    var_names - A list of strings representing the variable names used in the parameters.
+    assumed - A dictionary mapping some variable names to the collection of types they are
+              limited to.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    stats - A dictionary that, if given, is updated with "sampling" (a description of the
+            sampling strategy), "probes" (the number of calls made to func), "outcomes",
+            "eliminated", "zero_divisions" (the parameters that probes raising
+            ZeroDivisionError divided by, see _zero_divisors), "pruned" (see candidate_types)
+            and "profile" (see new_profile).
+    shard - A tuple (index, count): only every count-th probe, starting at index, is run.
+    """
+    options = make_options(options)
+    profile = None if stats is None else stats.setdefault("profile", new_profile())
+    start = time.time()
+    var_types = candidate_types(lines, var_names, assumed, stats)
+    if profile is not None:
+        profile["timings"]["prune"] += time.time() - start
+    if var_types is None:
+        return None
+    return_types = {t: 0 for t in supported_types}
 
+    start = time.time()
     # now run through the function using sample values from each type
-    # keep track of return values as well
-    perms = sample_type_values(var_names, var_types)
+    # keep track of return values as well; with the adaptive option, alive is the lattice
+    # of (variable, type) pairs still worth probing, shrunk as probes fail; with the
+    # early_stop option, probes run in a shuffled order until the rankings settle; with the
+    # coverage option, probes near those that reach new lines of func run first
+    adaptive = options["adaptive"]
+    sequential = options["early_stop"] is not None
+    guide = None
+    alive = {v: set(var_types[v]) for v in var_names}
+    if sequential or options["coverage"] is not None:
+        perms, space = _shuffled_probes(var_names, var_types, options)
+        if options["coverage"] is not None:
+            perms = guide = CoverageGuide(perms, space, var_names, alive, options["coverage"],
+                                          options["seed"])
+    elif adaptive and options["sampling"] == "exhaustive":
+        perms = _lattice_product(var_names, alive, sample_table())
+        if options["budget"] is not None:
+            perms = itertools.islice(perms, options["budget"])
+    else:
+        perms = sample_type_values(var_names, var_types, options["sampling"], options["strength"],
+                                   options["budget"], options["seed"])
+    if shard != (0, 1):
+        perms = itertools.islice(perms, shard[0], None, shard[1])
+    if profile is not None:
+        profile["timings"]["sampling"] += time.time() - start
+    outcomes = {o: 0 for o in probe_outcomes}
+    eliminated = {}
+    zero_divisions = set()
+    divisors = find_zero_denominators(lines, var_names)
+    classify = failure_classifier(func, lines, var_names) if adaptive else None
+    executor = make_executor(func, options, classify)
     # prevent printing to stdout and stderr during test runs
-    stdout = sys.stdout
-    stderr = sys.stderr
-    sys.stdout = StringIO.StringIO()
-    sys.stderr = StringIO.StringIO()
-    for p in perms:
+    capture = silence_output()
+    try:
+        removed = 0
+        stopped, last_ranking, stable_since = False, None, 0
+        unproven = sum(len(alive[v]) for v in var_names) # live pairs without a success yet
+        sandboxed = options["executor"] == "sandbox"
+        small = (adaptive and sandboxed) or guide is not None
+        batches = _batches(perms, adaptive_batch_size if small else probe_batch_size)
+        if profile is not None:
+            batches = _timed(batches, profile["timings"], "sampling")
+        for batch in batches:
+            while batch:
+                if removed:
+                    batch = [p for p in batch if _is_alive(p, var_names, alive)]
+                    if not batch:
+                        break
+                start = time.time()
+                results = executor.run(batch)
+                if profile is not None:
+                    profile["timings"]["probes"] += time.time() - start
+                    record_slowest(profile["slowest"], zip(executor.durations, batch))
+                if guide is not None:
+                    for (p, arcs) in zip(batch, executor.arcs):
+                        guide.record(p, arcs)
+                for (p, (outcome, return_type, blamed), error) in zip(batch, results,
+                                                                      executor.errors):
+                    outcomes[outcome] += 1
+                    if error == "ZeroDivisionError":
+                        zero_divisions.update(_zero_divisors(p, var_names, divisors))
+                    if blamed is not None and type(p[blamed]) in alive[var_names[blamed]] and \
+                       var_types[var_names[blamed]][type(p[blamed])] == 0:
+                        # eliminate the pair for the rest of the run, unless some probe with
+                        # it has already succeeded, i.e. the failure depends on the value
+                        var, t = var_names[blamed], type(p[blamed])
+                        alive[var].discard(t)
+                        del var_types[var][t]
+                        eliminated.setdefault(var, []).append(stringify_type(t))
+                        removed += 1
+                        unproven -= 1
+                    if outcome != "ok" or (removed and not _is_alive(p, var_names, alive)):
+                        continue
+                    for ndx in range(len(var_names)):
+                        if not var_types[var_names[ndx]][type(p[ndx])]:
+                            unproven -= 1
+                        var_types[var_names[ndx]][type(p[ndx])] += 1
+                    if return_type in return_types:
+                        return_types[return_type] += 1
+                if not unproven:
+                    # every remaining pair has succeeded once, so none can be eliminated
+                    executor.classify = None
+                # executors may stop early after a blamed failure; resubmit the rest
+                batch = batch[len(results):]
+
+                if sequential:
+                    done = sum(outcomes.values())
+                    ranking = _ranking_key(var_names, var_types, return_types, done,
+                                           options["confidence"])
+                    if ranking != last_ranking:
+                        last_ranking, stable_since = ranking, done
+                    elif done - stable_since >= options["early_stop"] or \
+                         ranking_settled(var_names, var_types, return_types, done, space - done,
+                                         options["confidence"]):
+                        stopped = True
+                        break
+            if stopped:
+                break
+    finally:
+        executor.close()
+        # restore print functionality
+        capture.close()
+
+    if stats is not None:
+        stats["probes"] = sum(outcomes.values())
+        stats["outcomes"] = outcomes
+        stats["eliminated"] = eliminated
+        stats["zero_divisions"] = [v for v in var_names if v in zero_divisions]
+        if sequential:
+            stats["stopped_early"] = stopped
+        if sequential or guide is not None:
+            stats["space"] = space
+        if guide is not None:
+            stats["coverage"] = len(guide.arcs)
+            stats["saturated"] = guide.saturated()
+        stats["sampling"] = describe_sampling(options, stats["probes"], outcomes, stats.get("space"))
+
+    return var_types, return_types
+
+def _zero_divisors(args, var_names, divisors):
+    """Returns the list of the parameter a probe that raised ZeroDivisionError divided by:
+    the only one whose argument is a number equal to zero, or else the only denominator
+    found by find_zero_denominators whose argument is. Returns an empty list when the
+    probe does not single out one parameter; sampling runs other probes with a single zero.
+
+    args - The tuple of arguments of the probe.
+    var_names - A list of strings representing the variable names used in the parameters.
+    divisors - The list of parameters returned by find_zero_denominators.
+    """
+    zero = [v for (v, a) in zip(var_names, args) if isinstance(a, numbers.Number) and a == 0]
+    if len(zero) > 1:
+        zero = [v for v in zero if v in divisors]
+    return zero if len(zero) == 1 else []
+
+def _shuffled_probes(var_names, var_types, options):
+    """Returns a tuple of an iterable of the probes of the sampling strategy in options,
+    in a shuffled order seeded by the "seed" option, and the number of probes in it.
+    The exhaustive product is shuffled lazily, without building it.
+
+    var_names - A list of strings representing the variable names used in the parameters.
+    var_types - A dictionary mapping variable names to dictionaries keyed by possible types.
+    options - A dictionary of analysis options (see default_options).
+    """
+    if options["sampling"] != "exhaustive":
+        perms = list(sample_type_values(var_names, var_types, options["sampling"],
+                                        options["strength"], options["budget"], options["seed"]))
+        random.Random(options["seed"]).shuffle(perms)
+        return perms, len(perms)
+
+    table = sample_table()
+    values = [[v for t in ordered_types(var_types[name]) for v in table[t]] for name in var_names]
+    total = 1
+    for v in values:
+        total *= len(v)
+    space = total if options["budget"] is None else min(total, options["budget"])
+
+    def generate():
+        # visit every index once with a step near total / golden ratio (coprime to
+        # total) from a seeded start, which spreads consecutive probes over the space
+        step = max(1, int(total * 0.6180339887))
+        while _gcd(step, total) != 1:
+            step += 1
+        ndx = random.Random(options["seed"]).randrange(total)
+        for i in xrange(space):
+            row, rest = [], ndx
+            for v in reversed(values):
+                rest, r = divmod(rest, len(v))
+                row.append(v[r])
+            yield tuple(reversed(row))
+            ndx = (ndx + step) % total
+    return generate(), space
+
+class CoverageGuide(object):
+    """Orders the probes of a function by the coverage they reach. Iterating over it
+    generates probes, and record is called with the arcs each probe traced (see
+    InlineExecutor.run). Whenever a probe reaches an arc no earlier probe did, its
+    neighbours, i.e. the probe with one parameter changed to a sample value of one of its
+    live types, are queued to run before the remaining probes. Iteration ends once window
+    probes in a row reach nothing new, or the probes run out. No probe is generated twice.
+    """
+
+    def __init__(self, probes, limit, var_names, alive, window, seed):
+        """probes - An iterable of the probes to run when no neighbours are queued.
+        limit - The number of probes to generate at most.
+        var_names - A list of strings representing the variable names used in the parameters.
+        alive - A dictionary mapping each variable name to the set of its live types,
+                which the caller may shrink while iterating.
+        window - The number of probes in a row that must reach nothing new to stop.
+        seed - An integer seeding the choice of neighbours.
+        """
+        self.probes = iter(probes)
+        self.limit = limit
+        self.var_names = var_names
+        self.alive = alive
+        self.window = window
+        self.random = random.Random(seed)
+        self.table = sample_table()
+        self.arcs = set()
+        self.queue = collections.deque()
+        self.tried = set() # reprs, since sample values need not be hashable
+        self.since_new = 0
+
+    def __iter__(self):
+        while len(self.tried) < self.limit and not self.saturated():
+            if self.queue:
+                probe = self.queue.popleft()
+            else:
+                probe = next(self.probes, None)
+                if probe is None:
+                    return
+            key = repr(probe)
+            if key not in self.tried:
+                self.tried.add(key)
+                yield probe
+
+    def record(self, probe, arcs):
+        """Records the set of arcs a probe reached."""
+        if arcs <= self.arcs:
+            self.since_new += 1
+            return
+        self.arcs |= arcs
+        self.since_new = 0
+        for (ndx, var) in enumerate(self.var_names):
+            for t in supported_types:
+                if t in self.alive[var]:
+                    value = self.random.choice(self.table[t])
+                    self.queue.append(probe[:ndx] + (value,) + probe[ndx + 1:])
+
+    def saturated(self):
+        """Returns whether the last window probes reached nothing new."""
+        return self.since_new >= self.window
+
+def _arc_tracer(code, arcs):
+    """Returns a global trace function for sys.settrace that adds the (previous line, line)
+    arcs executed in frames of a code object to a set. The first line of a call is reached
+    from line -1, and returning from a line leads to line -1. Other frames are not traced.
+
+    code - A code object.
+    arcs - A set to add arcs to.
+    """
+    def trace(frame, event, arg):
+        if frame.f_code is not code:
+            return None
+        last = [-1]
+        def local(frame, event, arg):
+            if event == "line":
+                arcs.add((last[0], frame.f_lineno))
+                last[0] = frame.f_lineno
+            elif event == "return":
+                arcs.add((last[0], -1))
+            return local
+        return local
+    return trace
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+def _hoeffding_bound(probes, comparisons, confidence):
+    """Returns the error bound on a success rate estimated from probes probes that holds
+    for all of comparisons comparisons with probability 1 - confidence."""
+    return math.sqrt(math.log(2.0 * max(1, comparisons) / confidence) / (2.0 * probes))
+
+def _ranking_key(var_names, var_types, return_types, probes, confidence):
+    """Returns a comparable summary of the top 5 types of every variable and of the return
+    value, in which adjacent types whose counts are too close to be told apart (within
+    twice the Hoeffding bound) form an unordered group. Types that are tied in
+    expectation, such as those of an unused parameter, then do not keep the ranking from
+    settling by trading places.
+    """
+    groups_of = []
+    for counts in [var_types[v] for v in var_names] + [return_types]:
+        ranked = sorted([(n, t) for (t, n) in counts.items() if n > 0],
+                        key=lambda pair: pair[0], reverse=True)
+        tolerance = 2 * _hoeffding_bound(max(1, probes), len(ranked), confidence) * probes
+        groups, taken = [], 0
+        for (ndx, (n, t)) in enumerate(ranked):
+            if taken >= 5 and (not groups or ranked[ndx-1][0] - n > tolerance):
+                break
+            if groups and ranked[ndx-1][0] - n <= tolerance:
+                groups[-1].add(t)
+            else:
+                groups.append(set([t]))
+            taken += 1
+        groups_of.append(tuple(frozenset(g) for g in groups))
+    return tuple(groups_of)
+
+def ranking_settled(var_names, var_types, return_types, probes, remaining, confidence):
+    """Returns whether further probes cannot reorder the type rankings of rank_types,
+    either for certain (every gap between adjacent counts is larger than the number of
+    probes remaining) or with probability 1 - confidence by Hoeffding's inequality
+    (every gap between adjacent success rates is larger than twice the error bound).
+
+    The gaps checked are those between the ranked types and between the last ranked
+    type and the best unranked one.
+
+    var_names - A list of strings representing the variable names used in the parameters.
+    var_types - A dictionary mapping variable names to dictionaries mapping types to counts.
+    return_types - A dictionary mapping return types to counts.
+    probes - An integer, the number of probes run so far.
+    remaining - An integer, the number of probes left in the probe space.
+    confidence - A number, the probability with which the ranking may still change.
+    """
+    if probes == 0:
+        return remaining <= 0
+    gaps = []
+    for counts in [var_types[v] for v in var_names] + [return_types]:
+        ranked = sorted(counts.values(), reverse=True)[:6]
+        if not ranked or ranked[0] == 0:
+            return False
+        gaps.extend(a - b for (a, b) in zip(ranked, ranked[1:]) if a > 0)
+    if all(gap > remaining for gap in gaps):
+        return True
+    bound = _hoeffding_bound(probes, len(gaps), confidence)
+    return all(gap > 2 * bound * probes for gap in gaps)
+
+def _lattice_product(var_names, alive, table):
+    """Generates the same tuples as the exhaustive strategy of sample_type_values, but
+    consults the lattice alive before each combination of types, so that once a
+    (variable, type) pair is eliminated the combinations using it are skipped without
+    being enumerated.
+
+    var_names - A list of strings representing the variable names used in the parameters.
+    alive - A dictionary mapping variable names to the set of types still possible.
+    table - A dictionary mapping types to lists of sample values.
+    """
+    orders = [ordered_types(alive[v]) for v in var_names]
+    def combinations(ndx, prefix):
+        if ndx == len(var_names):
+            yield prefix
+            return
+        for t in orders[ndx]:
+            if t in alive[var_names[ndx]]:
+                for combination in combinations(ndx + 1, prefix + (t,)):
+                    yield combination
+    for combination in combinations(0, ()):
+        for row in itertools.product(*[table[t] for t in combination]):
+            yield row
+
+def _is_alive(args, var_names, alive):
+    """Returns whether every value in a tuple of arguments has a type still in the lattice."""
+    for ndx in range(len(var_names)):
+        if type(args[ndx]) not in alive[var_names[ndx]]:
+            return False
+    return True
+
+def failure_classifier(func, lines, var_names):
+    """Returns a function (args, exception, traceback) -> index that blames a failed probe
+    of func on a single parameter, or returns None when the failure cannot be pinned on
+    one. Returns None instead of a function if func has no code object. count_types only
+    eliminates a blamed (parameter, type) pair while no probe using it has succeeded.
+
+    A failure is blamed on a parameter when it is a TypeError or AttributeError raised
+    by func's own code (not a callee), the parameter is the only one on the failing line,
+    and its type is quoted in the error message, e.g. 'dict' in "unsupported operand
+    type(s) for +: 'dict' and 'int'". A line using several parameters is never blamed:
+    the message may name only one operand, and the failure may depend on the other's
+    type, as in "a + b" for two tuples. Parameters that are reassigned anywhere in func
+    are never blamed, since the failing line may see the new value.
+
+    func - A function.
+    lines - A list of strings representing the function's source lines, without comments.
+    var_names - A list of strings representing the variable names used in the parameters.
+    """
+    code = getattr(func, "__code__", None)
+    if code is None:
+        return None
+    reassigned = _index_usages(lines[1:], var_names)[1]
+    positions = {v: ndx for (ndx, v) in enumerate(var_names) if v not in reassigned}
+    line_params = {}
+    verdicts = {} # the same line failing the same way for the same types gets the same blame
+
+    def classify(args, exc, tb):
+        if not isinstance(exc, (TypeError, AttributeError)) or tb is None:
+            return None
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        if tb.tb_frame.f_code is not code:
+            return None
+        lineno = tb.tb_lineno
+        key = (lineno, type(exc), tuple(map(type, args)))
+        if key in verdicts:
+            return verdicts[key]
+        if lineno not in line_params:
+            line = linecache.getline(code.co_filename, lineno).strip()
+            names = set(text for (row, kind, text) in _tokenize_lines([line])
+                        if kind == tokenize.NAME and text in var_names)
+            line_params[lineno] = names if len(names) == 1 and names <= set(positions) else set()
+        message = str(exc)
+        # Python 3 quotes some type names in double quotes, e.g. 'str (not "int")'; such a
+        # message names one operand only, which is safe to blame since line_params only
+        # holds lines using a single parameter
+        blamed = [positions[v] for v in line_params[lineno]
+                  if "'%s'" % type(args[positions[v]]).__name__ in message or
+                     '"%s"' % type(args[positions[v]]).__name__ in message]
+        verdicts[key] = blamed[0] if len(blamed) == 1 else None
+        return verdicts[key]
+    return classify
+
+# the possible results of a single probe: the call returned, raised an exception, ran
+# past the sandbox timeout, or killed its sandbox worker (e.g. over the memory limit)
+probe_outcomes = ["ok", "raised", "timeout", "crashed"]
+
+# the number of probes handed to an executor at a time; smaller with the adaptive option
+# so that few sandboxed probes run after the pair they use has been eliminated
+probe_batch_size = 64
+adaptive_batch_size = 8
+
+def make_executor(func, options, classify=None):
+    """Returns the probe executor selected by the "executor" option for func, tracing
+    arcs with the coverage option.
+
+    func - A function.
+    options - A dictionary of analysis options (see default_options).
+    classify - A function returned by failure_classifier, or None.
+    """
+    trace = options["coverage"] is not None
+    if options["executor"] == "sandbox":
+        return SandboxExecutor(func, options["timeout"], options["memory"], classify, trace)
+    return InlineExecutor(func, classify, trace)
+
+def _batches(iterable, size):
+    """Generates lists of up to size consecutive items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _timed(iterable, timings, stage):
+    """Generates the items of iterable, adding the time spent producing them to
+    timings[stage]."""
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
         try:
-            retval = func(*p)
-            for ndx in range(len(var_names)):
-                var_types[var_names[ndx]][type(p[ndx])] += 1
-            if type(retval) in return_types:
-                return_types[type(retval)] += 1
-        except BaseException as e:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[stage] += time.time() - start
+        yield item
+
+class InlineExecutor(object):
+    """Runs probes of a function directly in the current process."""
+
+    def __init__(self, func, classify=None, trace=False):
+        """func - A function.
+        classify - A function returned by failure_classifier, or None.
+        trace - A boolean indicating whether to trace the arcs each call executes.
+        """
+        self.func = func
+        self.call = probe_callable(func)
+        self.classify = classify
+        self.trace = trace
+        self.durations = []
+        self.arcs = []
+        self.errors = []
+
+    def run(self, batch):
+        """Calls the function once per tuple of arguments in batch and returns a list of
+        (outcome, return type, blamed) tuples. The return type is None unless the call
+        returned; blamed is the index of the parameter a failure was pinned on by the
+        classifier, or None. The number of seconds each call took is left in durations,
+        the name of the exception type it raised, or None, in errors and, when tracing,
+        the set of (line, line) arcs it executed in the function's own code (see
+        _arc_tracer) in arcs.
+
+        Stops after the first failure that is blamed on a parameter, so the list may cover
+        only a prefix of batch; the caller resubmits the rest.
+        """
+        results = []
+        self.durations = []
+        self.arcs = []
+        self.errors = []
+        for args in batch:
+            arcs = set()
+            if self.trace:
+                previous = sys.gettrace()
+                sys.settrace(_arc_tracer(self.func.__code__, arcs))
+            start = time.time()
+            try:
+                results.append(("ok", type(self.call(*fresh_arguments(args))), None))
+                self.errors.append(None)
+            except BaseException as e:
+                if self.trace:
+                    sys.settrace(previous)
+                blamed = None if self.classify is None else self.classify(args, e, sys.exc_info()[2])
+                results.append(("raised", None, blamed))
+                self.errors.append(type(e).__name__)
+                if blamed is not None:
+                    break
+            finally:
+                if self.trace:
+                    sys.settrace(previous)
+                self.durations.append(time.time() - start)
+                self.arcs.append(arcs)
+        return results
+
+    def close(self):
+        pass
+
+class SandboxExecutor(object):
+    """Runs probes of a function in a forked worker process, which is reused across
+    probes. Each probe gets a wall-clock timeout, and the worker's address space is
+    capped with RLIMIT_AS. A worker that stalls is killed and a fresh one is forked for
+    the rest of the batch.
+
+    Falls back to running probes inline where fork is unavailable.
+    """
+
+    def __init__(self, func, timeout, memory, classify=None, trace=False):
+        """func - A function.
+        timeout - A number of seconds each probe may run for.
+        memory - A number of bytes of address space the worker may allocate on top of what
+                 it inherits, or None for no limit.
+        classify - A function returned by failure_classifier, run in the worker, or None.
+        trace - A boolean indicating whether to trace the arcs each probe executes.
+        """
+        self.func = func
+        self.timeout = timeout
+        self.memory = memory
+        self.classify = classify
+        self.trace = trace
+        self.pid = None
+        self.durations = []
+        self.arcs = []
+        self.errors = []
+
+    def run(self, batch):
+        """Returns a list of (outcome, return type, blamed) tuples, one per tuple of
+        arguments in batch, as described by InlineExecutor.run. Probes that time out or
+        crash are charged the time waited for them in durations, reach no arcs and raise
+        no error."""
+        if not hasattr(os, "fork"):
+            inline = InlineExecutor(self.func, self.classify, self.trace)
+            results = inline.run(batch)
+            self.durations, self.arcs, self.errors = inline.durations, inline.arcs, inline.errors
+            return results
+        import select
+        results = []
+        self.durations = []
+        self.arcs = []
+        self.errors = []
+        while len(results) < len(batch):
+            if self.pid is None:
+                self._spawn()
+            pending = batch[len(results):]
+            _write_message(self.requests, pending)
+            for args in pending:
+                start = time.time()
+                ready = select.select([self.responses], [], [], self.timeout)[0]
+                response = _read_message(self.responses) if ready else None
+                if response is None:
+                    # stalled or died: charge this probe, then retry the rest on a new worker
+                    results.append(("timeout" if not ready else "crashed", None, None))
+                    self.durations.append(time.time() - start)
+                    self.arcs.append(set())
+                    self.errors.append(None)
+                    self._kill()
+                    break
+                outcome, type_index, blamed, seconds, arcs, error = response
+                results.append((outcome, supported_types[type_index] if type_index >= 0 else None,
+                                blamed))
+                self.durations.append(seconds)
+                self.arcs.append(arcs)
+                self.errors.append(error)
+        return results
+
+    def close(self):
+        """Stops the worker process, if any."""
+        self._kill()
+
+    def _spawn(self):
+        requests_r, requests_w = os.pipe()
+        responses_r, responses_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(requests_w)
+                os.close(responses_r)
+                _sandbox_worker(self.func, requests_r, responses_w, self.memory, self.classify,
+                                self.trace)
+            finally:
+                os._exit(0)
+        os.close(requests_r)
+        os.close(responses_w)
+        self.pid, self.requests, self.responses = pid, requests_w, responses_r
+
+    def _kill(self):
+        if self.pid is None:
+            return
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
             pass
-    # restore print functionality
-    sys.stdout = stdout
-    sys.stderr = stderr
+        os.waitpid(self.pid, 0)
+        os.close(self.requests)
+        os.close(self.responses)
+        self.pid = None
+
+def _sandbox_worker(func, requests, responses, memory, classify, trace=False):
+    """The loop of a SandboxExecutor worker process: reads batches of arguments from the
+    requests pipe and writes one (outcome, type index, blamed, seconds, arcs, error)
+    response per probe, where the type index is the position of the return type in
+    supported_types or -1, arcs is the set of arcs traced, empty unless trace is set, and
+    error is the name of the exception type raised, or None.
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+    if memory is not None and resource is not None:
+        limit = _address_space() + memory
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    index = {t: ndx for (ndx, t) in enumerate(supported_types)}
+    call = probe_callable(func)
+    while True:
+        batch = _read_message(requests)
+        if batch is None:
+            return
+        for args in batch:
+            start = time.time()
+            arcs = set()
+            if trace:
+                sys.settrace(_arc_tracer(func.__code__, arcs))
+            error = None
+            try:
+                response = ("ok", index.get(type(call(*fresh_arguments(args))), -1), None)
+            except BaseException as e:
+                sys.settrace(None)
+                blamed = None if classify is None else classify(args, e, sys.exc_info()[2])
+                response = ("raised", -1, blamed)
+                error = type(e).__name__
+            finally:
+                sys.settrace(None)
+            _write_message(responses, response + (time.time() - start, arcs, error))
+
+def _address_space():
+    """Returns the size in bytes of the current process's address space, or 0 if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (IOError, ValueError):
+        return 0
+
+def _write_message(fd, obj):
+    """Writes a length-prefixed pickle of obj to a file descriptor."""
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    data = struct.pack("!I", len(data)) + data
+    while data:
+        data = data[os.write(fd, data):]
+
+def _read_message(fd):
+    """Reads an object written by _write_message from a file descriptor. Returns None at
+    end of file."""
+    header = _read_exactly(fd, 4)
+    if header is None:
+        return None
+    data = _read_exactly(fd, struct.unpack("!I", header)[0])
+    return None if data is None else pickle.loads(data)
+
+def _read_exactly(fd, size):
+    """Reads size bytes from a file descriptor. Returns None at end of file."""
+    buf = b""
+    while len(buf) < size:
+        chunk = os.read(fd, size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+class _NullStream(object):
+    """A write-only stream that discards everything written to it."""
+
+    def write(self, data):
+        pass
+
+    def writelines(self, lines):
+        pass
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
 
-    # only take top 5 type suggestions
-    return ({v: sorted(filter(lambda x: x[1] > 0, var_types[v].items()), key=lambda x: -x[1])[:5] \
-            for v in var_names}, \
-            sorted(filter(lambda x: x[1] > 0, return_types.items()), key=lambda x: -x[1])[:5])
+class _ThreadStream(object):
+    """Stands in for sys.stdout or sys.stderr while some thread's output is silenced:
+    writes from silenced threads are discarded, and writes from other threads go to the
+    stream it replaced."""
 
-def sample_type_values(var_names, var_types):
-    """Provides all permutations of values that should be assigned to each variable in the
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _target(self):
+        return _null_stream if getattr(_silenced, "depth", 0) else self.stream
+
+    def write(self, data):
+        self._target().write(data)
+
+    def writelines(self, lines):
+        self._target().writelines(lines)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+# the state shared by silence_output calls: the per-thread nesting depth of silenced
+# sections, and the number of open sections in all threads with the streams they replaced
+_null_stream = _NullStream()
+_silenced = threading.local()
+_silence_lock = threading.Lock()
+_silence_state = {"open": 0, "streams": None}
+
+class silence_output(object):
+    """Discards what the calling thread writes to sys.stdout and sys.stderr until closed,
+    without buffering it. Other threads keep writing to the real streams, so several
+    analyses can run at once in a thread pool. The streams are swapped for _ThreadStream
+    proxies when the first section opens and restored when the last one closes.
+
+    Can be used as a context manager, or closed explicitly; closing twice does nothing.
+    """
+
+    def __init__(self):
+        self.closed = True
+        with _silence_lock:
+            try:
+                if _silence_state["open"] == 0:
+                    _silence_state["streams"] = (sys.stdout, sys.stderr)
+                    sys.stdout = _ThreadStream(sys.stdout)
+                    sys.stderr = _ThreadStream(sys.stderr)
+            finally:
+                # counted even if interrupted above, so that close always balances it
+                _silence_state["open"] += 1
+                _silenced.depth = getattr(_silenced, "depth", 0) + 1
+                self.closed = False
+
+    def close(self):
+        with _silence_lock:
+            if self.closed:
+                return
+            self.closed = True
+            _silenced.depth -= 1
+            _silence_state["open"] -= 1
+            if _silence_state["open"] == 0:
+                # unconditionally, in case a probe replaced the streams itself
+                sys.stdout, sys.stderr = _silence_state["streams"]
+                _silence_state["streams"] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def merge_counts(counts):
+    """Adds together a list of count_types results for disjoint shards of one function.
+    Returns None if any of them is None.
+
+    counts - A non-empty list of values returned by count_types.
+    """
+    if any(c is None for c in counts):
+        return None
+    var_types = {v: dict(t) for (v, t) in counts[0][0].items()}
+    return_types = dict(counts[0][1])
+    for (vt, rt) in counts[1:]:
+        for v in vt:
+            for t in vt[v]:
+                var_types[v][t] = var_types[v].get(t, 0) + vt[v][t]
+        for t in rt:
+            return_types[t] = return_types.get(t, 0) + rt[t]
+    return var_types, return_types
+
+# the stages of analyzing a function that are timed, in order, and the number of the
+# slowest probes of each function that are kept
+profile_stages = ["source", "prune", "sampling", "probes"]
+slowest_probes = 5
+
+def new_profile():
+    """Returns an empty profile of the analysis of a function, a dictionary with the keys:
+        timings - a dictionary mapping each of profile_stages to the seconds spent in it:
+                  removing comments, pruning, generating probes and running them.
+        slowest - a list of up to slowest_probes [seconds, arguments] pairs, slowest
+                  first, where arguments is the repr of the tuple of arguments.
+    """
+    return {"timings": {s: 0.0 for s in profile_stages}, "slowest": []}
+
+def record_slowest(slowest, probes):
+    """Merges probes into a list of the slowest probes, as described by new_profile.
+
+    slowest - A list of [seconds, arguments] pairs, slowest first, updated in place.
+    probes - An iterable of (seconds, arguments) pairs, where arguments is a tuple or
+             the repr of one.
+    """
+    for (seconds, args) in probes:
+        if len(slowest) == slowest_probes and seconds <= slowest[-1][0]:
+            continue
+        slowest.append([seconds, args if isinstance(args, str) else repr(args)])
+        slowest.sort(key=lambda pair: -pair[0])
+        del slowest[slowest_probes:]
+
+def merge_stats(stats, options):
+    """Combines the statistics collected by count_types for disjoint shards of one function.
+    Every shard prunes the same candidates, so pruning is counted once but timed in all.
+
+    stats - A list of dictionaries filled in by count_types; empty ones are ignored.
+    options - A dictionary of analysis options (see default_options).
+    """
+    if not any(stats):
+        return {}
+    outcomes = {o: 0 for o in probe_outcomes}
+    eliminated = {}
+    profile = new_profile()
+    zero_divisions = set()
+    for s in stats:
+        for (o, n) in s.get("outcomes", {}).items():
+            outcomes[o] += n
+        zero_divisions.update(s.get("zero_divisions", []))
+        for (v, names) in s.get("eliminated", {}).items():
+            eliminated.setdefault(v, []).extend(n for n in names if n not in eliminated.get(v, []))
+        if "profile" in s:
+            for (stage, seconds) in s["profile"]["timings"].items():
+                profile["timings"][stage] += seconds
+            record_slowest(profile["slowest"], s["profile"]["slowest"])
+    merged = {"profile": profile}
+    if any("pruned" in s for s in stats):
+        merged["pruned"] = max(s.get("pruned", 0) for s in stats)
+    if any("outcomes" in s for s in stats): # i.e. not pruned down to nothing
+        probes = sum(outcomes.values())
+        merged.update({"probes": probes, "outcomes": outcomes, "eliminated": eliminated,
+                       "zero_divisions": sorted(zero_divisions),
+                       "sampling": describe_sampling(options, probes, outcomes)})
+    return merged
+
+def rank_types(var_names, var_types, return_types):
+    """Returns the tuple described by infer_types from type counts: for each variable and
+    for the return value, the (type, count) pairs with a positive count, most likely
+    first, ties broken by the order of supported_types.
+
+    var_names - A list of strings representing the variable names used in the parameters.
+    var_types - A dictionary mapping variable names to dictionaries mapping types to counts.
+    return_types - A dictionary mapping return types to counts.
+    """
+    def ranked(counts):
+        # only take top 5 type suggestions
+        order = ordered_types(counts)
+        return sorted(filter(lambda x: x[1] > 0, [(t, counts[t]) for t in order]),
+                      key=lambda x: -x[1])[:5]
+    return ({v: ranked(var_types[v]) for v in var_names}, ranked(return_types))
+
+def sample_type_values(var_names, var_types, strategy="exhaustive", strength=2, budget=None,
+                       seed=0):
+    """Provides combinations of values that should be assigned to each variable in the
     list. Each type that can be assigned to a variable may take on multiple values.
-    Returns an itertools object of tuples (whose values are those that should be assigned
+    Returns an iterable of tuples (whose values are those that should be assigned
     to the variables specified in var_names, in respective order).
 
+    The strategies are:
+        exhaustive - every permutation of every sample value (an itertools object).
+        covering   - a t-wise covering array over the possible types of the variables,
+                     so every combination of types for any `strength` variables appears
+                     at least once, padded until every sample value of every variable
+                     has been used. Its size grows roughly linearly with the number of
+                     variables rather than exponentially.
+        random     - `budget` combinations drawn without replacement from the
+                     permutations, using a random generator seeded with `seed`.
+
     Each variable in var_types must have at least one possible type.
 
     var_names - A list of strings representing the variable names used in the parameters.
     var_types - A dictionary mapping strings of variable names to a dictionary mapping
                  types to a numeric score indicating likelihood of the variable's type.
+    strategy - A string naming one of the strategies above.
+    strength - An integer t for the covering strategy (2 gives pairwise coverage).
+    budget - An integer capping the number of combinations provided, or None for no cap.
+             The random strategy uses default_random_budget when None.
+    seed - An integer seeding the random strategy.
     """
-    table = {
-        types.BooleanType   : [True, False, True, False, True]
-    ,   types.IntType       : [-100, 1, 0, 1, 100]
-    ,   types.FloatType     : [-1.1, -0.73, 0.0, 0.34, 2.999]
-    ,   types.StringType    : ["", "\n", " ", "Hello", "H3llo\n W0rld!"]
-    ,   types.TupleType     : [(), (0,1), (2,"zz", False), ("a","b","c"), ([1,2,3], 4)]
-    ,   types.ListType      : [ [], [-1.1, "zzz"], [[], [[0]], [0,1]], ["a","b","c"], [1,2,3] ]
-    ,   types.DictType      : [{}, {"a": 3}, {1:{1,2}, 4:3}, {0:"h"}, {"b":"c"}]
-    ,   types.NoneType      : [None, None, None, None, None]
-    }
-
-    # set up possible values across all types for each variable
-    values = var_names[:]
-    for ndx in range(len(var_names)):
-        buf = []
-        for t in var_types[var_names[ndx]]:
-            for v in table[t]:
-                buf.append(v)
-        values[ndx] = buf
+    table = sample_table()
 
-    return itertools.product(*values)
+    # set up possible types and values for each variable, in a stable order
+    var_type_lists = [ordered_types(var_types[v]) for v in var_names]
+    values = [[v for t in tl for v in table[t]] for tl in var_type_lists]
 
+    if strategy == "exhaustive":
+        perms = itertools.product(*values)
+        return perms if budget is None else itertools.islice(perms, budget)
+    elif strategy == "covering":
+        rows = _covering_rows(var_type_lists, table, strength)
+        return rows if budget is None else rows[:budget]
+    elif strategy == "random":
+        return _random_rows(values, default_random_budget if budget is None else budget, seed)
+    raise ValueError("Unknown sampling strategy: " + str(strategy))
 
-if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print "Please supply exactly one target file name."
-    elif not os.path.isfile(sys.argv[1]):
-        print "Specified input is not a file."
+def sample_table():
+    """Returns a dictionary mapping each supported type to a list of distinct sample values,
+    the first share of its entry's samples given by the entry's weight.
+    The values are templates shared by every probe that uses them; executors hand each
+    call a copy from fresh_arguments, so that targets mutating their arguments do not
+    change the inputs of later probes."""
+    table = {}
+    for t in supported_types:
+        entry = type_registry[t]
+        samples = entry.samples()
+        table[t] = samples[:max(1, int(round(len(samples) * entry.weight)))]
+    return table
+
+def _fresh_tuple(value):
+    items = tuple(fresh_value(v) for v in value)
+    # a tuple of immutable values is itself immutable, so it is reused
+    return value if all(a is b for (a, b) in zip(items, value)) else items
+
+# the functions rebuilding a mutable sample value from its template, by type; values of
+# other types are immutable and reused as they are
+_rebuilders = {
+    list    : lambda value: [fresh_value(v) for v in value]
+,   dict    : lambda value: {k: fresh_value(v) for (k, v) in value.items()}
+,   set     : set
+,   tuple   : _fresh_tuple
+}
+
+def fresh_value(value):
+    """Returns a copy of a sample value that shares no mutable part with it, or the value
+    itself if it is immutable (or of a registered type without a rebuild function)."""
+    rebuild = _rebuilders.get(type(value))
+    if rebuild is None:
+        entry = type_registry.get(type(value))
+        rebuild = entry.rebuild if entry is not None else None
+    return value if rebuild is None else rebuild(value)
+
+def fresh_arguments(args):
+    """Returns a tuple of fresh copies (see fresh_value) of a tuple of sample values."""
+    return tuple(fresh_value(v) for v in args)
+
+def ordered_types(type_scores):
+    """Returns the types in a collection of types (e.g. a dictionary keyed by type) in
+    the order of supported_types, so that sampling is reproducible between runs.
+
+    type_scores - A collection of types.
+    """
+    rank = {t: ndx for (ndx, t) in enumerate(supported_types)}
+    return sorted(type_scores, key=lambda t: (rank.get(t, len(rank)), repr(t)))
+
+def _covering_rows(var_type_lists, table, strength):
+    """Returns a list of value tuples forming a covering array of the given strength
+    over the types of each variable, built greedily. Sample values are handed out
+    round-robin for each (variable, type) pair, then extra rows are appended until every
+    sample value of every variable has appeared at least once.
+
+    var_type_lists - A list holding, for each variable, a list of its possible types.
+    table - A dictionary mapping types to lists of sample values.
+    strength - An integer, the number of variables whose type combinations are covered.
+    """
+    n = len(var_type_lists)
+    if n == 0:
+        return [()]
+    t = max(1, min(strength, n))
+    sizes = [len(tl) for tl in var_type_lists]
+
+    # every t-way combination of (variable index, type index) still to cover
+    uncovered = set()
+    for cols in itertools.combinations(range(n), t):
+        for picks in itertools.product(*[range(sizes[c]) for c in cols]):
+            uncovered.add((cols, picks))
+
+    type_rows = []
+    while uncovered:
+        cols, picks = min(uncovered)
+        row = [None] * n
+        for (c, k) in zip(cols, picks):
+            row[c] = k
+        for c in range(n):
+            if row[c] is not None:
+                continue
+            best, best_gain = 0, -1
+            for k in range(sizes[c]):
+                row[c] = k
+                gain = 0
+                assigned = [j for j in range(n) if row[j] is not None and j != c]
+                for others in itertools.combinations(assigned, t - 1):
+                    key_cols = tuple(sorted(others + (c,)))
+                    if (key_cols, tuple(row[j] for j in key_cols)) in uncovered:
+                        gain += 1
+                if gain > best_gain:
+                    best, best_gain = k, gain
+            row[c] = best
+        for cols in itertools.combinations(range(n), t):
+            uncovered.discard((cols, tuple(row[c] for c in cols)))
+        type_rows.append(row)
+
+    # assign concrete values, cycling through each type's samples per variable
+    used = [set() for _ in range(n)]
+    cursor = {}
+    def next_value(c, k):
+        samples = table[var_type_lists[c][k]]
+        ndx = cursor.get((c, k), 0)
+        cursor[(c, k)] = ndx + 1
+        used[c].add((k, ndx % len(samples)))
+        return samples[ndx % len(samples)]
+
+    rows = [tuple(next_value(c, row[c]) for c in range(n)) for row in type_rows]
+    unused = [[(k, ndx) for k in range(sizes[c]) for ndx in range(len(table[var_type_lists[c][k]]))
+               if (k, ndx) not in used[c]] for c in range(n)]
+    for r in range(max(len(u) for u in unused)):
+        row = []
+        for c in range(n):
+            if r < len(unused[c]):
+                k, ndx = unused[c][r]
+                row.append(table[var_type_lists[c][k]][ndx])
+            else:
+                row.append(next_value(c, r % sizes[c]))
+        rows.append(tuple(row))
+    return rows
+
+def _random_rows(values, budget, seed):
+    """Returns a list of up to budget distinct value tuples drawn from the product of
+    values, without building the product.
+
+    values - A list holding, for each variable, a list of its sample values.
+    budget - An integer, the maximum number of tuples returned.
+    seed - An integer seeding the random generator.
+    """
+    total = 1
+    for v in values:
+        total *= len(v)
+    if total <= budget:
+        return list(itertools.product(*values))
+    # indices are drawn per variable, since the product can exceed what sample accepts
+    rng = random.Random(seed)
+    picks = []
+    seen = set()
+    while len(picks) < budget:
+        pick = tuple(rng.randrange(len(v)) for v in values)
+        if pick not in seen:
+            seen.add(pick)
+            picks.append(pick)
+    return [tuple(v[r] for (v, r) in zip(values, pick)) for pick in picks]
+
+def describe_sampling(options, probes, outcomes=None, space=None):
+    """Returns a short string naming the sampling strategy in options and the number of
+    probes executed with it, noting any that timed out or crashed.
+
+    options - A dictionary of analysis options (see default_options).
+    probes - An integer, the number of probes executed.
+    outcomes - A dictionary mapping each of probe_outcomes to a count, or None.
+    space - An integer, the number of probes available when stopping early, or None.
+    """
+    strategy = options["sampling"]
+    if strategy == "covering":
+        strategy = "pairwise" if options["strength"] == 2 else "%d-wise" % options["strength"]
+        strategy += " covering"
+    elif strategy == "random":
+        strategy += " (seed %d)" % options["seed"]
+    if options["adaptive"]:
+        strategy += ", adaptive"
+    if options["early_stop"] is not None:
+        strategy += ", sequential"
+    if options["coverage"] is not None:
+        strategy += ", coverage-guided"
+    if space is not None and probes < space:
+        description = "%s, %d of %d probes" % (strategy, probes, space)
+    else:
+        description = "%s, %d probes" % (strategy, probes)
+    if outcomes is not None:
+        if outcomes["timeout"]:
+            description += ", %d timed out" % outcomes["timeout"]
+        if outcomes["crashed"]:
+            description += ", %d crashed" % outcomes["crashed"]
+    return description
+
+
+# seconds between checks of the served files for changes
+watch_interval = 0.5
+
+class AnalysisServer(object):
+    """Answers analysis requests on a Unix socket, keeping the records of each requested
+    file, and the results of its functions, in memory. Served files are checked for
+    changes between requests and analyzed again as soon as they change: a changed file is
+    imported again, but only the functions whose code, source, globals or callees changed
+    are probed (see ResultCache.key).
+    Unchanged files are neither imported nor probed again. A file is not analyzed again
+    when only a module it imports changes.
+
+    A request is one line of JSON, either {"paths": [...]}, naming files and directories by
+    absolute paths, which is answered by the records of analyze_paths, one per line, before
+    the connection is closed, or {"stop": true}, which stops the server.
+    """
+
+    def __init__(self, path, options=None, cache=None, static=False, interval=watch_interval):
+        """path - A string naming the socket to listen on.
+        options - A dictionary of analysis options (see default_options), or None for the
+                  defaults, used for every request.
+        cache - A ResultCache to keep results in across runs of the server too, or None.
+        static - A boolean indicating whether to analyze files without importing them.
+        interval - A number, the seconds between checks of the served files for changes.
+        """
+        self.path = path
+        self.options = options
+        self.cache = cache
+        self.static = static
+        self.interval = interval
+        self.files = {} # filepath -> {"stamp", "records", "cache"}
+        self.loads = 0 # files imported or parsed
+
+    def records(self, filepath):
+        """Returns the list of records of a file, analyzing it if it is new or changed."""
+        try:
+            stamp = _file_stamp(filepath)
+        except OSError as e:
+            self.files.pop(filepath, None)
+            return [{"file": filepath, "error": _describe_exception(e)}]
+        served = self.files.setdefault(filepath, {"stamp": None, "records": [],
+                                                  "cache": MemoryCache(self.cache)})
+        if served["stamp"] != stamp:
+            served["stamp"] = stamp
+            served["records"] = self._analyze(filepath, served["cache"])
+            served["cache"].sweep()
+        return served["records"]
+
+    def _analyze(self, filepath, cache):
+        self.loads += 1
+        if self.static:
+            return list(file_records(filepath, None, None, self.options, 1, cache))
+        for (filepath, mod, error, seconds) in load_modules([filepath]):
+            return list(file_records(filepath, mod, error, self.options, 1, cache))
+
+    def refresh(self):
+        """Analyzes the served files that changed since they were last analyzed."""
+        for filepath in sorted(self.files):
+            self.records(filepath)
+
+    def handle(self, connection):
+        """Answers the request on a connection. Returns False if the server should stop."""
+        try:
+            request = json.loads(connection.makefile("r").readline())
+            paths = [str(p) for p in request.get("paths", [])]
+        except (ValueError, AttributeError, TypeError) as e:
+            emit_jsonl([{"error": "bad request (%s)" % _describe_exception(e)}],
+                       connection.makefile("w"))
+            return True
+        if request.get("stop"):
+            return False
+        out = connection.makefile("w")
+        emit_jsonl((record for filepath in discover_files(paths)
+                    for record in self.records(filepath)), out)
+        return True
+
+    def serve_forever(self):
+        """Listens on the socket, answering requests one at a time and checking the served
+        files for changes whenever no request has arrived for interval seconds, until a
+        stop request. A socket left behind by an earlier server is replaced."""
+        import select
+        import socket
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.remove(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            listener.listen(8)
+            running = True
+            while running:
+                if not select.select([listener], [], [], self.interval)[0]:
+                    self.refresh()
+                    continue
+                connection = listener.accept()[0]
+                try:
+                    running = self.handle(connection)
+                except socket.error: # the client went away
+                    pass
+                finally:
+                    connection.close()
+        finally:
+            listener.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+def _file_stamp(filepath):
+    """Returns a tuple that changes whenever the file is written to. Raises OSError if the
+    file does not exist."""
+    info = os.stat(filepath)
+    return info.st_mtime, info.st_size, info.st_ino
+
+def request_analysis(path, paths):
+    """Generates the records an AnalysisServer answers for a list of files and directories.
+
+    path - A string naming the socket the server listens on.
+    paths - A list of strings naming files and directories, relative to the current one.
+    """
+    import socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall(_bytes(json.dumps({"paths": [os.path.abspath(p) for p in paths]}) + "\n"))
+        for line in client.makefile("r"):
+            yield _plain(json.loads(line))
+    finally:
+        client.close()
+
+def stop_server(path):
+    """Stops the AnalysisServer listening on a socket.
+
+    path - A string naming the socket the server listens on.
+    """
+    import socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall(_bytes(json.dumps({"stop": True}) + "\n"))
+    finally:
+        client.close()
+
+# seconds a worker's lease on a shard of a WorkQueue lasts unless the worker renews it
+lease_seconds = 60.0
+# units of work (see file_units) per shard of a WorkQueue
+default_shard_size = 20
+
+def file_units(filepath, mod, options=None):
+    """Returns the list of the units of work of a file in a WorkQueue, in the order of its
+    records: the name of each function, then of each class, whose methods are analyzed
+    together, or [None], standing for the whole file, when its functions are analyzed
+    together (with the propagate option) or it cannot be parsed.
+
+    filepath - A string indicating the location of the file.
+    mod - The imported file, or None if it is analyzed statically.
+    options - A dictionary of analysis options (see default_options), or None for the defaults.
+    """
+    if mod is None:
+        try:
+            return [f.__name__ for f in static_functions(filepath)]
+        except (SyntaxError, TypeError, IOError):
+            return [None]
+    if make_options(options)["propagate"]:
+        return [None]
+    return [f.__name__ for f in get_functions(mod)] + [c.__name__ for c in get_classes(mod)]
+
+class WorkQueue(object):
+    """A queue of analysis work in a directory shared by every machine taking part. The
+    coordinator (see create) lists the units of work of every file (see file_units) and
+    splits them into shards of consecutive units. Workers (see run_worker) claim a shard by
+    creating its lease file, renew the lease while they analyze it, and write the records
+    of the shard to its results file before removing the lease. A lease that is not
+    renewed for lease seconds, because its worker died, expires, and the shard is claimed
+    again; a shard may then be analyzed twice, which is harmless since results files are
+    written atomically. Once every shard has results, merge generates the records of
+    analyze_paths for the same files, in the same order.
+
+    Leases expire by the modification times of their files, so the clocks of the machines
+    must agree.
+    """
+
+    def __init__(self, directory, lease=lease_seconds):
+        """directory - A string naming the directory of the queue.
+        lease - A number, the seconds a lease lasts unless it is renewed.
+        """
+        self.directory = directory
+        self.lease = lease
+        self._settings = None
+
+    def create(self, paths, options=None, static=False, types=(),
+               shard_size=default_shard_size):
+        """Lists the units of work of the files found under paths, importing each file
+        unless static, and writes the queue. Returns the number of shards. Raises
+        ValueError if the directory already holds a queue.
+
+        paths - A list of strings naming files and directories, relative to the current
+                directory, which workers resolve the same way wherever they run.
+        options - A dictionary of analysis options (see default_options), or None for the
+                  defaults, used by every worker.
+        static - A boolean indicating whether to analyze every file without importing it.
+        types - A list of the types to register in every worker, named as by load_type.
+        shard_size - An integer, the number of units of work per shard.
+        """
+        if os.path.exists(self._path("queue.json")):
+            raise ValueError("%s already holds a queue" % self.directory)
+        filepaths = list(discover_files(paths))
+        if static:
+            loaded = ((filepath, None, None, 0.0) for filepath in filepaths)
+        else:
+            loaded = load_modules(filepaths)
+        units = [[filepath, name] for (filepath, mod, error, seconds) in loaded
+                 for name in file_units(filepath, mod, options)]
+        for name in ("leases", "results"):
+            if not os.path.isdir(self._path(name)):
+                os.makedirs(self._path(name))
+        self._settings = {"cwd": os.getcwd(), "files": filepaths, "units": units,
+                          "shard_size": shard_size, "options": make_options(options),
+                          "static": static, "types": list(types)}
+        self._write(self._path("queue.json"), self._settings)
+        return self.shards()
+
+    def settings(self):
+        """Returns the dictionary describing the queue, with the keys:
+            cwd        - the directory the paths of the files are relative to.
+            files      - the list of the paths of the files, in order.
+            units      - the list of the [filepath, name] units of work, in order.
+            shard_size - the number of units per shard.
+            options    - the dictionary of analysis options.
+            static     - whether files are analyzed without being imported.
+            types      - the list of the types to register, named as by load_type.
+        """
+        if self._settings is None:
+            with open(self._path("queue.json")) as f:
+                self._settings = _plain(json.load(f))
+        return self._settings
+
+    def register_types(self):
+        """Registers the types of the queue in this process (see register_type)."""
+        for spec in self.settings()["types"]:
+            register_type(load_type(spec))
+
+    def shards(self):
+        """Returns the number of shards."""
+        settings = self.settings()
+        return (len(settings["units"]) + settings["shard_size"] - 1) // settings["shard_size"]
+
+    def units(self, shard):
+        """Returns the list of the [filepath, name] units of work of a shard."""
+        size = self.settings()["shard_size"]
+        return self.settings()["units"][shard * size:(shard + 1) * size]
+
+    def pending(self):
+        """Returns the list of the shards that have no results yet."""
+        return [shard for shard in range(self.shards())
+                if not os.path.exists(self._results_path(shard))]
+
+    def claim(self, worker):
+        """Leases a shard that has no results yet and no unexpired lease to a worker, and
+        returns it, or returns None if there is none.
+
+        worker - A string naming the worker, written to the lease for people to read.
+        """
+        for shard in self.pending():
+            path = self._lease_path(shard)
+            try:
+                if time.time() - os.stat(path).st_mtime < self.lease:
+                    continue
+                os.remove(path) # expired
+            except OSError: # not leased, or the lease was just removed
+                pass
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except OSError: # claimed by another worker meanwhile
+                continue
+            try:
+                os.write(fd, _bytes(worker + "\n"))
+            finally:
+                os.close(fd)
+            if not os.path.exists(self._results_path(shard)):
+                return shard
+            self.release(shard) # completed meanwhile
+        return None
+
+    def renew(self, shard):
+        """Renews the lease on a shard."""
+        try:
+            os.utime(self._lease_path(shard), None)
+        except OSError:
+            pass
+
+    def release(self, shard):
+        """Removes the lease on a shard."""
+        try:
+            os.remove(self._lease_path(shard))
+        except OSError:
+            pass
+
+    def complete(self, shard, results):
+        """Writes the results of a shard and removes its lease.
+
+        shard - An integer, the shard.
+        results - A dictionary returned by shard_results.
+        """
+        self._write(self._results_path(shard), results)
+        self.release(shard)
+
+    def merge(self, report=None):
+        """Reads the results of every shard and returns a generator of their records, in
+        the order of analyze_paths. Raises ValueError if some shards have no results yet
+        or a results file is not valid JSON, and IOError if one cannot be read.
+
+        report - A StatsReport to add the files and the records to, or None.
+        """
+        pending = self.pending()
+        if pending:
+            raise ValueError("%d of the %d shards in %s have no results yet" %
+                             (len(pending), self.shards(), self.directory))
+        shards = []
+        for shard in range(self.shards()):
+            with open(self._results_path(shard)) as f:
+                shards.append(_plain(json.load(f)))
+        return self._merged(shards, report)
+
+    def _merged(self, shards, report):
+        if report is not None:
+            for filepath in self.settings()["files"]:
+                imports = [r["imports"][filepath] for r in shards if filepath in r["imports"]]
+                report.add_file(filepath, imports[0] if imports else 0.0)
+        for results in shards:
+            for record in results["records"]:
+                if report is not None:
+                    report.add(record)
+                yield record
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _lease_path(self, shard):
+        return os.path.join(self.directory, "leases", "%06d.lease" % shard)
+
+    def _results_path(self, shard):
+        return os.path.join(self.directory, "results", "%06d.json" % shard)
+
+    def _write(self, path, data):
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, "w") as f:
+            json.dump(data, f, sort_keys=True)
+        os.rename(temp, path)
+
+def shard_results(queue, shard, cache=None):
+    """Analyzes the units of work of a shard of a WorkQueue, importing each of their files
+    once, and returns a dictionary with the keys:
+        records - the list of the records of the units, in order, as analyze_paths
+                  generates them for the files.
+        imports - a dictionary mapping each file to the seconds spent importing it.
+
+    queue - A WorkQueue.
+    shard - An integer, the shard.
+    cache - A ResultCache to reuse the results of unchanged functions from, or None; not a
+            DedupCache, whose duplicates would depend on which shards were analyzed.
+    """
+    settings = queue.settings()
+    groups = [(filepath, [name for (f, name) in units]) for (filepath, units) in
+              itertools.groupby(queue.units(shard), lambda unit: unit[0])]
+    located = [os.path.join(settings["cwd"], filepath) for (filepath, names) in groups]
+    if settings["static"]:
+        loaded = ((filepath, None, None, 0.0) for filepath in located)
     else:
-        analyze(sys.argv[1])
+        loaded = load_modules(located)
+    results = {"records": [], "imports": {}}
+    for ((filepath, names), (path, mod, error, seconds)) in zip(groups, loaded):
+        results["imports"][filepath] = round(seconds, 6)
+        for record in file_records(path, mod, error, settings["options"], 1, cache,
+                                   names=None if None in names else set(names)):
+            record["file"] = filepath
+            results["records"].append(record)
+    return results
 
+def run_worker(directory, cache=None, lease=lease_seconds):
+    """Claims the shards of the WorkQueue in a directory one at a time, analyzes them
+    with the options of the queue and writes back their results, renewing the lease on
+    each shard from another thread while it is analyzed, until every shard has results.
+    Shards leased to other workers are waited for, in case their leases expire. Returns
+    the number of shards this worker analyzed.
 
+    directory - A string naming the directory of the queue.
+    cache - A ResultCache to reuse the results of unchanged functions from, or None; not a
+            DedupCache, whose duplicates would depend on which shards were analyzed.
+    lease - A number, the seconds a lease lasts unless it is renewed.
+    """
+    import socket
+    queue = WorkQueue(directory, lease)
+    queue.register_types()
+    worker = "%s:%d" % (socket.gethostname(), os.getpid())
+    analyzed = 0
+    while True:
+        shard = queue.claim(worker)
+        if shard is None:
+            if not queue.pending():
+                return analyzed
+            time.sleep(lease / 4.0)
+            continue
+        done = threading.Event()
+        def renew(shard=shard):
+            while not done.wait(lease / 4.0):
+                queue.renew(shard)
+        renewer = threading.Thread(target=renew)
+        renewer.daemon = True
+        renewer.start()
+        try:
+            results = shard_results(queue, shard, cache)
+        finally:
+            done.set()
+            renewer.join()
+        queue.complete(shard, results)
+        analyzed += 1
 
+def _run_worker(task):
+    """Runs run_worker in a process of a multiprocessing pool, with a tuple of its
+    arguments."""
+    return run_worker(*task)
 
+def print_records(records, headers=False):
+    """Prints records in the text format of analyze, without the docstring check.
 
+    records - An iterable of records returned by analyze_paths.
+    headers - A boolean indicating whether to print the name of each file before its records.
+    """
+    filepath = None
+    for record in records:
+        if headers and record.get("file") != filepath:
+            filepath = record.get("file")
+            print("="*80)
+            print(filepath)
+        if "error" in record:
+            print("Cannot analyze %s (%s)" % (record.get("file"), record["error"]))
+            continue
+        print("-"*80)
+        print(record["qualname"])
+        print()
+        print(format_recommendation(_result_from_json(record)))
+    print("-"*80)
 
+def parse_args(argv):
+    """Returns the parsed command line arguments.
 
+    argv - A list of strings representing the command line arguments, excluding the program name.
+    """
+    parser = argparse.ArgumentParser(description="Recommends parameter and return types "
+                                                 "for the functions in Python source files.")
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        help="a Python source file, or a directory to search for them")
+    parser.add_argument("--format", choices=["text", "jsonl"], default="text",
+                        help="text reports, or one JSON record per function as it finishes")
+    parser.add_argument("--static", action="store_true",
+                        help="analyze the source alone, without importing or running it")
+    parser.add_argument("--sampling", choices=sampling_strategies, default="exhaustive",
+                        help="how sample values are combined into probes (default: exhaustive)")
+    parser.add_argument("--strength", type=int, default=2,
+                        help="t for t-wise covering arrays (default: 2, pairwise)")
+    parser.add_argument("--budget", type=int, default=None,
+                        help="maximum number of probes per function")
+    parser.add_argument("--seed", type=int, default=0, help="seed for random sampling")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="stop probing a (parameter, type) pair once a probe fails on "
+                             "a line using no other parameter, with an error naming the type")
+    parser.add_argument("--early-stop", type=int, default=None, metavar="WINDOW",
+                        help="probe in shuffled order and stop once the type rankings "
+                             "have not changed for WINDOW probes")
+    parser.add_argument("--confidence", type=float, default=0.05,
+                        help="with --early-stop, also stop once the rankings can change "
+                             "with at most this probability (default: 0.05)")
+    parser.add_argument("--coverage", type=int, default=None, metavar="WINDOW",
+                        help="trace the lines each probe reaches, run probes near new ones "
+                             "first, and stop once WINDOW probes in a row reach nothing new")
+    parser.add_argument("--propagate", action="store_true",
+                        help="analyze callees first and limit the parameters their callers "
+                             "pass straight on to the types inferred for the callee")
+    parser.add_argument("--types", default=None, metavar="NAME[,NAME...]",
+                        help="register more types to infer: any of %s, or module:attribute "
+                             "naming a TypeEntry" % ", ".join(sorted(extra_types)))
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes to probe functions with (default: 1)")
+    parser.add_argument("--sandbox", action="store_true",
+                        help="run probes in forked workers with a timeout and memory limit")
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        help="seconds each sandboxed probe may run for (default: 1)")
+    parser.add_argument("--memory", type=int, default=512,
+                        help="megabytes each sandbox worker may allocate (default: 512)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="probe every function instead of reusing results cached by "
+                             "earlier runs")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="probe every function instead of reusing the results of "
+                             "functions with the same code analyzed earlier in the run")
+    parser.add_argument("--cache-dir", default=default_cache_dir,
+                        help="directory of the result cache (default: %s)" % default_cache_dir)
+    parser.add_argument("--stats", metavar="FILE", default=None,
+                        help="write a JSON report of the time spent in each stage, the probe "
+                             "outcomes and the slowest probes of every function to FILE")
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="run under cProfile and dump the profile to FILE (worker "
+                             "processes of --jobs are not profiled)")
+    parser.add_argument("--serve", metavar="SOCKET", default=None,
+                        help="answer requests on a Unix socket, keeping results in memory "
+                             "and analyzing the PATHs, and files requested, as they change")
+    parser.add_argument("--connect", metavar="SOCKET", default=None,
+                        help="ask the server listening on SOCKET for the results of the PATHs")
+    parser.add_argument("--queue", metavar="DIR", default=None,
+                        help="split the functions of the PATHs into shards in the shared "
+                             "directory DIR, for any number of --work runs to analyze")
+    parser.add_argument("--shard-size", type=int, default=default_shard_size,
+                        help="functions, or classes, per shard of --queue (default: %d)" %
+                             default_shard_size)
+    parser.add_argument("--work", metavar="DIR", default=None,
+                        help="analyze the shards of the queue in DIR, in --jobs worker "
+                             "processes, until every shard is done")
+    parser.add_argument("--lease", type=float, default=lease_seconds,
+                        help="seconds after which a shard whose worker stopped renewing "
+                             "its lease is analyzed again (default: %g)" % lease_seconds)
+    parser.add_argument("--merge", metavar="DIR", default=None,
+                        help="report the results of the finished queue in DIR, as an "
+                             "analysis of its PATHs would")
+    args = parser.parse_args(argv)
+    if not args.paths and args.serve is None and args.work is None and args.merge is None:
+        parser.error("at least one PATH is required")
+    return args
 
+def options_from_args(args):
+    """Returns a dictionary of analysis options from parsed command line arguments.
 
+    args - The namespace returned by parse_args.
+    """
+    return make_options({"sampling": args.sampling, "strength": args.strength,
+                         "budget": args.budget, "seed": args.seed,
+                         "adaptive": args.adaptive,
+                         "early_stop": args.early_stop, "confidence": args.confidence,
+                         "coverage": args.coverage, "propagate": args.propagate,
+                         "executor": "sandbox" if args.sandbox else "inline",
+                         "timeout": args.timeout, "memory": args.memory * 1024 ** 2})
 
 
+def main(args):
+    """Runs the analysis described by parsed command line arguments.
 
+    args - The namespace returned by parse_args.
+    """
+    import multiprocessing
+    missing = [p for p in args.paths if not os.path.exists(p)]
+    if missing:
+        print("Specified input does not exist: " + ", ".join(missing))
+        return
+    options = options_from_args(args)
+    if args.types:
+        try:
+            entries = [load_type(spec) for spec in args.types.split(",")]
+        except ValueError as e:
+            print(e)
+            return
+        for entry in entries:
+            register_type(entry)
+    if args.connect is not None:
+        records = request_analysis(args.connect, args.paths)
+        if args.format == "jsonl":
+            emit_jsonl(records)
+        else:
+            print_records(records, len(args.paths) > 1 or os.path.isdir(args.paths[0]))
+        return
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    if args.serve is not None:
+        server = AnalysisServer(args.serve, options, cache, args.static)
+        for filepath in discover_files(args.paths):
+            server.records(os.path.abspath(filepath))
+        server.serve_forever()
+        return
+    if args.queue is not None:
+        try:
+            shards = WorkQueue(args.queue).create(args.paths, options, args.static,
+                                                  args.types.split(",") if args.types else [],
+                                                  args.shard_size)
+        except ValueError as e:
+            print(e)
+            return
+        print("Wrote %d shards to %s." % (shards, args.queue))
+        return
+    if args.work is not None:
+        try:
+            WorkQueue(args.work).register_types()
+        except (ValueError, IOError, OSError) as e:
+            print(e)
+            return
+        if args.jobs > 1:
+            pool = multiprocessing.Pool(args.jobs)
+            try:
+                analyzed = sum(pool.map(_run_worker, [(args.work, cache, args.lease)] * args.jobs))
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            analyzed = run_worker(args.work, cache, args.lease)
+        print("Analyzed %d shards of %s." % (analyzed, args.work))
+        return
+    # not for workers, whose duplicates would depend on which shards each one analyzed
+    if not args.no_dedup:
+        cache = DedupCache(cache)
+    report = None if args.stats is None else StatsReport()
+    try:
+        if args.merge is not None:
+            queue = WorkQueue(args.merge)
+            try:
+                queue.register_types()
+                records = queue.merge(report)
+            except (ValueError, IOError, OSError) as e:
+                print(e)
+                return
+            if args.format == "jsonl":
+                emit_jsonl(records)
+            else:
+                print_records(records, len(queue.settings()["files"]) > 1)
+            return
+        if args.format == "jsonl":
+            emit_jsonl(analyze_paths(args.paths, options, args.jobs, cache, args.static, report))
+            return
+        pool = multiprocessing.Pool(args.jobs) if args.jobs > 1 and not args.static else None
+        try:
+            for filepath in discover_files(args.paths):
+                if len(args.paths) > 1 or os.path.isdir(args.paths[0]):
+                    print("="*80)
+                    print(filepath)
+                analyze(filepath, options=options, jobs=args.jobs, cache=cache, pool=pool,
+                        static=args.static, report=report)
+            if not args.no_dedup and cache.hits:
+                print("Deduplicated %d functions." % cache.hits)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    finally:
+        # written for interrupted runs too, covering the functions analyzed so far
+        if report is not None:
+            report.write(args.stats)
 
 
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    if args.profile is None:
+        main(args)
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(main, args)
+        finally:
+            profiler.dump_stats(args.profile)
@@ -2,13 +2,13 @@
 # # nocomment.py during testing
 
 def hello():
-    print "hello world"
+    print("hello world")
 
 def func_with_comments(a, b):
     c = 5/b
     d = a/5
     # test comment for removal
-    print a
+    print(a)
     '''
     test single quote multi-line comments
     '''
@@ -1,11 +1,36 @@
 # Runs the tests for nocomment.py on the Python source file test-target.py
 
+from __future__ import print_function
+
 import unittest
-import imp
+import json
+import os
+import shutil
 import sys
-import StringIO
+import tempfile
+import threading
+import time
 import nocomment
-import types
+
+try:
+    from StringIO import StringIO
+except ImportError: # Python 3
+    from io import StringIO
+
+NoneType = type(None)
+
+def without_profile(result):
+    """Returns a copy of a result without the profile in its statistics, which describes
+    one run rather than the analysis."""
+    stats = {k: v for (k, v) in result["stats"].items() if k != "profile"}
+    return dict(result, stats=stats)
+
+def without_seconds(record):
+    """Returns a copy of a record without the time spent and the profile, which describe
+    one run rather than the analysis."""
+    record = dict(without_profile(record))
+    record.pop("seconds")
+    return record
 
 class NoCommentTests(unittest.TestCase):
     """Performs tests on all module-level methods in nocomment.py"""
@@ -14,37 +39,262 @@ class NoCommentTests(unittest.TestCase):
         """Verifies that the function runs successfully. Random ordering of variables
         and types makes this nondeterministic. Printing to stdout is suppressed."""
         stdout = sys.stdout
-        temp_output = StringIO.StringIO()
+        temp_output = StringIO()
         sys.stdout = temp_output
         nocomment.analyze('./test-target.py')
         assert(len(temp_output.getvalue()) > 0)
         sys.stdout = stdout
 
+    def test_parallel_recommendations(self):
+        """Verifies that probing in worker processes, with functions split into shards,
+        gives the same recommendations as probing serially."""
+        mod = nocomment.load_source('mod', './test-target.py')
+        functions = nocomment.get_functions(mod)
+        threshold = nocomment.shard_threshold
+        nocomment.shard_threshold = 1
+        try:
+            parallel = list(nocomment.parallel_recommendations('./test-target.py', functions,
+                                                               None, 3))
+        finally:
+            nocomment.shard_threshold = threshold
+        serial = [(f, nocomment.recommend(f)) for f in functions]
+        self.assertEqual([(f.__name__, without_profile(r)) for (f, r) in serial],
+                         [(f.__name__, without_profile(r)) for (f, r, seconds) in parallel])
+
+    def test_propagated_results(self):
+        """Verifies that the call graph only links parameters passed straight on by calls
+        made on every run, that callees are ordered before callers, and that propagating
+        callee types cuts a wrapper's probes without changing its ranking."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "wrappers.py")
+            with open(path, "w") as f:
+                f.write("def base(s, n):\n    return s.upper() * n\n"
+                        "def wrapper(s, n):\n    return base(s, n=n)\n"
+                        "def maybe(a, b):\n    if a:\n        base(a, 2)\n    b = 3\n"
+                        "    return base(b, a)\n"
+                        "def ping(a):\n    return pong(a)\n"
+                        "def pong(a):\n    ping(a)\n    return a\n")
+            graph = nocomment.call_graph(path)
+            self.assertEqual([("base", {"s": "s", "n": "n"})], graph["wrapper"])
+            self.assertEqual([("base", {"a": "n"})], graph["maybe"])
+            components = nocomment.strongly_connected(graph)
+            self.assertEqual(["ping", "pong"], [c for c in components if len(c) > 1][0])
+            self.assertTrue(components.index(["base"]) < components.index(["wrapper"]))
+
+            functions = nocomment.get_functions(nocomment.load_source("wrappers", path))
+            plain = dict((f.__name__, r) for (f, r, s) in nocomment.file_results(path, functions))
+            propagated = dict((f.__name__, r) for (f, r, s) in
+                              nocomment.file_results(path, functions, {"propagate": True}))
+            self.assertEqual(plain["wrapper"]["types"], propagated["wrapper"]["types"])
+            self.assertTrue(propagated["wrapper"]["stats"]["probes"] * 10 <
+                            plain["wrapper"]["stats"]["probes"])
+            self.assertEqual(without_profile(plain["base"]), without_profile(propagated["base"]))
+        finally:
+            shutil.rmtree(directory)
+
     def test_get_functions(self):
         """Verifies the right number of module-level functions in the target source file."""
-        mod = imp.load_source('mod', './test-target.py')
+        mod = nocomment.load_source('mod', './test-target.py')
         self.assertEqual(5, len(nocomment.get_functions(mod)))
 
+    def test_class_results(self):
+        """Verifies that constructors are analyzed before methods, that methods are probed
+        on a bounded pool of instances without constructing one per probe, that mutated
+        instances are replaced, and that static and class methods are analyzed too."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "shapes.py")
+            with open(path, "w") as f:
+                f.write("class Counter(object):\n"
+                        "    created = 0\n"
+                        "    def __init__(self, start):\n"
+                        "        Counter.created += 1\n"
+                        "        self.total = start + 0\n"
+                        "    def add(self, amount):\n"
+                        "        self.total += amount\n"
+                        "        return self.total\n"
+                        "    def scaled(self, factor):\n"
+                        "        return self.total * factor\n"
+                        "    @staticmethod\n"
+                        "    def double(x):\n"
+                        "        return x * 2\n"
+                        "    @classmethod\n"
+                        "    def named(cls, name):\n"
+                        "        return name.upper()\n"
+                        "class Broken(object):\n"
+                        "    def __init__(self):\n"
+                        "        raise ValueError\n"
+                        "    def size(self, n):\n"
+                        "        return n + 1\n")
+            mod = nocomment.load_source("shapes", path)
+            self.assertEqual(["Broken", "Counter"],
+                             [c.__name__ for c in nocomment.get_classes(mod)])
+            targets = nocomment.class_targets(mod.Counter)
+            self.assertEqual(["Counter.__init__", "Counter.add", "Counter.double",
+                              "Counter.named", "Counter.scaled"], [t.__name__ for t in targets])
+            results = dict((t.__name__, r) for (t, r, s) in nocomment.class_results(targets))
+            self.assertEqual(["start"], results["Counter.__init__"]["params"])
+            self.assertEqual(["amount"], results["Counter.add"]["params"])
+
+            pool = targets[0].pool
+            self.assertEqual(nocomment.instance_pool_size, len(pool.instances))
+            constructions = mod.Counter.created - results["Counter.__init__"]["stats"]["probes"]
+            self.assertEqual(nocomment.instance_pool_size + pool.refreshed, constructions)
+            self.assertTrue(pool.refreshed > 0)
+            self.assertEqual([-1.1, -0.73, 0.0, 0.34], sorted(vars(i[0])["total"]
+                                                              for i in pool.instances))
+            factor = results["Counter.scaled"]["types"]["factor"]
+            self.assertTrue(int in [t for (t, n) in factor])
+            self.assertEqual([str],
+                             [t for (t, n) in results["Counter.named"]["returns"]])
+            self.assertTrue(results["Counter.double"]["types"]["x"])
+
+            broken = dict((t.__name__, r) for (t, r, s) in
+                          nocomment.class_results(nocomment.class_targets(mod.Broken)))
+            self.assertEqual(None, broken["Broken.size"]["types"])
+            self.assertEqual(0, broken["Broken.size"]["stats"]["probes"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_class_results_without_source(self):
+        """Verifies that methods generated without source code, as by namedtuple and
+        dataclasses, are reported without being probed instead of aborting the run."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "generated.py")
+            with open(path, "w") as f:
+                f.write("import collections\n"
+                        "Point = collections.namedtuple('Point', 'x y')\n")
+                if sys.version_info >= (3, 7):
+                    f.write("import dataclasses\n"
+                            "@dataclasses.dataclass\n"
+                            "class Pair(object):\n"
+                            "    first: int\n"
+                            "    second: int\n"
+                            "    def total(self):\n"
+                            "        return self.first + self.second\n")
+            records = list(nocomment.analyze_paths([path]))
+            by_name = dict((r["qualname"], r) for r in records)
+            self.assertEqual(None, by_name["Point.__new__"]["types"])
+            self.assertEqual(["x", "y"], by_name["Point.__new__"]["params"])
+            self.assertTrue(by_name["Point.__new__"]["stats"]["sampling"].startswith("no source"))
+            if sys.version_info >= (3, 7):
+                self.assertEqual(["first", "second"], by_name["Pair.__init__"]["params"])
+                self.assertTrue(by_name["Pair.__init__"]["stats"]["sampling"].startswith(
+                    "no source"))
+                self.assertEqual(0, by_name["Pair.total"]["stats"]["probes"])
+        finally:
+            shutil.rmtree(directory)
+
+    @unittest.skipIf(sys.version_info[0] > 2, "old-style classes need Python 2")
+    def test_old_style_classes(self):
+        """Verifies that the methods of an old-style class without __init__ are probed on
+        instances constructed without arguments."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "old.py")
+            with open(path, "w") as f:
+                f.write("class Old:\n"
+                        "    def size(self, n):\n"
+                        "        return n + 1\n")
+            records = list(nocomment.analyze_paths([path]))
+            self.assertEqual(["Old.size"], [r["qualname"] for r in records])
+            self.assertTrue("int" in [t for (t, n) in records[0]["types"]["n"]])
+        finally:
+            shutil.rmtree(directory)
+
+    @unittest.skipIf(sys.version_info[0] < 3, "keyword-only parameters need Python 3")
+    def test_keyword_only_parameters(self):
+        """Verifies that keyword-only parameters and parameters with defaults are probed,
+        by keyword and position respectively, in functions and constructors, that *args and **kwargs are not, and that
+        parsing the source finds the same parameters."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "keywords.py")
+            with open(path, "w") as f:
+                f.write("def scale(value, *rest, factor, offset=0, **options):\n"
+                        "    return value * factor + offset\n"
+                        "class K(object):\n"
+                        "    def __init__(self, a, *, b):\n"
+                        "        self.total = a + b\n"
+                        "    def get(self, c):\n"
+                        "        return self.total * c\n")
+            scale = nocomment.load_source("keywords", path).scale
+            lines, var_names = nocomment.function_source(scale)
+            self.assertEqual(["value", "factor", "offset"], var_names)
+            self.assertEqual(var_names, nocomment.static_functions(path)[0].var_names)
+            self.assertEqual(7, nocomment.probe_callable(scale)(2, 3, 1))
+            result = nocomment.recommend(scale)
+            for v in var_names:
+                self.assertTrue(set([int, float]) <= set(t for (t, n) in result["types"][v]))
+
+            # constructors too, for every instance of the pool
+            records = dict((r["qualname"], r) for r in nocomment.analyze_paths([path]))
+            self.assertEqual(["a", "b"], records["K.__init__"]["params"])
+            self.assertTrue(records["K.__init__"]["types"]["b"])
+            self.assertTrue(records["K.get"]["stats"]["probes"] > 0)
+            self.assertTrue(records["K.get"]["types"]["c"])
+        finally:
+            shutil.rmtree(directory)
+
     def test_generate_recommendation(self):
         """Verifies that the function runs successfully. Random ordering of variables
         and types make this nondeterministic."""
         def foo(a, b, c, d):
-            print b, c #, d
+            print(b, c) #, d
             a = d/a
             return a*b + c*d
         nocomment.generate_recommendation(foo)
 
     def test_stringify_type(self):
         """Verifies that the program's supported types have matching string descriptors."""
-        self.assertEqual("bool"  , nocomment.stringify_type(types.BooleanType))
-        self.assertEqual("int"   , nocomment.stringify_type(types.IntType))
-        self.assertEqual("float" , nocomment.stringify_type(types.FloatType))
-        self.assertEqual("string", nocomment.stringify_type(types.StringType))
-        self.assertEqual("tuple" , nocomment.stringify_type(types.TupleType))
-        self.assertEqual("list"  , nocomment.stringify_type(types.ListType))
-        self.assertEqual("dict"  , nocomment.stringify_type(types.DictType))
-        self.assertEqual("None"  , nocomment.stringify_type(types.NoneType))
-        self.assertEqual(None    , nocomment.stringify_type(types.LongType))
+        self.assertEqual("bool"  , nocomment.stringify_type(bool))
+        self.assertEqual("int"   , nocomment.stringify_type(int))
+        self.assertEqual("float" , nocomment.stringify_type(float))
+        self.assertEqual("string", nocomment.stringify_type(str))
+        self.assertEqual("tuple" , nocomment.stringify_type(tuple))
+        self.assertEqual("list"  , nocomment.stringify_type(list))
+        self.assertEqual("dict"  , nocomment.stringify_type(dict))
+        self.assertEqual("None"  , nocomment.stringify_type(NoneType))
+        self.assertEqual(None    , nocomment.stringify_type(complex))
+
+    def test_register_type(self):
+        """Verifies that registered types are named, sampled by weight, pruned by the usages
+        they support, narrowed by their methods and probed, and that re-registering a type
+        replaces its entry in place."""
+        saved = (list(nocomment.supported_types), dict(nocomment.type_registry))
+        # Python 3 ints are unbounded, so only Python 2 has long integers
+        longs = [nocomment.extra_types["long"].type] if "long" in nocomment.extra_types else []
+        try:
+            nocomment.register_type(nocomment.extra_types["set"])
+            for entry in longs:
+                nocomment.register_type(nocomment.extra_types["long"])
+                self.assertEqual("long", nocomment.stringify_type(entry))
+            nocomment.register_type(nocomment.extra_types["float-edges"])
+            self.assertEqual("set", nocomment.stringify_type(set))
+            self.assertEqual(2, nocomment.supported_types.index(float))
+            table = nocomment.sample_table()
+            self.assertEqual(2, len(table[set]))
+            self.assertEqual(10, len(table[float]))
+
+            var_types = {v: {t: 0 for t in nocomment.supported_types} for v in "abc"}
+            lines = ['def foo(a, b, c):',
+                     '    return (a | b) + c.bit_length()']
+            pruned = nocomment.prune(lines, var_types)
+            self.assertEqual(set([bool, int, set] + longs), set(pruned["a"]))
+            self.assertEqual(set([int] + longs), set(pruned["c"]))
+
+            def union(a, b):
+                return a | b
+            tp, returnarg = nocomment.infer_types(union, ['def union(a, b):',
+                                                          '    return a | b'], ['a', 'b'])
+            self.assertTrue(set in [t for (t, n) in returnarg])
+        finally:
+            nocomment.supported_types[:] = saved[0]
+            nocomment.type_registry.clear()
+            nocomment.type_registry.update(saved[1])
+        self.assertEqual(None, nocomment.stringify_type(set))
 
     def test_remove_comments(self):
         """Verifies that Python comments are removed from source text."""
@@ -62,11 +312,29 @@ class NoCommentTests(unittest.TestCase):
         expected = ['def func_with_comments(a, b):',
                     '    c = 5/b',
                     '    d = a/5',
-                    '    ',
+                    '',
                     '    print a',
-                    '     ',
-                    '    return a/b ']
+                    '', '', '', '', '', '',
+                    '    return a/b']
+        self.assertEqual(expected, nocomment.remove_comments(lines))
+
+        # code between docstrings and '#' inside strings are kept
+        lines = ['def f(a):\n',
+                 '    """first"""\n',
+                 '    b = "#%d" % a  # comment\n',
+                 "    '''second'''\n",
+                 '    return b\n']
+        expected = ['def f(a):', '', '    b = "#%d" % a', '', '    return b']
         self.assertEqual(expected, nocomment.remove_comments(lines))
+        self.assertEqual(['    foo(a,', '        b)'],
+                         nocomment.remove_comments(['    foo(a, # unbalanced\n', '        b)']))
+
+        # the body tokens read by prune are served from the tokens of remove_comments
+        cleaned = nocomment.remove_comments(lines)
+        tokens = nocomment._tokenize_lines(cleaned[1:])
+        self.assertTrue(tokens is nocomment._tokenize_lines(cleaned[1:]))
+        nocomment._token_cache.clear()
+        self.assertEqual(tokens, nocomment._tokenize_lines(cleaned[1:]))
 
     def test_find_zero_denominators(self):
         """Verifies that zero denominator variables are found."""
@@ -76,12 +344,37 @@ class NoCommentTests(unittest.TestCase):
         expected = ['b']
         self.assertEqual(set(expected), set(nocomment.find_zero_denominators(lines, ['a', 'b'])))
 
+        lines = ['def divide(a, b, c, d, bar, e):',
+                 '    x = a / bar + "%s" % e',
+                 '    q, r = divmod(a, -c)',
+                 '    alias = b if a else 1',
+                 '    if x:',
+                 '        a //= alias',
+                 '    d = 2',
+                 '    return x % d + math.fmod(a, (e))']
+        self.assertEqual(['b', 'c', 'bar', 'e'],
+                         nocomment.find_zero_denominators(lines, ['a', 'b', 'c', 'd', 'bar', 'e']))
+
+    def test_zero_divisions(self):
+        """Verifies that the parameters probes divided by zero are reported, and only
+        those."""
+        def ratio(a, b, c):
+            d = b
+            x = a % c if c else 0
+            return a / d + x
+        for options in [None, {"executor": "sandbox"}]:
+            result = nocomment.recommend(ratio, options)
+            self.assertEqual(["b", "c"], result["divisors"])
+            self.assertEqual(["b"], result["zero_divisions"])
+            self.assertTrue("b (divisor, raised ZeroDivisionError)" in
+                            nocomment.format_recommendation(result))
+
     def test_prune(self):
         """Verifies that a variable's set of possible types are pruned of impossible
         ones based on source code analysis."""
-        all_types = {types.BooleanType: 0, types.IntType: 0, types.FloatType: 0,
-                    types.StringType: 0, types.TupleType: 0, types.ListType: 0,
-                    types.DictType: 0, types.NoneType: 0}
+        all_types = {bool: 0, int: 0, float: 0,
+                    str: 0, tuple: 0, list: 0,
+                    dict: 0, NoneType: 0}
         var_types = {"a": all_types.copy(), "b": all_types.copy(), "c": all_types.copy()}
         lines = ['def foo(a, b, c):',
                  '    d = a * b,',
@@ -89,47 +382,196 @@ class NoCommentTests(unittest.TestCase):
                  '    d = b - a',
                  '    a = d/a',
                  '    return a*b + c[0]*d']
-        expected = {"a": {types.BooleanType: 0, types.IntType: 0, types.FloatType: 0,
-                          types.StringType: 0, types.TupleType: 0, types.ListType: 0,
+        expected = {"a": {bool: 0, int: 0, float: 0,
+                          str: 0, tuple: 0, list: 0,
                          },
-                    "b": {types.BooleanType: 0, types.IntType: 0, types.FloatType: 0},
-                    "c": {types.StringType: 0, types.TupleType: 0, types.ListType: 0,
-                          types.DictType: 0}
+                    "b": {bool: 0, int: 0, float: 0},
+                    "c": {str: 0, tuple: 0, list: 0,
+                          dict: 0}
                    }
         self.assertEqual(expected, nocomment.prune(lines, var_types))
 
     def test_prune_2(self):
         """Verifies that the pruning process does not progress past reassignments."""
-        var_types = {"a": {types.BooleanType: 0, types.DictType: 0, types.ListType: 0}}
+        var_types = {"a": {bool: 0, dict: 0, list: 0}}
         lines = ['def foo(a):',
                  '    b = a[0]',
                  '    c = a*3',
                  '    a = e',
                  '    d = a - 4']
-        expected = {"a": {types.ListType: 0}}
+        expected = {"a": {list: 0}}
+        self.assertEqual(expected, nocomment.prune(lines, var_types))
+
+    def test_prune_3(self):
+        """Verifies that pruning matches whole parameter names rather than substrings,
+        and ignores names that only appear inside string literals."""
+        var_types = {"a": {int: 0, list: 0, NoneType: 0}}
+        lines = ['def foo(a):',
+                 '    b = ba[0] + len(alpha)',
+                 '    c = "a()" + self.a',
+                 '    return a.append(1)']
+        expected = {"a": {list: 0}}
         self.assertEqual(expected, nocomment.prune(lines, var_types))
 
     def test_infer_types(self):
         """Verifies that the function runs successfully. Random ordering of variables
         and types make this nondeterministic."""
         def foo(a, b, c, d):
-            print b, c #, d
+            print(b, c) #, d
             a = d/a
             return a*b + c*d
         lines = ['def foo(a, b, c, d):',
-                 '    print b, c #, d',
+                 '    print(b, c) #, d',
                  '    a = d/a',
                  '    return a*b + c*d']
         nocomment.infer_types(foo, lines, ['a', 'b', 'c', 'd'])
 
+    def test_infer_types_adaptive(self):
+        """Verifies that a type whose first probe fails with a TypeError naming it is
+        eliminated without running its remaining sample values."""
+        def foo(a):
+            return abs(a) + 1
+        lines = ['def foo(a):',
+                 '    return abs(a) + 1']
+        stats = {}
+        tp, returnarg = nocomment.infer_types(foo, lines, ['a'], options={"adaptive": True},
+                                              stats=stats)
+        self.assertEqual([float, int, bool],
+                         [t for (t, n) in tp['a']])
+        self.assertEqual(["string", "tuple", "list", "dict", "None"], stats["eliminated"]["a"])
+        self.assertEqual(11 + 5, stats["probes"])
+        nocomment.infer_types(foo, lines, ['a'], options={"adaptive": False}, stats=stats)
+        self.assertEqual(32, stats["probes"])
+
+    def test_infer_types_adaptive_operands(self):
+        """Verifies that a failure on a line using two parameters eliminates neither, so
+        that adaptive runs rank types like runs that probe everything."""
+        def foo(a, b):
+            return a + b
+        lines = ['def foo(a, b):',
+                 '    return a + b']
+        for options in [{}, {"early_stop": 50}, {"sampling": "random", "budget": 50}]:
+            adaptive = nocomment.infer_types(foo, lines, ['a', 'b'],
+                                             options=dict(options, adaptive=True))
+            plain = nocomment.infer_types(foo, lines, ['a', 'b'],
+                                          options=dict(options, adaptive=False))
+            self.assertEqual(plain, adaptive)
+
+    def test_failure_classifier(self):
+        """Verifies that a failure is blamed on the only parameter of the failing line,
+        whichever quotes the message puts around its type, and never on a parameter of a
+        line using another one."""
+        def suffix(a):
+            return "x" + a
+        def join(a, b):
+            return "x" + a + b
+        classify = nocomment.failure_classifier(suffix, ['def suffix(a):',
+                                                         '    return "x" + a'], ['a'])
+        try:
+            suffix(1)
+        except TypeError as e:
+            # 'must be str, not int' on Python 3.6, without quotes to match
+            quoted = '"int"' in str(e) or "'int'" in str(e)
+            self.assertEqual(0 if quoted else None, classify((1,), e, sys.exc_info()[2]))
+        classify = nocomment.failure_classifier(join, ['def join(a, b):',
+                                                       '    return "x" + a + b'], ['a', 'b'])
+        try:
+            join("y", (1,))
+        except TypeError as e:
+            self.assertEqual(None, classify(("y", (1,)), e, sys.exc_info()[2]))
+
+    def test_infer_types_early_stop(self):
+        """Verifies that sequential probing stops before exhausting the probe space once
+        the rankings settle, and reports how many probes it used."""
+        def foo(a, b, c):
+            return len(a) + b
+        lines = ['def foo(a, b, c):',
+                 '    return len(a) + b']
+        stats = {}
+        tp, returnarg = nocomment.infer_types(foo, lines, ['a', 'b', 'c'],
+                                              options={"early_stop": 200}, stats=stats)
+        self.assertTrue(stats["stopped_early"])
+        self.assertTrue(stats["probes"] < stats["space"])
+        self.assertEqual(set([int, float]), set(t for (t, n) in returnarg))
+        self.assertTrue("of %d probes" % stats["space"] in stats["sampling"])
+
+    def test_infer_types_coverage(self):
+        """Verifies that coverage-guided probing stops once new probes reach no new lines,
+        well before the probe space is exhausted, having reached every kind of return."""
+        def foo(a, b, c):
+            if a is None:
+                return 0
+            if isinstance(a, str):
+                return a * 2
+            if isinstance(c, dict):
+                return len(c)
+            return [a, b]
+        lines, var_names = nocomment.function_source(foo)
+        stats = {}
+        tp, returnarg = nocomment.infer_types(foo, lines, var_names,
+                                              options={"coverage": 30}, stats=stats)
+        self.assertTrue(stats["saturated"])
+        self.assertTrue(stats["probes"] < stats["space"] / 10)
+        self.assertEqual(set([int, str, list]),
+                         set(t for (t, n) in returnarg))
+        self.assertTrue("coverage-guided" in stats["sampling"])
+
+    def test_infer_types_threads(self):
+        """Verifies that infer_types can run in several threads at once, silencing only
+        their own output, and that the streams are restored afterwards, even after a
+        silenced section is interrupted."""
+        from multiprocessing.pool import ThreadPool
+        def foo(a, b):
+            print(a, b)
+            return a + b
+        lines = ['def foo(a, b):',
+                 '    print(a, b)',
+                 '    return a + b']
+        stdout, stderr = sys.stdout, sys.stderr
+        expected = nocomment.infer_types(foo, lines, ['a', 'b'])
+        pool = ThreadPool(4)
+        try:
+            results = pool.map(lambda n: nocomment.infer_types(foo, lines, ['a', 'b']), range(8))
+        finally:
+            pool.close()
+        self.assertEqual([expected] * 8, results)
+        self.assertTrue(sys.stdout is stdout and sys.stderr is stderr)
+
+        temp_output = StringIO()
+        sys.stdout = temp_output
+        try:
+            with nocomment.silence_output():
+                print("silenced")
+                thread = threading.Thread(target=lambda: sys.stdout.write("kept"))
+                thread.start()
+                thread.join()
+                raise KeyboardInterrupt
+        except KeyboardInterrupt:
+            pass
+        finally:
+            restored = sys.stdout
+            sys.stdout = stdout
+        self.assertTrue(restored is temp_output)
+        self.assertEqual("kept", temp_output.getvalue())
+
+    def test_ranking_settled(self):
+        """Verifies that rankings are settled when no gap can close in the remaining
+        probes, or when the gaps exceed the confidence bound, but not on close counts."""
+        var_types = {'a': {int: 50, str: 10}}
+        return_types = {int: 60}
+        self.assertTrue(nocomment.ranking_settled(['a'], var_types, return_types, 60, 5, 0.05))
+        self.assertTrue(nocomment.ranking_settled(['a'], var_types, return_types, 60, 10000, 0.05))
+        var_types = {'a': {int: 31, str: 29}}
+        self.assertFalse(nocomment.ranking_settled(['a'], var_types, return_types, 60, 10000, 0.05))
+
     def test_sample_type_values(self):
         """Verifies that all permutations of sample type values are provided."""
         p = nocomment.sample_type_values(['a', 'b', 'c'],
                                          {
-                                             'a' : {types.BooleanType: 1},
-                                             'b' : {types.IntType: 0,
-                                                    types.FloatType: 2},
-                                             'c' : {types.FloatType: 3}
+                                             'a' : {bool: 1},
+                                             'b' : {int: 0,
+                                                    float: 2},
+                                             'c' : {float: 3}
                                          })
         expected = [(True, -100, -1.1), (True, -100, -0.73), (True, -100, 0.0),
                     (True, -100, 0.34), (True, -100, 2.999), (True, 1, -1.1),
@@ -197,5 +639,382 @@ class NoCommentTests(unittest.TestCase):
                     (True, 2.999, 0.34), (True, 2.999, 2.999)]
         self.assertEqual(set(expected), set(p))
 
+    def test_sample_type_values_covering(self):
+        """Verifies that a pairwise covering array uses every (variable, type) pair and
+        every pair of types for any two variables, in far fewer probes than exhaustive."""
+        var_names = ['a', 'b', 'c', 'd']
+        var_types = {v: {int: 0, str: 0, NoneType: 0}
+                     for v in var_names}
+        rows = list(nocomment.sample_type_values(var_names, var_types, "covering"))
+        covered = set()
+        for row in rows:
+            for i in range(len(var_names)):
+                for j in range(i + 1, len(var_names)):
+                    covered.add((i, j, type(row[i]), type(row[j])))
+        self.assertEqual(6 * 3 * 3, len(covered))
+        self.assertTrue(len(rows) < 15 ** 4 / 100)
+        for ndx in range(len(var_names)):
+            self.assertEqual(set([-100, 0, 1, 100, "", "\n", " ", "Hello", "H3llo\n W0rld!", None]),
+                             set(row[ndx] for row in rows))
+
+    def test_sample_type_values_random(self):
+        """Verifies that random sampling respects its budget, never repeats a combination,
+        is reproducible for a given seed and handles products larger than sys.maxsize."""
+        var_types = {'a': {str: 0, float: 0},
+                     'b': {str: 0, float: 0}}
+        first = nocomment.sample_type_values(['a', 'b'], var_types, "random", budget=30, seed=7)
+        second = nocomment.sample_type_values(['a', 'b'], var_types, "random", budget=30, seed=7)
+        self.assertEqual(30, len(first))
+        self.assertEqual(first, second)
+        self.assertEqual(30, len(set(map(repr, first))))
+
+        # products too large to index with sample are drawn from too
+        names = ['v%d' % i for i in range(30)]
+        rows = nocomment.sample_type_values(names, dict((n, {str: 0, float: 0}) for n in names),
+                                            "random", budget=30, seed=7)
+        self.assertEqual(30, len(set(map(repr, rows))))
+        self.assertTrue(all(len(row) == 30 for row in rows))
+
+    def test_fresh_arguments(self):
+        """Verifies that every probe gets its own copy of mutable sample values, so that a
+        target mutating its arguments does not change later probes, and that immutable
+        values are reused."""
+        def foo(a):
+            a.append(0)
+            return len(a)
+        lines = ['def foo(a):',
+                 '    a.append(0)',
+                 '    return len(a)']
+        tp, returnarg = nocomment.infer_types(foo, lines, ['a'], options={"adaptive": False})
+        self.assertEqual([(int, 5)], returnarg)
+        template = (3, "x", (1, 2), ([1], 2), {"a": [1]})
+        fresh = nocomment.fresh_arguments(template)
+        self.assertEqual(template, fresh)
+        self.assertTrue(all(a is b for (a, b) in zip(template[:3], fresh[:3])))
+        self.assertFalse(fresh[3][0] is template[3][0])
+        self.assertFalse(fresh[4]["a"] is template[4]["a"])
+        executor = nocomment.InlineExecutor(foo)
+        lists = [([1],)] * 3
+        executor.run(lists)
+        self.assertEqual([1], lists[0][0])
+        for values in nocomment.sample_table().values():
+            self.assertEqual(len(values), len(set(map(repr, values))))
+
+    def test_sandbox_executor(self):
+        """Verifies that sandboxed probes that stall are timed out, probes that kill their
+        worker are reported as crashed, and the worker is replaced for later probes."""
+        def foo(a):
+            while a is True:
+                pass
+            if a is None:
+                os._exit(1)
+            return a
+        executor = nocomment.SandboxExecutor(foo, 0.2, None)
+        try:
+            results = executor.run([(1,), (True,), ("x",), (None,), ([],)])
+        finally:
+            executor.close()
+        self.assertEqual([("ok", int, None), ("timeout", None, None),
+                          ("ok", str, None), ("crashed", None, None),
+                          ("ok", list, None)], results)
+
+    def test_stats_report(self):
+        """Verifies that each stage of a function's analysis is timed, that probe outcomes
+        and pruned pairs are counted, and that the report sums them over the run."""
+        def foo(a):
+            return len(a)
+        stats = nocomment.recommend(foo)["stats"]
+        self.assertEqual(sorted(nocomment.profile_stages),
+                         sorted(stats["profile"]["timings"]))
+        self.assertEqual(nocomment.slowest_probes, len(stats["profile"]["slowest"]))
+        durations = [t for (t, args) in stats["profile"]["slowest"]]
+        self.assertEqual(sorted(durations, reverse=True), durations)
+        self.assertEqual(4, stats["pruned"]) # bool, int, float and None
+        self.assertEqual(stats["probes"], sum(stats["outcomes"].values()))
+
+        report = nocomment.StatsReport()
+        records = list(nocomment.analyze_paths(["./test-target.py"], report=report))
+        data = json.loads(json.dumps(report.to_json()))
+        self.assertEqual(1, data["totals"]["files"])
+        self.assertEqual(len(records), len(data["functions"]))
+        self.assertEqual(sum(r["stats"].get("probes", 0) for r in records),
+                         sum(data["totals"]["outcomes"].values()))
+        self.assertTrue(data["totals"]["timings"]["import"] > 0)
+        self.assertTrue(all(p[1] == "./test-target.py" for p in data["slowest"]))
+
+    def test_result_cache(self):
+        """Verifies that cached results round-trip, that the key depends on the code, the
+        callees and the options, and that the least recently used entries are evicted first."""
+        def foo(a):
+            return a + 1
+        def bar(a):
+            return a - 1
+        directory = tempfile.mkdtemp()
+        try:
+            cache = nocomment.ResultCache(directory)
+            lines, var_names = nocomment.function_source(foo)
+            key = cache.key(foo, lines, None)
+            self.assertNotEqual(key, cache.key(bar, lines, None))
+            self.assertNotEqual(key, cache.key(foo, lines, {"sampling": "covering"}))
+            self.assertEqual(None, cache.get(key))
+            result = nocomment.recommend(foo, cache=cache)
+            self.assertTrue("profile" in result["stats"])
+            result = without_profile(result)
+            self.assertEqual(result, cache.get(key))
+            self.assertEqual(result, nocomment.recommend(foo, cache=cache))
+
+            # replacing a type's entry under the same name misses the cache
+            saved = dict(nocomment.type_registry)
+            try:
+                nocomment.register_type(nocomment.extra_types["float-edges"])
+                self.assertNotEqual(key, cache.key(foo, lines, None))
+                edges = nocomment.recommend(foo, cache=cache)
+                self.assertEqual(without_profile(nocomment.recommend(foo)),
+                                 without_profile(edges))
+            finally:
+                nocomment.type_registry.update(saved)
+            self.assertEqual(key, cache.key(foo, lines, None))
+
+            # editing a callee misses the cache for its caller, whose source is unchanged
+            path = os.path.join(directory, "m.py")
+            results = []
+            for body in ["x.upper()", "x + 1"]:
+                with open(path, "w") as f:
+                    f.write("def helper(x):\n    return %s\n"
+                            "def f(a):\n    return helper(a)\n" % body)
+                mod = nocomment.load_source("m%d" % len(results), path)
+                results.append(nocomment.recommend(mod.f, cache=cache))
+            self.assertEqual([str], [t for (t, n) in results[0]["types"]["a"]])
+            self.assertTrue(int in [t for (t, n) in results[1]["types"]["a"]])
+
+            small = nocomment.ResultCache(directory, max_bytes=1)
+            small.put("ab" + "0" * 38, result)
+            self.assertEqual(None, small.get(key))
+            self.assertEqual(result, small.get("ab" + "0" * 38))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_dedup_cache(self):
+        """Verifies that functions with the same code are analyzed once across files, with
+        the same results whatever their names, that functions reading different globals are
+        not, that the keys do not vary between runs, and that the cache stays bounded."""
+        directory = tempfile.mkdtemp()
+        try:
+            for (name, scale) in [("a.py", 2), ("b.py", 2), ("c.py", "'x'")]:
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write("SCALE = %s\n" % scale)
+                    f.write("def %s(n, m):\n    return n * SCALE - m\n" % name[0])
+                    f.write("def %s2(n, m):\n    # %s\n    return n * SCALE - m\n" %
+                            (name[0], name))
+            for jobs in [1, 2]:
+                cache = nocomment.DedupCache()
+                report = nocomment.StatsReport()
+                records = list(nocomment.analyze_paths([directory], jobs=jobs, cache=cache,
+                                                       report=report))
+                origin = os.path.join(directory, "a.py") + ":a"
+                self.assertEqual([None, origin, origin, origin, None, "%s:c" % records[4]["file"]],
+                                 [r["stats"].get("duplicate_of") for r in records])
+                for r in records[1:4]:
+                    self.assertEqual(r["types"], records[0]["types"])
+                    self.assertEqual(r["returns"], records[0]["returns"])
+                self.assertNotEqual(records[4]["types"], records[0]["types"])
+                self.assertEqual(4, cache.hits)
+                self.assertEqual(4, report.to_json()["totals"]["deduplicated"])
+
+            # a cache remembering one code at a time forgets a's once it meets c's
+            size = nocomment.dedup_cache_size
+            nocomment.dedup_cache_size = 1
+            try:
+                cache = nocomment.DedupCache()
+                bounded = list(nocomment.analyze_paths([directory], cache=cache))
+            finally:
+                nocomment.dedup_cache_size = size
+            self.assertEqual([r["stats"].get("duplicate_of") for r in records],
+                             [r["stats"].get("duplicate_of") for r in bounded])
+            self.assertEqual(["%s:c" % records[4]["file"]], list(cache.origins.values()))
+            self.assertEqual(1, len(cache.used) + len(cache.entries))
+            cache.clear()
+            self.assertEqual(({}, {}, {}), (cache.origins, cache.entries, cache.used))
+
+            # the keys of functions reading locks, instances and classes of their own
+            # module are the same in every run, and change with the classes' code
+            path = os.path.join(directory, "locked.py")
+            fingerprints = []
+            for (ndx, value) in enumerate([1, 1, 2]):
+                with open(path, "w") as f:
+                    f.write("import threading\nLOCK = threading.Lock()\n"
+                            "class Box(object):\n    def get(self):\n        return %d\n"
+                            "BOX = Box()\n"
+                            "def g(a):\n    with LOCK:\n        return Box, BOX, a + 1\n"
+                            % value)
+                name = "_nocomment_target_%d" % ndx
+                try:
+                    mod = nocomment.load_source(name, path)
+                    fingerprints.append(nocomment.global_fingerprint(mod.g))
+                finally:
+                    sys.modules.pop(name, None) # as load_modules does
+            self.assertEqual(fingerprints[0], fingerprints[1])
+            self.assertNotEqual(fingerprints[0], fingerprints[2])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_analysis_server(self):
+        """Verifies that a server answers like analyze_paths, answers repeated requests
+        without analyzing again, and analyzes a file again as soon as it changes, probing
+        only the functions that changed or call a function that changed."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "served.py")
+            with open(path, "w") as f:
+                f.write("def first(a):\n    return a + 1\n"
+                        "def second(b):\n    return len(b)\n"
+                        "def third(c):\n    return second(c)\n")
+            socket_path = os.path.join(directory, "nocomment.sock")
+            server = nocomment.AnalysisServer(socket_path, interval=0.05)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                while not os.path.exists(socket_path):
+                    time.sleep(0.01)
+                records = list(nocomment.request_analysis(socket_path, [directory]))
+                expected = list(nocomment.analyze_paths([path]))
+                self.assertEqual([without_seconds(r) for r in expected],
+                                 [without_seconds(r) for r in records])
+                self.assertEqual(records, list(nocomment.request_analysis(socket_path, [path])))
+                self.assertEqual(1, server.loads)
+
+                with open(path, "w") as f:
+                    f.write("def first(a):\n    return a + 1\n"
+                            "def second(b):\n    return b.upper()\n"
+                            "def third(c):\n    return second(c)\n")
+                stamp = os.stat(path).st_mtime + 10
+                os.utime(path, (stamp, stamp))
+                while server.loads < 2:
+                    time.sleep(0.01)
+                records = list(nocomment.request_analysis(socket_path, [path]))
+                self.assertEqual(1, server.files[path]["cache"].hits)
+                self.assertEqual([["string", 5]], records[1]["types"]["b"])
+                # third's source is unchanged, but the function it calls changed
+                self.assertEqual([["string", 5]], records[2]["types"]["c"])
+                self.assertEqual(2, server.loads)
+            finally:
+                nocomment.stop_server(socket_path)
+                thread.join()
+            self.assertFalse(os.path.exists(socket_path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_work_queue(self):
+        """Verifies that a worker analyzes every shard of a queue, claiming the shard of a
+        worker that died once its lease expires, and that the merged records are those of
+        analyze_paths."""
+        directory = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(directory, "src"))
+            with open(os.path.join(directory, "src", "a.py"), "w") as f:
+                f.write("def inc(n):\n    return n + 1\n"
+                        "class Box(object):\n    def __init__(self, n):\n        self.n = n + 0\n"
+                        "    def get(self):\n        return self.n\n"
+                        "def length(s):\n    return len(s)\n")
+            with open(os.path.join(directory, "src", "b.py"), "w") as f:
+                f.write("def neg(n):\n    return -n\n")
+            path = os.path.join(directory, "queue")
+            queue = nocomment.WorkQueue(path, lease=0.2)
+            self.assertEqual(4, queue.create([os.path.join(directory, "src")], shard_size=1))
+            self.assertEqual(["inc", "length", "Box", "neg"], [u[1] for u in queue.settings()["units"]])
+            self.assertRaises(ValueError, queue.create, [directory])
+            self.assertEqual(0, queue.claim("dead"))
+            self.assertEqual(1, queue.claim("alive"))
+            queue.release(1)
+            self.assertRaises(ValueError, queue.merge)
+
+            self.assertEqual(4, nocomment.run_worker(path, lease=0.2))
+            self.assertEqual([], queue.pending())
+            self.assertEqual([], os.listdir(os.path.join(path, "leases")))
+            report = nocomment.StatsReport()
+            merged = list(queue.merge(report))
+            expected = list(nocomment.analyze_paths([os.path.join(directory, "src")]))
+            self.assertEqual(["inc", "length", "Box.__init__", "Box.get", "neg"],
+                             [r["qualname"] for r in merged])
+            for (m, e) in zip(merged, expected):
+                for r in (m, e):
+                    del r["seconds"]
+                    del r["stats"]["profile"]
+                self.assertEqual(e, m)
+            self.assertEqual(2, len(report.files))
+            self.assertEqual(5, report.to_json()["totals"]["functions"])
+
+            # results files are read before merge returns
+            results = os.path.join(path, "results", "%06d.json" % 3)
+            os.remove(results)
+            os.mkdir(results)
+            self.assertRaises((IOError, OSError), queue.merge)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_static_functions(self):
+        """Verifies that parsing finds the same functions, source lines and parameters as
+        importing, decorated or not, and that static recommendations rank the types that survive pruning."""
+        static = nocomment.static_functions("./test-target.py")
+        functions = nocomment.get_functions(nocomment.load_source("mod", "./test-target.py"))
+        self.assertEqual([f.__name__ for f in functions], [f.__name__ for f in static])
+        for (f, s) in zip(functions, static):
+            self.assertEqual(nocomment.function_source(f), (s.lines, s.var_names))
+            self.assertEqual(f.__doc__, s.__doc__)
+
+        result = nocomment.static_recommendation(static[0])
+        self.assertEqual(["a", "b"], result["params"])
+        self.assertEqual(["b"], result["divisors"])
+        self.assertEqual([str],
+                         [t for (t, n) in nocomment.static_recommendation(static[2])["returns"]])
+        self.assertEqual([(NoneType, 1)], nocomment.static_recommendation(static[3])["returns"])
+        self.assertEqual(None, nocomment.static_recommendation(static[4])["types"])
+
+        # a function followed by a decorated one ends before the decorator
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "decorated.py")
+            with open(path, "w") as f:
+                f.write("def a(x, y):\n    return x / y\n\n"
+                        "def cached(f):\n    return f\n\n"
+                        "@cached\n@cached\ndef b(n):\n    return n + 1\n")
+            static = nocomment.static_functions(path)
+            functions = nocomment.get_functions(nocomment.load_source("decorated", path))
+            for (f, s) in zip(functions, static):
+                self.assertEqual(nocomment.function_source(f), (s.lines, s.var_names))
+            self.assertEqual(["y"], nocomment.static_recommendation(static[0])["divisors"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_analyze_paths(self):
+        """Verifies that directories are searched recursively, that one record is generated
+        per function in file order, and that files which cannot be imported are reported."""
+        directory = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(directory, "sub"))
+            with open(os.path.join(directory, "a.py"), "w") as f:
+                f.write("def inc(n):\n    return n + 1\n")
+            with open(os.path.join(directory, "sub", "b.py"), "w") as f:
+                f.write("raise ImportError('missing dependency')\ndef neg(n):\n    return -n\n")
+            with open(os.path.join(directory, "sub", "c.py"), "w") as f:
+                f.write("def broken(:\n")
+            records = list(nocomment.analyze_paths([directory]))
+            self.assertEqual(3, len(records))
+            self.assertEqual(os.path.join(directory, "a.py"), records[0]["file"])
+            self.assertEqual("inc", records[0]["qualname"])
+            self.assertEqual(["n"], records[0]["params"])
+            self.assertEqual(os.path.join(directory, "sub", "b.py"), records[1]["file"])
+            self.assertEqual("neg", records[1]["qualname"])
+            self.assertEqual("ImportError: missing dependency", records[1]["import_error"])
+            self.assertEqual(0, records[1]["stats"]["probes"])
+            self.assertEqual(os.path.join(directory, "sub", "c.py"), records[2]["file"])
+            self.assertTrue(records[2]["error"].startswith("SyntaxError"))
+
+            out = StringIO()
+            nocomment.emit_jsonl(records[:1], out)
+            self.assertEqual(records[:1], [json.loads(line) for line in out.getvalue().splitlines()])
+        finally:
+            shutil.rmtree(directory)
+
 if __name__ == '__main__':
     unittest.main()